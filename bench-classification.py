@@ -0,0 +1,154 @@
+"""Measure SUMMARY classification cost per event over a mixed feed.
+
+Usage:
+    python bench-classification.py [--events 100000] [--format freetobook] [--repeat 5] [--json]
+
+Builds a feed-like mix of coded reservations, code-less reservations, close-outs
+and summaries in other formats, then times the compiled single-pass classifier
+against a baseline: for Freetobook, the two inline re.match calls it replaced;
+for other formats, trying each rule's pattern in turn. Reports the best of
+--repeat runs in nanoseconds per event, along with the per-rule hit counts and
+how many events were left unclassified.
+"""
+import argparse
+import importlib.util
+import json
+import pathlib
+import random
+import re
+import sys
+import time
+
+_MODULE_PATH = pathlib.Path(__file__).resolve().parent / "format-calendars.py"
+_spec = importlib.util.spec_from_file_location("format_calendars", _MODULE_PATH)
+if _spec is None or _spec.loader is None:
+    raise ImportError(f"Unable to load module from {_MODULE_PATH}")
+calendars = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(calendars)
+
+
+# (weight, maker, rule expected to match under each format; None for unclassified)
+SHAPES = [
+    (60, lambda i, unit: (f"{unit}:WTB{i:07X}", f"{70000000 + i}@freetobook.com"),
+     {"freetobook": "unit-and-code", "generic": "unit-and-code"}),
+    (10, lambda i, unit: (unit, f"CTB{i:07X}@freetobook.com"),
+     {"freetobook": "unit-with-ctb-uid", "generic": None}),
+    (15, lambda i, unit: (f"Closed - {unit}", f"{70000000 + i}@freetobook.com"),
+     {"freetobook": "unit-close-out", "generic": "block"}),
+    (5, lambda i, unit: (unit, f"{70000000 + i}@freetobook.com"),
+     {"freetobook": "unit-close-out", "generic": None}),
+    (5, lambda i, unit: (f"Reservation HM{i:08d} - {unit}", f"{i}@example.com"),
+     {"freetobook": None, "generic": "code-then-unit"}),
+    (5, lambda i, unit: (f"Owner stay {unit}", f"{i}@example.com"),
+     {"freetobook": None, "generic": "block"}),
+]
+
+
+def mixed_summaries(event_count, seed=0):
+    """(summary, uid) pairs in roughly the proportions a busy feed has."""
+    rng = random.Random(seed)
+    units = calendars.KNOWN_PROPERTIES
+    weights = [weight for weight, _, _ in SHAPES]
+    makers = [maker for _, maker, _ in SHAPES]
+    return [rng.choices(makers, weights)[0](i, units[i % len(units)]) for i in range(event_count)]
+
+
+def check_shapes(source_format):
+    """Raise ValueError unless every shape, for every unit, hits the rule SHAPES expects.
+
+    Keeps the mix honest: a shape that silently falls through to another rule (or to
+    unclassified) would leave the branch it stands for out of the timings.
+    """
+    classifier = calendars.SummaryClassifier(source_format, calendars.CLASSIFICATION_RULES[source_format])
+    for _, maker, expected in SHAPES:
+        for unit in calendars.KNOWN_PROPERTIES:
+            summary, uid = maker(1, unit)
+            rule, _ = classifier.match(summary, uid)
+            name = None if rule is None else classifier.rules[rule]['name']
+            if source_format in expected and name != expected[source_format]:
+                raise ValueError(f"{summary!r} ({uid}) classified as {name!r} under {source_format}, "
+                                 f"expected {expected[source_format]!r}")
+
+
+def classify_freetobook_inline(summary, uid):
+    """Baseline: the inline checks parse_source_reservation() used to make for every event."""
+    full_match = re.match(r'(Apartment|Room) ([\w\s\-]+):([\w\d]+)', summary)
+    if full_match:
+        return summary.split(':')[0].strip(), full_match.group(3)
+    loose_match = re.match(r'(Apartment|Room) ([\w\s\-]+)', summary)
+    if loose_match and "CTB" in uid:
+        return summary.split(':')[0].strip(), uid.split(":")[-1] if ":" in uid else uid
+    return None
+
+
+def classify_sequentially(classifier, summary, uid):
+    """Baseline for other formats: one re.match per rule until one applies."""
+    for rule, pattern in zip(classifier.rules, classifier.patterns):
+        match = pattern.match(summary)
+        if match is not None and (not rule.get('uid_contains') or rule['uid_contains'] in uid):
+            groups = match.groupdict()
+            unit = (groups.get('unit') or summary.split(':')[0]).strip()
+            code = groups.get('code') or (uid.split(":")[-1] if ":" in uid else uid)
+            return unit, code, rule.get('kind', 'reservation')
+    return None
+
+
+def best_ns_per_event(fn, events, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter_ns()
+        for summary, uid in events:
+            fn(summary, uid)
+        elapsed = time.perf_counter_ns() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best / len(events), 1)
+
+
+def run(events=100000, source_format="freetobook", repeat=5, seed=0):
+    check_shapes(source_format)
+    summaries = mixed_summaries(events, seed)
+    rules = calendars.CLASSIFICATION_RULES[source_format]
+    baseline = calendars.SummaryClassifier(source_format, rules)
+    compiled_ns = best_ns_per_event(
+        calendars.SummaryClassifier(source_format, rules).classify, summaries, repeat
+    )
+    if source_format == "freetobook":
+        baseline_fn = classify_freetobook_inline
+    else:
+        baseline_fn = lambda summary, uid: classify_sequentially(baseline, summary, uid)
+    baseline_ns = best_ns_per_event(baseline_fn, summaries, repeat)
+
+    counted = calendars.SummaryClassifier(source_format, rules)
+    for summary, uid in summaries:
+        counted.classify(summary, uid)
+    return {
+        "events": events,
+        "format": source_format,
+        "compiled_ns_per_event": compiled_ns,
+        "baseline_ns_per_event": baseline_ns,
+        "hits": counted.stats()["hits"],
+        "unclassified": counted.unclassified,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark SUMMARY classification over a mixed feed.")
+    parser.add_argument("--events", type=int, default=100000, help="summaries in the mixed feed")
+    parser.add_argument("--format", default="freetobook", choices=sorted(calendars.CLASSIFICATION_RULES),
+                        help="rule table to benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="timed passes; the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the feed mix")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = run(events=args.events, source_format=args.format, repeat=args.repeat, seed=args.seed)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key:>24}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
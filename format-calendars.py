@@ -1,18 +1,113 @@
 import requests
-from flask import Flask, Response, request
-from icalendar import Calendar as ICal, Event as IEvent, Timezone as ITimezone, TimezoneStandard as ITimezoneStandard
+from flask import Flask, Response, jsonify, request, send_file
+from icalendar import (
+    Calendar as ICal, Event as IEvent, Timezone as ITimezone,
+    TimezoneDaylight as ITimezoneDaylight, TimezoneStandard as ITimezoneStandard,
+)
 from datetime import datetime, time, timedelta
-from collections import defaultdict
+from collections import Counter, OrderedDict, defaultdict
+from dateutil.rrule import rrulestr
 import pytz
 import re
 import logging
+import cProfile
+import codecs
+import functools
+import gzip
+import hashlib
+import heapq
+import hmac
+import io
+import itertools
+import pstats
+import queue
+import sys
+import tempfile
+import threading
+import tracemalloc
+import uuid
+from bisect import bisect_left, bisect_right
+from time import monotonic
+from urllib.parse import urlparse
 
 import json, os
 CACHE_FILE = "active_reservations_cache.json"
+# Top-level cache file key holding the last fetched close-outs/owner blocks (everything else is a unit).
+CACHE_BLOCKS_KEY = "_blocks"
 FETCH_TIMEOUT_SECONDS = 20
-
-SOURCE_ICAL_URL = 'https://www.freetobook.com/ical/property-feed/5eac437529a87f16b68149bb183f19ef.ics'
+FETCH_CHUNK_BYTES = 64 * 1024
+# Refuse source feeds larger than this instead of buffering them.
+FETCH_MAX_BYTES = 20 * 1024 * 1024
+# Reuse one parsed snapshot of the source feed for this many seconds before fetching again.
+SNAPSHOT_TTL_SECONDS = 300
+# Written next to CACHE_FILE so every worker process sees them: the latest background refresh job,
+# and a marker replaced after each manual refresh or reset so other workers drop their snapshot.
+REFRESH_STATUS_FILE = "refresh_status.json"
+REFRESH_MARKER_FILE = "refresh_marker"
+# A background refresh still "running" after this long is treated as abandoned (e.g. its worker restarted).
+REFRESH_JOB_STALE_SECONDS = 600
+# Directory that every unit's rendered .ics (and .ics.gz) is written to after each refresh (None = off).
+PUBLISH_DIR = None
+# When set, published feeds are handed to a fronting proxy via X-Accel-Redirect under this prefix
+# (e.g. "/published/" mapped to PUBLISH_DIR) instead of being sent by the app.
+X_ACCEL_REDIRECT_PREFIX = None
+# Rendered VEVENT blocks kept for reuse across renders, keyed by the fields that feed them.
+VEVENT_CACHE_MAX_ENTRIES = 5000
+# Parsed source VEVENTs kept for reuse across fetches, keyed by UID and a hash of the raw text.
+SOURCE_EVENT_CACHE_MAX_ENTRIES = 20000
+# Unit feeds with at least this many events are streamed in chunks rather than built in memory (None = never).
+STREAM_MIN_EVENTS = 200
+# Advertised to calendar clients as X-PUBLISHED-TTL and used as the stale-while-revalidate window.
+PUBLISHED_TTL_SECONDS = 30 * 60
+# When set, changed units are purged from a fronting cache by sending PURGE here with a Surrogate-Key header.
+PURGE_URL = os.environ.get('PURGE_URL')
+# Property names whose slugs are memoized; names come from the upstream feed, so this must stay bounded.
+SLUG_CACHE_MAX_ENTRIES = 1024
+# Required (as X-Debug-Token or ?token=) by the /debug/* endpoints; they are disabled while unset.
+DEBUG_TOKEN = os.environ.get('DEBUG_TOKEN')
+# Where profiles requested with X-Profile are written.
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+# Frames kept per allocation when tracemalloc is started for /debug/memory.
+TRACEMALLOC_FRAMES = 1
+# Days of reservations served by /calendar/<slug>.ics when no ?to= is given (None = everything).
+DEFAULT_HORIZON_DAYS = None
+# Recurring close-outs are expanded this many days ahead when a feed has no other end date.
+BLOCK_HORIZON_DAYS = 365
+# Consumer callback registrations; units that changed in a refresh are POSTed to their subscribers.
+WEBHOOK_SUBSCRIPTIONS_FILE = "webhook_subscriptions.json"
+# Next to the subscriptions file: one marker per (unit, digest) sent, so only one worker delivers each change.
+WEBHOOK_CLAIMS_DIR = "webhook_claims"
+# Required (as X-Subscription-Token or ?token=) by /subscriptions; registration is disabled while unset.
+SUBSCRIPTION_TOKEN = os.environ.get('SUBSCRIPTION_TOKEN')
+# When set, every webhook body is signed with HMAC-SHA256 in an X-Webhook-Signature header.
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+# Deliveries waiting to be sent or retried; new ones are dropped (and counted) beyond this.
+WEBHOOK_QUEUE_MAX = 1000
+WEBHOOK_TIMEOUT_SECONDS = 5
+# A failed delivery is retried after WEBHOOK_RETRY_BASE_SECONDS, then twice that, and so on.
+WEBHOOK_MAX_ATTEMPTS = 5
+WEBHOOK_RETRY_BASE_SECONDS = 2
+# Peer mode: an instance with PEER_LEADER_URL pulls the leader's snapshot instead of fetching the source.
+PEER_LEADER_URL = os.environ.get('PEER_LEADER_URL')
+# Shared by the leader and its followers; /peer/snapshot requires it and signs its body with it.
+PEER_SECRET = os.environ.get('PEER_SECRET')
+PEER_TIMEOUT_SECONDS = 5
+# The leader vouches for its data this long after its last successful source fetch; after that
+# followers stop trusting it and fetch the source themselves.
+PEER_LEASE_SECONDS = 15 * 60
+PEER_SNAPSHOT_FORMAT = 1
+# Ended, cancelled and superseded reservations are appended here instead of vanishing (None = off).
+HISTORY_DIR = os.environ.get('HISTORY_DIR')
+# One history segment per period in this strftime format; closed periods are compacted.
+HISTORY_SEGMENT_FORMAT = "%Y-%m"
+
+SOURCE_ICAL_URL = os.environ.get('SOURCE_ICAL_URL', 'https://www.freetobook.com/ical/property-feed/5eac437529a87f16b68149bb183f19ef.ics')
 TIMEZONE = 'America/Puerto_Rico'
+# Local check-in/check-out times given to all-day source dates (per-unit overrides in UNIT_SETTINGS).
+CHECK_IN_TIME = "16:00"
+CHECK_OUT_TIME = "11:00"
+# VTIMEZONE blocks generated from the tz database, keyed by (zone, first year, last year).
+VTIMEZONE_CACHE_MAX_ENTRIES = 64
 
 FAVICON_SVG = """<?xml version="1.0" encoding="UTF-8"?>
 <svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 16 16" shape-rendering="crispEdges">
@@ -74,21 +169,132 @@ DISPLAY_NAME_OVERRIDES = {
     "Apartment MAO - Five Bedroom": "Apartment MAO",
 }
 
+# Units in another location, or with different arrival/departure times, e.g.
+# {"Apartment AYA": {"timezone": "America/New_York", "check_in": "15:00", "check_out": "10:00"}}.
+# Anything not set falls back to TIMEZONE, CHECK_IN_TIME and CHECK_OUT_TIME.
+UNIT_SETTINGS = {}
+
+# How each source format marks reservations and blocked dates in SUMMARY, tried in order; unmatched events
+# are ignored. A rule's pattern must match at the start of SUMMARY and may use {units} for any KNOWN_PROPERTIES
+# name. Optional named groups: `unit` (otherwise the text before the first ':') and `code` (otherwise taken
+# from the UID). `uid_contains` also requires that text in the UID. `kind` is 'reservation' (default) or
+# 'block' for close-outs and owner/maintenance blocks.
+CLASSIFICATION_RULES = {
+    'freetobook': [
+        {'name': 'unit-and-code', 'summary': r'(?:Apartment|Room) [\w\s\-]+:(?P<code>[\w\d]+)'},
+        {'name': 'unit-with-ctb-uid', 'summary': r'(?:Apartment|Room) [\w\s\-]+', 'uid_contains': 'CTB'},
+        {'name': 'unit-close-out', 'summary': r'(?:(?:Closed|Blocked)\s*[-:]\s*)?(?P<unit>{units})\b', 'kind': 'block'},
+    ],
+    # "<Unit>: <CODE>" or "Reservation <CODE> - <Unit>", as exported by many channel managers.
+    'generic': [
+        {'name': 'code-then-unit', 'summary': r'(?:Reservation|Reserved|Booking)\s+(?P<code>[\w\-]+)\s+-\s+(?P<unit>.+)'},
+        {'name': 'block', 'summary': r'(?:Blocked|Closed|Owner stay|Maintenance)(?:\s*[-:]\s*|\s+)(?P<unit>.+)', 'kind': 'block'},
+        {'name': 'unit-and-code', 'summary': r'(?P<unit>[^:]+):\s*(?P<code>[\w\-]+)'},
+    ],
+}
+SOURCE_FORMAT = os.environ.get('SOURCE_FORMAT', 'freetobook')
+
 app = Flask(__name__)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
 logger = logging.getLogger(__name__)
 
-slugify_cache = {}
+# --- Metrics, served in Prometheus text format from /metrics ---
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+def set_metric(name, value):
+    with _metrics_lock:
+        _metrics[name] = value
+
+def inc_metric(name, amount=1):
+    with _metrics_lock:
+        _metrics[name] = _metrics.get(name, 0) + amount
+
+# In-process caches by name, so /metrics can report their counters.
+_caches = {}
+
+class LRUCache:
+    """Thread-safe mapping that evicts its least recently used entries past max_entries."""
+
+    def __init__(self, name, max_entries):
+        self.name = name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        _caches[name] = self
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def approximate_bytes(self):
+        """Rough memory held by the entries: container overhead plus keys and values one level deep."""
+        with self._lock:
+            items = list(self._data.items())
+        total = sys.getsizeof(self._data)
+        for key, value in items:
+            total += _approximate_size(key) + _approximate_size(value)
+        return total
+
+    def stats(self):
+        return {
+            'entries': len(self),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'approx_bytes': self.approximate_bytes(),
+        }
+
+def _approximate_size(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+vevent_cache = LRUCache("vevent", VEVENT_CACHE_MAX_ENTRIES)
+
+source_event_cache = LRUCache("source_event", SOURCE_EVENT_CACHE_MAX_ENTRIES)
+
+vtimezone_cache = LRUCache("vtimezone", VTIMEZONE_CACHE_MAX_ENTRIES)
+
+slugify_cache = LRUCache("slug", SLUG_CACHE_MAX_ENTRIES)
 
 def slugify(s: str) -> str:
     """URL-safe, case-insensitive slug for property names."""
-    if s in slugify_cache:
-        return slugify_cache[s]
+    slug = slugify_cache.get(s)
+    if slug is not None:
+        return slug
     slug = s.lower()
     slug = re.sub(r"[^a-z0-9]+", "-", slug)
     slug = re.sub(r"-+", "-", slug).strip("-")
-    slugify_cache[s] = slug
+    slugify_cache.put(s, slug)
     return slug
 
 
@@ -105,9 +311,27 @@ def load_cached_reservations(cache_file=CACHE_FILE):
                 return {}
     return {}
 
-def save_cached_reservations(data, cache_file=CACHE_FILE):
-    with open(cache_file, "w") as f:
-        json.dump(data, f, indent=2, default=str)
+def save_cached_reservations(data, cache_file=CACHE_FILE, blocks=None):
+    if blocks:
+        data = dict(data, **{CACHE_BLOCKS_KEY: block_entries(blocks)})
+    # Compact separators keep json on its C encoder; indent=2 falls back to the pure-Python one.
+    write_file_atomic(cache_file, json.dumps(data, separators=(",", ":"), default=str).encode("utf-8"))
+    inc_metric('pms_cache_file_writes')
+    logger.info("Wrote reservation cache to %s", cache_file)
+
+def write_file_atomic(path, data):
+    """Write bytes to path via a temp file and rename, so readers never see a partial file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
 def build_event_description(
     full_property_name,
@@ -154,15 +378,74 @@ def ensure_known_property_keys(properties):
             properties[key] = []
     return properties
 
+def cache_entries(properties, now):
+    """The JSON-ready cache form of grouped reservations, leaving out those already ended."""
+    cache_to_save = {}
+    now_iso = now.isoformat()
+    saved_at = datetime.now(pytz.utc).isoformat()
+    for prop_name, events in properties.items():
+        cache_evs = []
+        for e in events:
+            try:
+                if e['end'] <= now:
+                    continue
+                cache_evs.append({
+                    'uid': e['uid'],
+                    'summary': e.get('summary'),
+                    'booking_code': e.get('booking_code'),
+                    'original_booking_code': e.get('original_booking_code'),
+                    'start': e['start'].isoformat(),
+                    'end': e['end'].isoformat(),
+                    'description': e.get('description'),
+                    'dtstamp': e.get('dtstamp') or saved_at,
+                    'version': e.get('version', 1),
+                    'last_seen': e.get('last_seen', now_iso),
+                    'location': e.get('location'),
+                    'geo': e.get('geo'),
+                })
+            except Exception:
+                continue
+        cache_to_save[prop_name] = cache_evs
+    return cache_to_save
+
+def block_entries(blocks):
+    """The JSON-ready form of close-outs/owner blocks by unit."""
+    return {
+        unit: [dict(block, start=block['start'].isoformat(), end=block['end'].isoformat()) for block in unit_blocks]
+        for unit, unit_blocks in blocks.items()
+    }
+
+def blocks_from_entries(entries):
+    blocks = {}
+    for unit, unit_blocks in entries.items():
+        tz = unit_timezone(unit)
+        blocks[unit] = [
+            dict(block, start=datetime.fromisoformat(block['start']).astimezone(tz),
+                 end=datetime.fromisoformat(block['end']).astimezone(tz))
+            for block in unit_blocks
+        ]
+    return blocks
+
+def cached_blocks(cache):
+    """The blocks save_cached_reservations() stored with the reservations, by unit."""
+    entries = cache.get(CACHE_BLOCKS_KEY)
+    if not isinstance(entries, dict):
+        return {}
+    try:
+        return blocks_from_entries(entries)
+    except (AttributeError, KeyError, TypeError, ValueError) as exc:
+        logger.warning("Ignoring unreadable blocks in the reservation cache: %s", exc)
+        return {}
+
 def properties_from_cache(cache, now):
     properties = defaultdict(list)
-    tz = pytz.timezone(TIMEZONE)
 
     for prop_name, cached_events in cache.items():
         if not isinstance(cached_events, list):
             continue
         if prop_name not in properties:
             properties[prop_name] = []
+        tz = unit_timezone(prop_name)
 
         for ev in cached_events:
             try:
@@ -191,127 +474,595 @@ def properties_from_cache(cache, now):
 
     return ensure_known_property_keys(properties)
 
-def fetch_source_calendar():
-    response = requests.get(SOURCE_ICAL_URL, timeout=FETCH_TIMEOUT_SECONDS)
-    status_code = getattr(response, "status_code", 200)
-    if status_code and int(status_code) >= 400:
-        raise ValueError(f"Source feed returned HTTP {status_code}")
-
-    feed_text = getattr(response, "text", "")
-    if not feed_text or "BEGIN:VCALENDAR" not in feed_text:
+def history_transitions(previous_cache, new_cache, now):
+    """Diff two cache contents into history records: each new version, and each stay that left the cache."""
+    previous = {
+        (unit, ev.get('uid')): ev
+        for unit, events in previous_cache.items() if isinstance(events, list)
+        for ev in events
+    }
+    records = []
+    for unit, events in new_cache.items():
+        for ev in events:
+            old = previous.pop((unit, ev['uid']), None)
+            if old is None or old.get('version', 1) != ev.get('version', 1):
+                records.append(dict(ev, unit=unit, state='booked'))
+    for (unit, uid), ev in previous.items():
+        try:
+            ended = datetime.fromisoformat(ev['end']) <= now
+        except (KeyError, TypeError, ValueError):
+            continue
+        records.append(dict(ev, unit=unit, state='ended' if ended else 'cancelled'))
+    return records
+
+
+_history_lock = threading.Lock()
+
+class ReservationHistory:
+    """Append-only log of every reservation version seen and of how each stay left the cache.
+
+    Records are JSON lines in one segment per HISTORY_SEGMENT_FORMAT period they were
+    written in (<period>.jsonl). Once a period is over its segment is compacted into a
+    sorted, de-duplicated <period>.jsonl.gz, and index.json records each compacted
+    segment's per-unit date range so queries skip segments that cannot match.
+    """
+
+    STATES = ('booked', 'ended', 'cancelled')
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+
+    def append(self, records, now=None):
+        if not records:
+            return
+        now = (now or datetime.now(pytz.utc)).astimezone(pytz.utc)
+        segment = now.strftime(HISTORY_SEGMENT_FORMAT)
+        lines = "".join(json.dumps(dict(r, recorded_at=now.isoformat()), default=str) + "\n" for r in records)
+        os.makedirs(self.directory, exist_ok=True)
+        with _history_lock:
+            # One write per batch, in append mode, so concurrent workers never interleave lines.
+            with open(os.path.join(self.directory, segment + ".jsonl"), "a") as f:
+                f.write(lines)
+        inc_metric('pms_history_records', len(records))
+        self.compact(before=segment)
+
+    def segments(self):
+        """(period, path, compacted) for every segment file, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        found = []
+        for filename in sorted(os.listdir(self.directory)):
+            if filename.endswith(".jsonl.gz"):
+                found.append((filename[:-len(".jsonl.gz")], os.path.join(self.directory, filename), True))
+            elif filename.endswith(".jsonl"):
+                found.append((filename[:-len(".jsonl")], os.path.join(self.directory, filename), False))
+        return found
+
+    def load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, "r") as f:
+            return json.load(f)
+
+    def compact(self, before):
+        """Compact every open segment for a period earlier than `before` (a segment name)."""
+        with _history_lock:
+            for period, _, compacted in self.segments():
+                if not compacted and period < before:
+                    self._compact_segment(period)
+
+    def _compact_segment(self, period):
+        open_path = os.path.join(self.directory, period + ".jsonl")
+        gz_path = open_path + ".gz"
+        records = {}
+        for path in (gz_path, open_path):
+            if os.path.exists(path):
+                for record in self._read(path):
+                    records.setdefault(self.record_key(record), record)
+        ordered = sorted(records.values(), key=lambda r: (r['unit'], r['start'], r['uid'], r.get('version', 1)))
+
+        ranges = {}
+        for record in ordered:
+            start, end = datetime.fromisoformat(record['start']), datetime.fromisoformat(record['end'])
+            low, high = ranges.get(record['unit'], (start, end))
+            ranges[record['unit']] = (min(low, start), max(high, end))
+        body = "".join(json.dumps(r, default=str) + "\n" for r in ordered).encode("utf-8")
+        write_file_atomic(gz_path, gzip.compress(body, mtime=0))
+        os.remove(open_path)
+
+        index = self.load_index()
+        index[period] = {
+            'records': len(ordered),
+            'units': {unit: [low.isoformat(), high.isoformat()] for unit, (low, high) in ranges.items()},
+        }
+        write_file_atomic(self.index_path, json.dumps(index, indent=2, sort_keys=True).encode("utf-8"))
+        logger.info("Compacted reservation history segment %s (%d records)", period, len(ordered))
+
+    def query(self, unit=None, start=None, end=None):
+        """Records for one unit (or all) whose stay overlaps [start, end), oldest stay first."""
+        def overlaps(record_start, record_end):
+            return (end is None or datetime.fromisoformat(record_start) < end) and \
+                (start is None or datetime.fromisoformat(record_end) > start)
+
+        index = self.load_index()
+        seen = set()
+        results = []
+        for period, path, compacted in self.segments():
+            if compacted and period in index:
+                ranges = index[period]['units']
+                if unit:
+                    candidates = [ranges[unit]] if unit in ranges else []
+                else:
+                    candidates = list(ranges.values())
+                if not any(overlaps(low, high) for low, high in candidates):
+                    continue
+            for record in self._read(path):
+                if unit and record['unit'] != unit:
+                    continue
+                if not overlaps(record['start'], record['end']):
+                    continue
+                key = self.record_key(record)
+                if key not in seen:
+                    seen.add(key)
+                    results.append(record)
+        results.sort(key=lambda r: (r['start'], r['unit'], r['uid'], r.get('version', 1), self.STATES.index(r['state'])))
+        return results
+
+    @staticmethod
+    def record_key(record):
+        # Workers sharing a cache file can each log the same transition; these fields identify it.
+        return (record['unit'], record['uid'], record.get('version', 1), record['state'])
+
+    @staticmethod
+    def _read(path):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def iter_feed_lines(chunks, max_bytes=None):
+    """Decode a stream of byte chunks into iCal content lines.
+
+    The header is validated as soon as the first bytes arrive, and the stream is
+    abandoned once it grows past max_bytes, so a bad or oversized feed is never
+    buffered in full.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    header = "BEGIN:VCALENDAR"
+    header_checked = False
+    total = 0
+    pending = ""
+    for chunk in chunks:
+        if not chunk:
+            continue
+        total += len(chunk)
+        if max_bytes and total > max_bytes:
+            raise ValueError(f"Source feed is larger than {max_bytes} bytes")
+        pending += decoder.decode(chunk)
+        if not header_checked:
+            head = pending.lstrip("\ufeff \t\r\n")
+            if len(head) < len(header):
+                continue
+            if not head.startswith(header):
+                raise ValueError("Source feed response does not look like iCal data")
+            header_checked = True
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip("\r")
+
+    pending += decoder.decode(b"", final=True)
+    if not header_checked and not pending.lstrip("\ufeff \t\r\n").startswith(header):
         raise ValueError("Source feed response does not look like iCal data")
-
-    return ICal.from_ical(feed_text)
-
-def parse_and_group_events(now_override=None, cache_file=CACHE_FILE):
-    properties = defaultdict(list)
-    tz = pytz.timezone(TIMEZONE)
-    cache = load_cached_reservations(cache_file)
-    now = now_override.astimezone(tz) if now_override else datetime.now(tz)
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-
-    logger.info("Fetching calendar feed from source...")
+    for line in pending.split("\n"):
+        yield line.rstrip("\r")
+
+def iter_vevents(lines):
+    """Yield each VEVENT's raw text as soon as its END line arrives; only one event is held at a time."""
+    block = None
+    complete = False
+    for line in lines:
+        marker = line.strip().upper()
+        if block is None:
+            if marker == "BEGIN:VEVENT":
+                block = [line]
+            elif marker == "END:VCALENDAR":
+                complete = True
+            continue
+        block.append(line)
+        if marker == "END:VEVENT":
+            yield "\r\n".join(block)
+            block = None
+    if not complete:
+        # A truncated feed must not be mistaken for one where bookings were cancelled.
+        raise ValueError("Source feed ended before END:VCALENDAR")
+
+def vevent_uid(raw):
+    """Cheaply pull the UID line out of a raw VEVENT block (without unfolding)."""
+    for line in raw.split("\n"):
+        if line[:4].upper() == "UID:":
+            return line[4:].strip()
+    return ""
+
+# ETag and ordered source_event_cache keys of the last feed that was read to the end; a 304 replays those keys.
+_source_etag = None
+_source_keys = []
+
+def source_event_key(raw):
+    """(UID, SHA-1 of the raw text): identifies one version of a source VEVENT in source_event_cache."""
+    return vevent_uid(raw), hashlib.sha1(raw.encode("utf-8")).digest()
+
+def fetch_source_events():
+    """Stream the source feed, yielding (key, raw VEVENT) pairs while the rest of the body is still downloading.
+
+    The request carries If-None-Match with the last complete feed's ETag. A 304
+    yields that feed's keys again with no text (key, None), so the merge sees an
+    unchanged feed built from the records already parsed for those keys.
+    """
+    global _source_etag, _source_keys
+    headers = {'If-None-Match': _source_etag} if _source_etag else {}
+    response = requests.get(SOURCE_ICAL_URL, timeout=FETCH_TIMEOUT_SECONDS, stream=True, headers=headers)
     try:
-        cal = fetch_source_calendar()
-    except Exception as exc:
-        logger.error("Unable to fetch/parse source calendar; using cached reservations without rewriting cache: %s", exc)
-        return properties_from_cache(cache, now)
-
-    seen_uids_by_prop = defaultdict(set)
-    source_events_by_uid = {}
+        status_code = getattr(response, "status_code", 200)
+        if status_code and int(status_code) == 304:
+            if not _source_etag:
+                raise ValueError("Source feed returned HTTP 304 without a conditional request")
+            inc_metric('pms_source_not_modified')
+            etag, keys = _source_etag, _source_keys
+            # Until every key has been replayed; if one was evicted, the next fetch asks for the whole feed.
+            _source_etag = None
+            for key in keys:
+                yield key, None
+            _source_etag = etag
+            return
+        if status_code and int(status_code) >= 400:
+            raise ValueError(f"Source feed returned HTTP {status_code}")
+        etag = (getattr(response, "headers", None) or {}).get("ETag")
+        chunks = response.iter_content(chunk_size=FETCH_CHUNK_BYTES)
+        keys = []
+        for raw in iter_vevents(iter_feed_lines(chunks, FETCH_MAX_BYTES)):
+            key = source_event_key(raw)
+            keys.append(key)
+            yield key, raw
+        # Only a feed that arrived whole can stand in for a later 304.
+        _source_etag, _source_keys = etag, keys
+    finally:
+        response.close()
+
+def collect_source_reservations(source_events, now, stats=None, blocks=None):
+    """Turn raw source VEVENT blocks into reservation records, skipping stays that ended before today.
+
+    "Today" starts at midnight in each unit's own timezone.
+
+    ``source_events`` yields raw VEVENT text or, from fetch_source_events(), (key, raw)
+    pairs whose raw is None when the event must already be in source_event_cache.
+
+    Close-outs and owner blocks go into the `blocks` list when one is given (one-off
+    blocks only while they have not ended). VEVENTs whose UID and text were seen in an
+    earlier fetch reuse the record parsed then (from source_event_cache), so only new or
+    modified events go through icalendar and parse_source_reservation(); their summary
+    classification is counted again so the classifier's hit counts cover every fetch.
+    """
+    parsed = {}
+    reused = 0
     source_reservations = []
+    now_iso = now.isoformat()
+    day_starts = {}
+    for raw in source_events:
+        if isinstance(raw, tuple):
+            key, raw = raw
+        else:
+            key = source_event_key(raw)
+        if key in parsed:
+            reservation = parsed[key]
+        else:
+            cached = source_event_cache.get(key)
+            if cached is not None:
+                outcome, reservation = cached
+                if 'rule' in outcome:
+                    summary_classifier.count(outcome['rule'])
+                reused += 1
+            elif raw is None:
+                raise ValueError("Source feed was not modified, but its parsed events are no longer cached")
+            else:
+                outcome = {}
+                reservation = parse_source_reservation(IEvent.from_ical(raw), outcome)
+                source_event_cache.put(key, (outcome, reservation))
+            parsed[key] = reservation
 
-    for component in cal.walk():
-        if component.name != "VEVENT":
+        if reservation is None:
             continue
-
-        summary = str(component.get('SUMMARY', ''))
-        uid = str(component.get('UID', ''))
-        dtstart_raw = component.get('DTSTART')
-        dtend_raw = component.get('DTEND')
-
-        if not dtstart_raw or not dtend_raw:
+        unit = reservation['property_name']
+        today_start = day_starts.get(unit)
+        if today_start is None:
+            today_start = day_starts[unit] = local_day_start(now, unit_timezone(unit))
+        if reservation.get('kind') == 'block':
+            if blocks is not None and (reservation['rrule'] or reservation['end'] > today_start):
+                blocks.append(reservation)
             continue
-
-        # Handle DATE vs DATETIME using pytz timezone-aware conversion
-        puerto_rico_tz = pytz.timezone("America/Puerto_Rico")
-        dtstart = dtstart_raw.dt
-        dtend = dtend_raw.dt
-
-        if isinstance(dtstart, datetime):
-            if dtstart.tzinfo is None:
-                dtstart = puerto_rico_tz.localize(dtstart)
+        if reservation['end'] <= today_start:
+            continue
+        source_reservations.append(dict(reservation, last_seen=now_iso))
+
+    if stats is not None:
+        stats['events_reused'] = reused
+        stats['events_parsed'] = len(parsed) - reused
+    return source_reservations
+
+class SummaryClassifier:
+    """A source format's rule table compiled into one regex, so each SUMMARY is matched once.
+
+    Each rule becomes a named alternative (rule0, rule1, ...) of the dispatch pattern; which
+    alternative matched identifies the rule. Rules with a UID condition that fails fall
+    through to the remaining rules one at a time, as they would in a plain loop.
+    """
+
+    def __init__(self, source_format, rules, units=None):
+        self.source_format = source_format
+        self.rules = rules
+        # Longest names first, so "Room ONE" cannot cut short a longer name that starts the same way.
+        units_pattern = "|".join(re.escape(unit) for unit in sorted(units or KNOWN_PROPERTIES, key=len, reverse=True))
+        sources = [rule['summary'].replace('{units}', f"(?:{units_pattern})") for rule in rules]
+        self.patterns = [re.compile(source) for source in sources]
+        self._kinds = [rule.get('kind', 'reservation') for rule in rules]
+        alternatives = []
+        # Per rule: its `unit` and `code` group names in the dispatch pattern and in its own pattern
+        # (None when absent), and its UID condition.
+        self._groups = []
+        self._own_groups = []
+        self._uid_required = [rule.get('uid_contains') for rule in rules]
+        for i, rule in enumerate(rules):
+            # Group names must be unique across alternatives, so prefix them with the rule number.
+            pattern = re.sub(r'\(\?P<(\w+)>', lambda m: f"(?P<r{i}_{m.group(1)}>", sources[i])
+            alternatives.append(f"(?P<rule{i}>{pattern})")
+            names = self.patterns[i].groupindex
+            self._groups.append(tuple(f"r{i}_{name}" if name in names else None for name in ('unit', 'code')))
+            self._own_groups.append(tuple(name if name in names else None for name in ('unit', 'code')))
+        self.dispatch = re.compile("|".join(alternatives))
+        self._rule_numbers = {f"rule{i}": i for i in range(len(rules))}
+        self.hits = [0] * len(rules)
+        self.unclassified = 0
+
+    def classify(self, summary, uid):
+        """Return (unit, booking code, kind) for a reservation or block summary, or None."""
+        return self.match(summary, uid)[1]
+
+    def match(self, summary, uid):
+        """Like classify(), but returns (rule index or None, result) so the outcome can be counted again later."""
+        match = self.dispatch.match(summary)
+        if match is not None:
+            i = self._rule_numbers[match.lastgroup]
+            required = self._uid_required[i]
+            if required is None or required in uid:
+                return i, self._result(i, match, self._groups[i], summary, uid)
+            for j in range(i + 1, len(self.rules)):
+                match = self.patterns[j].match(summary)
+                required = self._uid_required[j]
+                if match is not None and (required is None or required in uid):
+                    return j, self._result(j, match, self._own_groups[j], summary, uid)
+        self.count(None)
+        return None, None
+
+    def count(self, rule):
+        """Count one classification by rule index (None for unclassified) without matching again."""
+        if rule is None:
+            self.unclassified += 1
         else:
-            dtstart = puerto_rico_tz.localize(datetime.combine(dtstart, time(16, 0)))
-
-        if isinstance(dtend, datetime):
-            if dtend.tzinfo is None:
-                dtend = puerto_rico_tz.localize(dtend)
+            self.hits[rule] += 1
+
+    def _result(self, i, match, groups, summary, uid):
+        self.hits[i] += 1
+        unit_group, code_group = groups
+        unit = (match.group(unit_group) if unit_group else summary.split(':', 1)[0]).strip()
+        if code_group:
+            code = match.group(code_group)
         else:
-            dtend = puerto_rico_tz.localize(datetime.combine(dtend, time(11, 0)))
+            code = uid.split(":")[-1] if ":" in uid else uid
+        return unit, code, self._kinds[i]
 
-        if dtend <= today_start:
-            continue
+    def stats(self):
+        return {
+            'format': self.source_format,
+            'hits': {rule['name']: hits for rule, hits in zip(self.rules, self.hits)},
+            'unclassified': self.unclassified,
+        }
 
-        label = "Close-out"
-        booking_code = "MANUAL"
-        property_name = "Unknown"
 
-        full_match = re.match(r'(Apartment|Room) ([\w\s\-]+):([\w\d]+)', summary)
-        if full_match:
-            _, property_name, booking_code = full_match.groups()
-            label = "Reservation"
-        else:
-            loose_match = re.match(r'(Apartment|Room) ([\w\s\-]+)', summary)
-            if loose_match and "CTB" in uid:  # likely reservation, but no explicit code
-                property_name = loose_match.group(2)
-                booking_code = uid.split(":")[-1] if ":" in uid else uid
-                label = "Reservation"
+summary_classifier = SummaryClassifier(SOURCE_FORMAT, CLASSIFICATION_RULES[SOURCE_FORMAT])
 
-        if label != "Reservation":
-            continue
-        full_property_name = summary.split(':')[0].strip()
-        key = full_property_name
-
-        dtstamp_raw = component.get('DTSTAMP')
-        if dtstamp_raw:
-            src_dtstamp = dtstamp_raw.dt
-            if isinstance(src_dtstamp, datetime) and src_dtstamp.tzinfo is None:
-                src_dtstamp = pytz.utc.localize(src_dtstamp)
-        else:
-            src_dtstamp = datetime.now(pytz.utc)
+def unit_timezone(key):
+    return pytz.timezone(UNIT_SETTINGS.get(key, {}).get('timezone', TIMEZONE))
 
-        nights = (dtend.date() - dtstart.date()).days
+def local_day_start(at, tz):
+    """Midnight starting the day that contains instant ``at`` in ``tz``."""
+    return tz.localize(datetime.combine(at.astimezone(tz).date(), time(0, 0)))
 
-        # Ensure dtstart and dtend are timezone-aware in PR
-        start = dtstart if dtstart.tzinfo else puerto_rico_tz.localize(dtstart)
-        end = dtend if dtend.tzinfo else puerto_rico_tz.localize(dtend)
+def unit_stay_times(key):
+    """(check-in, check-out) local times given to a unit's all-day source dates."""
+    settings = UNIT_SETTINGS.get(key, {})
+    return (
+        time.fromisoformat(settings.get('check_in', CHECK_IN_TIME)),
+        time.fromisoformat(settings.get('check_out', CHECK_OUT_TIME)),
+    )
 
-        dtstart_utc = start.astimezone(pytz.utc)
-        dtend_utc = end.astimezone(pytz.utc)
+def localize_source_time(value, default_time, tz):
+    """A source DATE or DATE-TIME as an aware datetime in tz (floating times are taken as local to tz)."""
+    if not isinstance(value, datetime):
+        return tz.localize(datetime.combine(value, default_time))
+    if value.tzinfo is None:
+        return tz.localize(value)
+    return value.astimezone(tz)
+
+def localize_rrule_until(rule_text, unit_tz):
+    """Rewrite a UTC UNTIL as the unit's wall time, since blocks are expanded in local time with ignoretz."""
+    def local(match):
+        until = pytz.utc.localize(datetime.strptime(match.group(1), "%Y%m%dT%H%M%S"))
+        return "UNTIL=" + until.astimezone(unit_tz).strftime("%Y%m%dT%H%M%S")
+    return re.sub(r"UNTIL=(\d{8}T\d{6})Z", local, rule_text, flags=re.IGNORECASE)
+
+def parse_source_block(component, key, uid, summary, unit_tz):
+    """Build a close-out/owner block record; all-day blocks cover whole local days.
+
+    Returns None (and logs why) for a block whose recurrence cannot be expanded, so
+    one malformed close-out never reaches rendering.
+    """
+    dtstart = component.get('DTSTART').dt
+    all_day = not isinstance(dtstart, datetime)
+    start = localize_source_time(dtstart, time(0, 0), unit_tz)
+    end = localize_source_time(component.get('DTEND').dt, time(0, 0), unit_tz)
+
+    rrule = component.get('RRULE')
+    try:
+        rule_text = rrule.to_ical().decode("utf-8") if rrule else None
+        if rule_text:
+            rule_text = localize_rrule_until(rule_text, unit_tz)
+            rrulestr(rule_text, dtstart=start.replace(tzinfo=None), ignoretz=True)
+        exdates = component.get('EXDATE') or []
+        if not isinstance(exdates, list):
+            exdates = [exdates]
+        excluded = sorted({
+            localize_source_time(value.dt, start.time(), unit_tz).replace(tzinfo=None).isoformat()
+            for exdate in exdates for value in exdate.dts
+        })
+    except Exception as exc:
+        logger.warning("Dropping block %s for %s: unusable recurrence: %s", uid, key, exc)
+        return None
+    dtstamp_raw = component.get('DTSTAMP')
+    return {
+        'kind': 'block',
+        'uid': uid,
+        'property_name': key,
+        'summary': summary,
+        'start': start,
+        'end': end,
+        'all_day': all_day,
+        'rrule': rule_text,
+        'exdates': excluded,
+        'dtstamp': dtstamp_raw.dt.isoformat() if dtstamp_raw else None,
+    }
+
+def parse_source_reservation(component, outcome=None):
+    """Build a reservation record from one source VEVENT, or None if it is not a reservation.
+
+    When given, ``outcome['rule']`` receives the classifying rule's index (None when no
+    rule matched); it stays unset for events skipped before classification.
+    """
+    summary = str(component.get('SUMMARY', ''))
+    uid = str(component.get('UID', ''))
+    dtstart_raw = component.get('DTSTART')
+    dtend_raw = component.get('DTEND')
+
+    if not dtstart_raw or not dtend_raw:
+        return None
+
+    rule, classified = summary_classifier.match(summary, uid)
+    if outcome is not None:
+        outcome['rule'] = rule
+    if classified is None:
+        # Not tied to a unit (e.g. "Last update ..."), so not exported anywhere.
+        return None
+    key, booking_code, kind = classified
+    unit_tz = unit_timezone(key)
+    if kind == 'block':
+        return parse_source_block(component, key, uid, summary, unit_tz)
+
+    # All-day dates become the unit's check-in/check-out times; everything ends up in the unit's timezone.
+    check_in, check_out = unit_stay_times(key)
+    start = localize_source_time(dtstart_raw.dt, check_in, unit_tz)
+    end = localize_source_time(dtend_raw.dt, check_out, unit_tz)
+
+    dtstamp_raw = component.get('DTSTAMP')
+    if dtstamp_raw:
+        src_dtstamp = dtstamp_raw.dt
+        if isinstance(src_dtstamp, datetime) and src_dtstamp.tzinfo is None:
+            src_dtstamp = pytz.utc.localize(src_dtstamp)
+    else:
+        src_dtstamp = datetime.now(pytz.utc)
+
+    nights = (end.date() - start.date()).days
+
+    dtstart_utc = start.astimezone(pytz.utc)
+    dtend_utc = end.astimezone(pytz.utc)
+
+    location_raw = component.get('LOCATION')
+    description_raw = component.get('DESCRIPTION')
+    categories_raw = component.get('CATEGORIES')
+
+    return {
+        'uid': uid,
+        'property_name': key,
+        'booking_code': booking_code,
+        'nights': nights,
+        'start': start,
+        'end': end,
+        'dtstart_utc': dtstart_utc,
+        'dtend_utc': dtend_utc,
+        'location': str(location_raw) if location_raw else None,
+        'location_raw': location_raw,
+        'description_raw': description_raw,
+        'categories_raw': categories_raw,
+        'geo': None,
+        'dtstamp': src_dtstamp.isoformat(),
+        'version': 1,
+        # build_event_description() output per (possibly suffixed) booking code, kept for reuse.
+        'descriptions': {},
+    }
+
+# Stage timings and counts from the most recent parse_and_group_events() run.
+last_parse_stats = {}
+# Close-outs and owner blocks by unit from the most recent parse: the feed's own, or the ones saved
+# with the cache when it fell back to the cache (None until a parse has run).
+last_source_blocks = None
+
+def parse_and_group_events(now_override=None, cache_file=CACHE_FILE, source_calendar=None, source_text=None):
+    """Group reservations by unit and merge them with the cache.
+
+    ``source_calendar`` is an already-parsed feed (e.g. read from disk by the batch
+    CLI) and ``source_text`` a raw one (e.g. a recorded feed being replayed), split
+    into VEVENTs the same way a fetched feed is; when neither is given the feed is
+    fetched from SOURCE_ICAL_URL.
+    """
+    global last_parse_stats, last_source_blocks
+    stage_started = monotonic()
+    stats = last_parse_stats = {'source_ok': False}
+    # Cleared up front so a failed parse never leaves an earlier feed's blocks behind.
+    last_source_blocks = None
+    properties = defaultdict(list)
+    tz = pytz.timezone(TIMEZONE)
+    cache = load_cached_reservations(cache_file)
+    now = now_override.astimezone(tz) if now_override else datetime.now(tz)
+    now_iso = now.isoformat()
 
-        location_raw = component.get('LOCATION')
-        description_raw = component.get('DESCRIPTION')
-        categories_raw = component.get('CATEGORIES')
+    if source_calendar is not None:
+        source_events = (c.to_ical().decode("utf-8") for c in source_calendar.walk() if c.name == "VEVENT")
+    elif source_text is not None:
+        source_events = iter_vevents(iter_feed_lines([source_text.encode("utf-8")]))
+    else:
+        logger.info("Fetching calendar feed from source...")
+        source_events = fetch_source_events()
 
-        source_reservations.append({
-            'uid': uid,
-            'property_name': key,
-            'booking_code': booking_code,
-            'nights': nights,
-            'start': start,
-            'end': end,
-            'dtstart_utc': dtstart_utc,
-            'dtend_utc': dtend_utc,
-            'location': str(location_raw) if location_raw else None,
-            'location_raw': location_raw,
-            'description_raw': description_raw,
-            'categories_raw': categories_raw,
-            'geo': None,
-            'dtstamp': src_dtstamp.isoformat(),
-            'version': 1,
-            'last_seen': now.isoformat(),
-        })
+    seen_uids_by_prop = defaultdict(set)
+    source_events_by_uid = {}
+    source_blocks = []
+    try:
+        source_reservations = collect_source_reservations(source_events, now, stats, source_blocks)
+    except Exception as exc:
+        logger.error("Unable to fetch/parse source calendar; using cached reservations without rewriting cache: %s", exc)
+        stats['error'] = str(exc)
+        stats['fetch_parse_seconds'] = round(monotonic() - stage_started, 4)
+        last_source_blocks = cached_blocks(cache)
+        return properties_from_cache(cache, now)
+    stats['source_ok'] = True
+    stats['source_reservations'] = len(source_reservations)
+    stats['source_blocks'] = len(source_blocks)
+    last_source_blocks = defaultdict(list)
+    for block in source_blocks:
+        last_source_blocks[block['property_name']].append(block)
+    last_source_blocks = dict(last_source_blocks)
+    stats['fetch_parse_seconds'] = round(monotonic() - stage_started, 4)
+    stage_started = monotonic()
 
     booking_code_counts = defaultdict(int)
     for reservation in source_reservations:
@@ -328,20 +1079,25 @@ def parse_and_group_events(now_override=None, cache_file=CACHE_FILE):
             booking_code = original_booking_code
 
         summary_text = f"{key} ({booking_code})"
-        description = build_event_description(
-            key,
-            booking_code,
-            original_booking_code,
-            reservation['uid'],
-            reservation['nights'],
-            reservation['start'],
-            reservation['end'],
-            reservation['dtstart_utc'],
-            reservation['dtend_utc'],
-            reservation.get('location_raw'),
-            reservation.get('description_raw'),
-            reservation.get('categories_raw'),
-        )
+        # Reused records carry the description built last time for the same booking code.
+        descriptions = reservation.setdefault('descriptions', {})
+        description = descriptions.get(booking_code)
+        if description is None:
+            description = build_event_description(
+                key,
+                booking_code,
+                original_booking_code,
+                reservation['uid'],
+                reservation['nights'],
+                reservation['start'],
+                reservation['end'],
+                reservation['dtstart_utc'],
+                reservation['dtend_utc'],
+                reservation.get('location_raw'),
+                reservation.get('description_raw'),
+                reservation.get('categories_raw'),
+            )
+            descriptions[booking_code] = description
 
         properties[key].append({
             'uid': reservation['uid'],
@@ -355,7 +1111,7 @@ def parse_and_group_events(now_override=None, cache_file=CACHE_FILE):
             'geo': reservation.get('geo'),
             'dtstamp': reservation.get('dtstamp'),
             'version': reservation.get('version', 1),
-            'last_seen': reservation.get('last_seen', now.isoformat()),
+            'last_seen': reservation.get('last_seen', now_iso),
         })
 
         seen_uids_by_prop[key].add(reservation['uid'])
@@ -365,14 +1121,17 @@ def parse_and_group_events(now_override=None, cache_file=CACHE_FILE):
     restored_active_after_start = 0
     cancelled_future_missing = 0
     for prop_name, cached_events in cache.items():
+        if not isinstance(cached_events, list):
+            continue
         if prop_name not in properties:
             properties[prop_name] = []
+        unit_tz = unit_timezone(prop_name)
 
         for ev in cached_events:
             try:
                 cached_uid = ev.get('uid')
-                cached_start = datetime.fromisoformat(ev['start']).astimezone(tz)
-                cached_end = datetime.fromisoformat(ev['end']).astimezone(tz)
+                cached_start = datetime.fromisoformat(ev['start']).astimezone(unit_tz)
+                cached_end = datetime.fromisoformat(ev['end']).astimezone(unit_tz)
                 cached_dtstamp = datetime.fromisoformat(ev.get('dtstamp')).astimezone(pytz.utc) if ev.get('dtstamp') else None
                 cached_version = ev.get('version', 1)
                 cached_last_seen = ev.get('last_seen')
@@ -390,10 +1149,10 @@ def parse_and_group_events(now_override=None, cache_file=CACHE_FILE):
 
                 if src_dt and cached_dtstamp and src_dt > cached_dtstamp:
                     src['version'] = cached_version + 1
-                    src['last_seen'] = now.isoformat()
+                    src['last_seen'] = now_iso
                 else:
                     src.setdefault('version', cached_version)
-                    src.setdefault('last_seen', now.isoformat())
+                    src.setdefault('last_seen', now_iso)
                 merged_count += 1
                 continue
 
@@ -417,7 +1176,7 @@ def parse_and_group_events(now_override=None, cache_file=CACHE_FILE):
                         'geo': ev.get('geo'),
                         'dtstamp': ev.get('dtstamp'),
                         'version': cached_version,
-                        'last_seen': cached_last_seen or now.isoformat(),
+                        'last_seen': cached_last_seen or now_iso,
                     })
                     merged_count += 1
                     restored_active_after_start += 1
@@ -431,133 +1190,1631 @@ def parse_and_group_events(now_override=None, cache_file=CACHE_FILE):
     )
 
     ensure_known_property_keys(properties)
+    stats.update({
+        'merged': merged_count,
+        'restored_started': restored_active_after_start,
+        'cancelled_future': cancelled_future_missing,
+        'merge_seconds': round(monotonic() - stage_started, 4),
+    })
+    stage_started = monotonic()
 
     # Save current active events to cache
-    cache_to_save = {}
-    for prop_name, events in properties.items():
-        cache_evs = []
-        for e in events:
-            try:
-                if e['end'] <= now:
-                    continue
-                cache_evs.append({
-                    'uid': e['uid'],
-                    'summary': e.get('summary'),
-                    'booking_code': e.get('booking_code'),
-                    'original_booking_code': e.get('original_booking_code'),
-                    'start': e['start'].isoformat(),
-                    'end': e['end'].isoformat(),
-                    'description': e.get('description'),
-                    'dtstamp': e.get('dtstamp') if e.get('dtstamp') else datetime.now(pytz.utc).isoformat(),
-                    'version': e.get('version', 1),
-                    'last_seen': e.get('last_seen', now.isoformat()),
-                    'location': e.get('location'),
-                    'geo': e.get('geo'),
-                })
-            except Exception:
-                continue
-        cache_to_save[prop_name] = cache_evs
-    save_cached_reservations(cache_to_save, cache_file)
+    cache_to_save = cache_entries(properties, now)
+    save_cached_reservations(cache_to_save, cache_file, last_source_blocks)
+    if HISTORY_DIR:
+        records = history_transitions(cache, cache_to_save, now)
+        try:
+            ReservationHistory(HISTORY_DIR).append(records, now)
+            stats['history_records'] = len(records)
+        except (OSError, ValueError) as exc:
+            logger.error("Unable to append to reservation history in %s: %s", HISTORY_DIR, exc)
+    stats['save_seconds'] = round(monotonic() - stage_started, 4)
 
     logger.info(f"Parsed calendar: {sum(len(v) for v in properties.values())} reservation events across {len(properties)} properties")
     return properties
 
+class UnitIndex:
+    """One unit's reservations sorted by start, so a date window is a bisect plus a slice."""
+
+    def __init__(self, events):
+        self.events = sorted(events, key=lambda e: e['start'])
+        self.starts = [e['start'] for e in self.events]
+        # Running maximum of end times; non-decreasing, so it can be bisected as well.
+        self.max_ends = []
+        running_end = None
+        for e in self.events:
+            if running_end is None or e['end'] > running_end:
+                running_end = e['end']
+            self.max_ends.append(running_end)
+
+    def window(self, window_start=None, window_end=None):
+        """Return events overlapping [window_start, window_end); None leaves that side open."""
+        lo = 0 if window_start is None else bisect_right(self.max_ends, window_start)
+        hi = len(self.events) if window_end is None else bisect_left(self.starts, window_end)
+        if window_start is None:
+            return self.events[lo:hi]
+        # A long stay earlier in the list can lift the running max; drop anything it let through.
+        return [e for e in self.events[lo:hi] if e['end'] > window_start]
+
+
+class OccupancyBitmap:
+    """Units x nights occupancy, one Python int per unit used as a packed bit array.
+
+    Bit ``n`` of a unit's row is set when night ``base_date + n`` is booked or
+    closed out, so a range query is a shift, an AND and a popcount per unit instead
+    of a walk over reservations. Blocks are expanded from ``base_date`` up to the
+    last reservation or BLOCK_HORIZON_DAYS ahead, whichever is later.
+    """
+
+    def __init__(self, properties, blocks=None):
+        blocks = blocks or {}
+        self.units = sorted(properties.keys())
+        today = datetime.now(pytz.timezone(TIMEZONE)).date()
+        starts = [e['start'].date() for events in properties.values() for e in events]
+        self.base_date = min(starts) if starts else today
+        ends = [e['end'].date() for events in properties.values() for e in events]
+        horizon = max(ends + [today + timedelta(days=BLOCK_HORIZON_DAYS)])
+        self.rows = []
+        for unit in self.units:
+            row = 0
+            stays = [(e['start'], e['end']) for e in properties[unit]]
+            if blocks.get(unit):
+                unit_tz = unit_timezone(unit)
+                window_start = unit_tz.localize(datetime.combine(self.base_date, time(0, 0)))
+                window_end = unit_tz.localize(datetime.combine(horizon, time(0, 0)))
+                for block in blocks[unit]:
+                    stays.extend(iter_block_occurrences(block, window_start, window_end, unit_tz))
+            for start, end in stays:
+                first = (start.date() - self.base_date).days
+                nights = (end.date() - start.date()).days
+                if first < 0:
+                    # A block occurrence running into the window from before base_date.
+                    nights, first = nights + first, 0
+                if nights > 0:
+                    row |= ((1 << nights) - 1) << first
+            self.rows.append(row)
+
+    def _mask(self, start_date, end_date):
+        first = (start_date - self.base_date).days
+        last = (end_date - self.base_date).days
+        first = max(first, 0)
+        if last <= first:
+            return 0
+        return ((1 << (last - first)) - 1) << first
+
+    def booked_nights(self, start_date, end_date):
+        """Booked or closed-out night count per unit for nights in [start_date, end_date)."""
+        mask = self._mask(start_date, end_date)
+        return {unit: bin(row & mask).count("1") for unit, row in zip(self.units, self.rows)}
+
+    def available_units(self, start_date, end_date):
+        """Units with no booked or closed-out night in [start_date, end_date)."""
+        mask = self._mask(start_date, end_date)
+        return [unit for unit, row in zip(self.units, self.rows) if not row & mask]
+
+
+def detect_double_bookings(properties):
+    """Find overlapping reservations within each unit with a sorted sweep.
+
+    Events are visited in start order while a heap keeps the still-running ones
+    keyed by end time, so the cost is O(n log n) plus one step per conflict
+    rather than a comparison of every pair.
+    """
+    conflicts = []
+    for unit, events in properties.items():
+        active = []
+        for seq, ev in enumerate(sorted(events, key=lambda e: (e['start'], e['end']))):
+            while active and active[0][0] <= ev['start']:
+                heapq.heappop(active)
+            for _, _, other in active:
+                conflicts.append({
+                    'unit': unit,
+                    'overlap_start': ev['start'].isoformat(),
+                    'overlap_end': min(ev['end'], other['end']).isoformat(),
+                    'reservations': [
+                        {
+                            'uid': e.get('uid'),
+                            'booking_code': e.get('booking_code'),
+                            'original_booking_code': e.get('original_booking_code'),
+                            'start': e['start'].isoformat(),
+                            'end': e['end'].isoformat(),
+                        }
+                        for e in (other, ev)
+                    ],
+                })
+            heapq.heappush(active, (ev['end'], seq, ev))
+    return conflicts
+
+
+def compute_turnovers(properties):
+    """One turnover per check-out: the departing stay, the unit's next arrival and the gap.
+
+    Every reservation is visited once in start order. Each unit keeps a heap of
+    departures still waiting for an arrival, and the first arrival at or after a
+    check-out closes it, so overlapping (double-booked) stays are never paired.
+    Departures left waiting at the end have no next arrival yet.
+    """
+    arrivals = sorted(
+        ((unit, ev) for unit, events in properties.items() for ev in events),
+        key=lambda item: (item[1]['start'], item[1]['end']),
+    )
+    waiting = defaultdict(list)
+    turnovers = []
+    for seq, (unit, ev) in enumerate(arrivals):
+        pending = waiting[unit]
+        while pending and pending[0][0] <= ev['start']:
+            _, _, departing = heapq.heappop(pending)
+            turnovers.append((departing['end'], unit, turnover_record(unit, departing, ev)))
+        heapq.heappush(pending, (ev['end'], seq, ev))
+    for unit, pending in waiting.items():
+        turnovers.extend((departing['end'], unit, turnover_record(unit, departing, None)) for _, _, departing in sorted(pending))
+    # By instant: the ISO strings carry each unit's own offset, so they do not sort as text.
+    turnovers.sort(key=lambda item: item[:2])
+    return [record for _, _, record in turnovers]
+
+
+def turnover_record(unit, departing, arriving):
+    check_out = departing['end']
+    record = {
+        'unit': unit,
+        'slug': slugify(unit),
+        'check_out': check_out.isoformat(),
+        'departing': {'uid': departing.get('uid'), 'booking_code': departing.get('booking_code')},
+        'next_arrival': None,
+        'arriving': None,
+        'gap_hours': None,
+        'gap_nights': None,
+        'same_day': False,
+    }
+    if arriving is not None:
+        check_in = arriving['start']
+        record.update(
+            next_arrival=check_in.isoformat(),
+            arriving={'uid': arriving.get('uid'), 'booking_code': arriving.get('booking_code')},
+            gap_hours=round((check_in - check_out).total_seconds() / 3600, 2),
+            gap_nights=(check_in.date() - check_out.date()).days,
+            same_day=check_in.date() == check_out.date(),
+        )
+    return record
+
+
+class Snapshot:
+    """Grouped reservations from one refresh, plus indexes derived from them on demand."""
+
+    def __init__(self, properties):
+        self.properties = properties
+        self.created = monotonic()
+        self.built_at = datetime.now(pytz.utc)
+        self._unit_indexes = {}
+        self._slug_map = None
+        self._occupancy = None
+        self._reservation_index = None
+        self.conflicts = []
+        self.expired = False
+        # Per-unit feed fingerprints and the time each one last changed, carried across snapshots.
+        self.unit_digests = {}
+        self.unit_last_modified = {}
+        self.changed_units = []
+        self.stats = {}
+        # When the source feed was last fetched successfully for this or an earlier snapshot.
+        self.source_fetched_at = None
+        self.peer_response = None
+        # The refresh marker as it was when this snapshot was built; see refresh_marker_version().
+        self.refresh_marker = None
+        # Close-outs and owner blocks by unit; kept from the previous snapshot when the fetch fails.
+        self.blocks = {}
+        self._turnovers = None
+        self._turnover_feed = None
+
+    def age_seconds(self):
+        return monotonic() - self.created
+
+    def resolve_key(self, property_name):
+        """Resolve a URL slug to the original property key (legacy hyphen-only links too)."""
+        if self._slug_map is None:
+            self._slug_map = {slugify(k): k for k in self.properties.keys()}
+        key = self._slug_map.get(property_name.lower())
+        if not key:
+            normalized_property_name = property_name.replace("-", " ")
+            if normalized_property_name in self.properties:
+                key = normalized_property_name
+        return key
+
+    def unit_index(self, key):
+        index = self._unit_indexes.get(key)
+        if index is None:
+            index = UnitIndex(self.properties[key])
+            self._unit_indexes[key] = index
+        return index
+
+    def occupancy(self):
+        if self._occupancy is None:
+            self._occupancy = OccupancyBitmap(self.properties, self.blocks)
+        return self._occupancy
+
+    def turnovers(self):
+        if self._turnovers is None:
+            self._turnovers = compute_turnovers(self.properties)
+        return self._turnovers
+
+    def turnover_feed(self):
+        """The turnover calendar (bytes) and its ETag, rendered once per snapshot."""
+        if self._turnover_feed is None:
+            body = render_turnover_calendar(self.turnovers(), self.built_at)
+            self._turnover_feed = (body, hashlib.sha1(body).hexdigest())
+        return self._turnover_feed
+
+    def reservation_index(self):
+        """Map original code, suffixed code and source UID (upper-cased) to (field, unit, event) hits."""
+        if self._reservation_index is None:
+            index = defaultdict(list)
+            for unit, events in self.properties.items():
+                for ev in events:
+                    seen = set()
+                    for field in ('booking_code', 'original_booking_code', 'uid'):
+                        value = ev.get(field)
+                        if not value or value.upper() in seen:
+                            continue
+                        seen.add(value.upper())
+                        index[value.upper()].append((field, unit, ev))
+            self._reservation_index = dict(index)
+        return self._reservation_index
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+# (cache path, mtime) -> Snapshot, so lookups before the first refresh read the cache file once.
+_cache_snapshot = None
+
+
+def shared_state_path(name):
+    """A file next to CACHE_FILE, where every worker process can see it."""
+    return os.path.join(os.path.dirname(os.path.abspath(CACHE_FILE)), name)
+
+
+def refresh_marker_version():
+    """Identifies the last manual refresh or reset by any worker (None before the first one)."""
+    try:
+        return os.stat(shared_state_path(REFRESH_MARKER_FILE)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def mark_snapshot_replaced():
+    """Tell the other workers their snapshot is out of date; returns the new marker version."""
+    try:
+        write_file_atomic(shared_state_path(REFRESH_MARKER_FILE), datetime.now(pytz.utc).isoformat().encode("utf-8"))
+    except OSError as exc:
+        logger.error("Unable to signal the refresh to other workers: %s", exc)
+    return refresh_marker_version()
+
+
+def get_snapshot():
+    """Return the current snapshot, rebuilding it once SNAPSHOT_TTL_SECONDS have passed.
+
+    It is also rebuilt when another worker has run a manual refresh or reset since it was built.
+    """
+    global _snapshot
+    with _snapshot_lock:
+        if (
+            _snapshot is not None and not _snapshot.expired and _snapshot.age_seconds() < SNAPSHOT_TTL_SECONDS
+            and _snapshot.refresh_marker == refresh_marker_version()
+        ):
+            return _snapshot
+        snapshot = _snapshot = build_snapshot(_snapshot)
+    # Outside the lock, so slow receivers never hold up requests waiting for the snapshot.
+    after_refresh(snapshot)
+    return snapshot
+
+
+def current_snapshot():
+    """The installed snapshot without refreshing it; falls back to the cache file before the first refresh.
+
+    The fallback is reused until the cache file changes, so repeated lookups do
+    not rebuild it and its reverse index.
+    """
+    global _cache_snapshot
+    snapshot = _snapshot
+    if snapshot is not None:
+        return snapshot
+    try:
+        version = (CACHE_FILE, os.stat(CACHE_FILE).st_mtime_ns)
+    except OSError:
+        version = (CACHE_FILE, None)
+    cached = _cache_snapshot
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    now = datetime.now(pytz.timezone(TIMEZONE))
+    cache = load_cached_reservations(CACHE_FILE)
+    snapshot = Snapshot(properties_from_cache(cache, now))
+    snapshot.blocks = cached_blocks(cache)
+    _cache_snapshot = (version, snapshot)
+    return snapshot
+
+
+def build_snapshot(previous=None, require_source=False):
+    """Run one refresh cycle: fetch/parse/merge, then the checks that run on every snapshot.
+
+    With require_source, a failed fetch raises ValueError instead of producing a
+    snapshot from the cached reservations, so nothing is rendered or published.
+    """
+    refresh_marker = refresh_marker_version()
+    properties = pull_peer_snapshot(previous) if PEER_LEADER_URL else None
+    if properties is None:
+        properties = parse_and_group_events()
+    stats = dict(last_parse_stats)
+    if require_source and not stats.get('source_ok'):
+        raise ValueError(f"Source feed could not be fetched or parsed: {stats.get('error', 'unknown error')}")
+    snapshot = Snapshot(properties)
+    snapshot.stats = stats
+    snapshot.refresh_marker = refresh_marker
+    if stats.get('source_ok'):
+        snapshot.source_fetched_at = snapshot.built_at
+        snapshot.blocks = last_source_blocks or {}
+    elif previous is not None:
+        snapshot.source_fetched_at = previous.source_fetched_at
+        snapshot.blocks = previous.blocks
+    else:
+        # First snapshot after a restart with the source down: the blocks saved with the cache.
+        snapshot.blocks = last_source_blocks or {}
+
+    stage_started = monotonic()
+    track_unit_changes(snapshot, previous)
+    stats['render_seconds'] = round(monotonic() - stage_started, 4)
+
+    stage_started = monotonic()
+    snapshot.conflicts = detect_double_bookings(snapshot.properties)
+    set_metric('pms_double_bookings', len(snapshot.conflicts))
+    for conflict in snapshot.conflicts:
+        first, second = conflict['reservations']
+        logger.warning(
+            f"Double booking in {conflict['unit']}: {first['booking_code']} ({first['uid']}) "
+            f"overlaps {second['booking_code']} ({second['uid']})"
+        )
+    stats['checks_seconds'] = round(monotonic() - stage_started, 4)
+
+    if PUBLISH_DIR:
+        stage_started = monotonic()
+        try:
+            stats['published'] = len(publish_snapshot(snapshot, PUBLISH_DIR))
+        except OSError as exc:
+            logger.error("Unable to publish rendered feeds to %s: %s", PUBLISH_DIR, exc)
+        stats['publish_seconds'] = round(monotonic() - stage_started, 4)
+    return snapshot
+
+
+def refresh_snapshot():
+    """Rebuild the snapshot now, swapping it in only if the source feed was fetched successfully."""
+    global _snapshot
+    started = monotonic()
+    with _snapshot_lock:
+        snapshot = build_snapshot(_snapshot, require_source=True)
+        snapshot.refresh_marker = mark_snapshot_replaced()
+        _snapshot = snapshot
+    after_refresh(snapshot)
+    snapshot.stats['total_seconds'] = round(monotonic() - started, 4)
+    return snapshot
+
+
+def refresh_report(snapshot):
+    stats = snapshot.stats
+    return {
+        'status': 'ok',
+        'built_at': snapshot.built_at.isoformat(),
+        'timings': {k[:-len('_seconds')]: v for k, v in stats.items() if k.endswith('_seconds')},
+        'changes': {
+            'units_changed': snapshot.changed_units,
+            'reservations': sum(len(v) for v in snapshot.properties.values()),
+            'source_reservations': stats.get('source_reservations'),
+            'restored_started': stats.get('restored_started'),
+            'cancelled_future': stats.get('cancelled_future'),
+            'conflicts': len(snapshot.conflicts),
+        },
+    }
+
+
+# This process's latest job; the copy in REFRESH_STATUS_FILE is the one all workers share.
+_refresh_job = None
+_refresh_job_lock = threading.Lock()
+
+
+def save_refresh_job(job):
+    try:
+        write_file_atomic(shared_state_path(REFRESH_STATUS_FILE), json.dumps(job).encode("utf-8"))
+    except OSError as exc:
+        logger.error("Unable to share the refresh job status with other workers: %s", exc)
+
+
+def load_refresh_job():
+    """The latest background refresh started by any worker, or None."""
+    try:
+        with open(shared_state_path(REFRESH_STATUS_FILE), "r") as f:
+            job = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return _refresh_job
+    return job if isinstance(job, dict) else _refresh_job
+
+
+def start_background_refresh():
+    """Start a refresh on a worker thread unless one is already running in any worker; returns the job record."""
+    global _refresh_job
+    with _refresh_job_lock:
+        current = load_refresh_job()
+        if current is not None and current.get('state') == 'running':
+            started_at = datetime.fromisoformat(current['started_at'])
+            if (datetime.now(pytz.utc) - started_at).total_seconds() < REFRESH_JOB_STALE_SECONDS:
+                return current
+        job = _refresh_job = {
+            'id': uuid.uuid4().hex[:12],
+            'state': 'running',
+            'started_at': datetime.now(pytz.utc).isoformat(),
+        }
+        save_refresh_job(job)
+    threading.Thread(target=_run_refresh_job, args=(job,), daemon=True).start()
+    return job
+
+
+def _run_refresh_job(job):
+    try:
+        result = refresh_report(refresh_snapshot())
+        job.update(state='succeeded', result=result)
+    except Exception as exc:
+        logger.error("Background refresh failed: %s", exc)
+        job.update(state='failed', error=str(exc))
+    job['finished_at'] = datetime.now(pytz.utc).isoformat()
+    save_refresh_job(job)
+
+
+def peer_signature(body):
+    return "sha256=" + hmac.new(PEER_SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+
+def peer_snapshot_response(snapshot):
+    """The signed body the leader serves on /peer/snapshot, built once per snapshot.
+
+    Returns None when the leader has never fetched the source, so it has no lease to offer.
+    """
+    if snapshot.source_fetched_at is None:
+        return None
+    if snapshot.peer_response is None:
+        now = datetime.now(pytz.timezone(TIMEZONE))
+        reservations = cache_entries(snapshot.properties, now)
+        blocks = block_entries(snapshot.blocks)
+        content = json.dumps([reservations, blocks], sort_keys=True, default=str)
+        body = json.dumps({
+            'format': PEER_SNAPSHOT_FORMAT,
+            'version': hashlib.sha1(content.encode("utf-8")).hexdigest(),
+            'built_at': snapshot.built_at.isoformat(),
+            'lease_expires_at': (snapshot.source_fetched_at + timedelta(seconds=PEER_LEASE_SECONDS)).isoformat(),
+            'reservations': reservations,
+            'blocks': blocks,
+        }, default=str).encode("utf-8")
+        snapshot.peer_response = (body, peer_signature(body))
+    return snapshot.peer_response
+
+
+def verify_peer_snapshot(body, signature, previous=None):
+    """Check a leader's snapshot is authentic, current and not older than the one in use; returns the payload."""
+    if not hmac.compare_digest(signature.encode(), peer_signature(body).encode()):
+        raise ValueError("Peer snapshot signature does not match")
+    payload = json.loads(body)
+    if payload.get('format') != PEER_SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported peer snapshot format: {payload.get('format')!r}")
+    if datetime.fromisoformat(payload['lease_expires_at']) <= datetime.now(pytz.utc):
+        raise ValueError(f"Leader's lease expired at {payload['lease_expires_at']}")
+    in_use = previous.stats.get('peer_built_at') if previous is not None else None
+    if in_use and datetime.fromisoformat(payload['built_at']) < datetime.fromisoformat(in_use):
+        raise ValueError(f"Peer snapshot from {payload['built_at']} is older than the one in use ({in_use})")
+    return payload
+
+
+def pull_peer_snapshot(previous=None):
+    """Take the leader's snapshot as this refresh's reservations; None means fetch the source instead.
+
+    The leader's reservations also replace the local cache file, so a follower that later has
+    to fetch for itself merges against the same started bookings the leader kept.
+    """
+    global last_parse_stats, last_source_blocks
+    started = monotonic()
+    try:
+        response = requests.get(
+            PEER_LEADER_URL.rstrip("/") + "/peer/snapshot",
+            headers={'X-Peer-Token': PEER_SECRET or ""},
+            timeout=PEER_TIMEOUT_SECONDS,
+        )
+        if response.status_code != 200:
+            raise ValueError(f"Leader returned HTTP {response.status_code}")
+        payload = verify_peer_snapshot(response.content, response.headers.get('X-Peer-Signature', ""), previous)
+    except (requests.RequestException, ValueError, KeyError) as exc:
+        inc_metric('pms_peer_pull_failures')
+        logger.warning("Not using the leader's snapshot; fetching the source directly: %s", exc)
+        return None
+
+    now = datetime.now(pytz.timezone(TIMEZONE))
+    properties = properties_from_cache(payload['reservations'], now)
+    last_source_blocks = blocks_from_entries(payload.get('blocks', {}))
+    save_cached_reservations(payload['reservations'], CACHE_FILE, last_source_blocks)
+    inc_metric('pms_peer_pulls')
+    last_parse_stats = {
+        'source_ok': True,
+        'peer_leader': PEER_LEADER_URL,
+        'peer_version': payload['version'],
+        'peer_built_at': payload['built_at'],
+        'source_reservations': sum(len(v) for v in payload['reservations'].values()),
+        'fetch_parse_seconds': round(monotonic() - started, 4),
+    }
+    logger.info("Using snapshot %s built by the leader at %s", payload['version'][:12], payload['built_at'])
+    return properties
+
+
+def publish_snapshot(snapshot, publish_dir):
+    """Atomically write every unit's rendered feed (plus a gzip variant) to publish_dir.
+
+    Files whose content is unchanged are left alone so their mtime, and with it the
+    ETag/Last-Modified served for them, only moves when the feed really changes.
+    Feeds of units that are gone, or that could not be rendered this time, are
+    removed so a stale file is never served in their place. Returns the keys whose
+    feeds were (re)written.
+    """
+    os.makedirs(publish_dir, exist_ok=True)
+    changed = []
+    published = set()
+    for key, events in snapshot.properties.items():
+        path = os.path.join(publish_dir, f"{slugify(key)}.ics")
+        try:
+            ical_bytes = render_property_calendar(key, events, snapshot.blocks.get(key, ()))
+        except Exception as exc:
+            logger.error("Not publishing %s and removing its old feed; it could not be rendered: %s", key, exc)
+            continue
+        published.add(os.path.basename(path))
+        try:
+            with open(path, "rb") as f:
+                if f.read() == ical_bytes:
+                    continue
+        except FileNotFoundError:
+            pass
+        write_file_atomic(path + ".gz", gzip.compress(ical_bytes, mtime=0))
+        write_file_atomic(path, ical_bytes)
+        changed.append(key)
+    for name in os.listdir(publish_dir):
+        feed = name[:-len(".gz")] if name.endswith(".ics.gz") else name
+        if feed.endswith(".ics") and feed not in published:
+            try:
+                os.remove(os.path.join(publish_dir, name))
+                logger.info("Removed stale published feed %s", name)
+            except FileNotFoundError:
+                pass
+    logger.info(f"Published {len(changed)} changed feeds to {publish_dir}")
+    return changed
+
+
+def published_feed_response(key):
+    """Serve a published feed from disk, or return None if it has not been published."""
+    filename = f"{slugify(key)}.ics"
+    path = os.path.join(PUBLISH_DIR, filename)
+    if not os.path.exists(path):
+        return None
+
+    if X_ACCEL_REDIRECT_PREFIX:
+        response = Response(mimetype='text/calendar')
+        response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + filename
+        return response
+
+    gz_path = path + ".gz"
+    if "gzip" in request.headers.get("Accept-Encoding", "") and os.path.exists(gz_path):
+        response = send_file(gz_path, mimetype='text/calendar', conditional=True, etag=True)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_file(path, mimetype='text/calendar', conditional=True, etag=True)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def invalidate_snapshot():
+    """Make the next request rebuild the snapshot (the old one is kept for change tracking)."""
+    with _snapshot_lock:
+        if _snapshot is not None:
+            _snapshot.expired = True
+
+
+def track_unit_changes(snapshot, previous):
+    """Fingerprint each unit's rendered feed and note which ones differ from the previous snapshot.
+
+    A unit whose blocks fail to render loses them from this snapshot, and one that
+    cannot be rendered at all is left without a digest; either way, the other units
+    and the snapshot itself are unaffected.
+    """
+    for key, events in snapshot.properties.items():
+        try:
+            try:
+                body = render_property_calendar(key, events, snapshot.blocks.get(key, ()))
+            except Exception as exc:
+                if not snapshot.blocks.get(key):
+                    raise
+                logger.error("Unable to render blocks for %s; exporting its reservations only: %s", key, exc)
+                snapshot.blocks = {unit: blocks for unit, blocks in snapshot.blocks.items() if unit != key}
+                body = render_property_calendar(key, events)
+        except Exception as exc:
+            logger.error("Unable to render the feed for %s: %s", key, exc)
+            continue
+        digest = hashlib.sha1(body).hexdigest()
+        snapshot.unit_digests[key] = digest
+        if previous is not None and previous.unit_digests.get(key) == digest:
+            snapshot.unit_last_modified[key] = previous.unit_last_modified[key]
+        else:
+            snapshot.unit_last_modified[key] = snapshot.built_at
+            if previous is not None:
+                snapshot.changed_units.append(key)
+    if previous is not None:
+        snapshot.changed_units.extend(k for k in previous.unit_digests if k not in snapshot.unit_digests)
+
+
+def after_refresh(snapshot):
+    """Notify outside systems about units whose content changed in this snapshot."""
+    if snapshot.changed_units:
+        logger.info(f"Refresh changed {len(snapshot.changed_units)} unit feeds: {', '.join(snapshot.changed_units)}")
+        if purge_hooks:
+            # The root page lists every unit, so it goes stale along with them.
+            purges.submit([surrogate_key(key) for key in snapshot.changed_units] + [INDEX_SURROGATE_KEY])
+        notify_subscribers(snapshot)
+
+
+INDEX_SURROGATE_KEY = "index"
+
+def surrogate_key(key):
+    return f"unit-{slugify(key)}"
+
+
+# Callables taking a list of surrogate keys; each one purges those keys from some shared cache.
+purge_hooks = []
+
+def http_purge_hook(url, timeout=5):
+    """A purge hook that sends one PURGE request listing the keys in a Surrogate-Key header."""
+    def purge(keys):
+        response = requests.request("PURGE", url, headers={'Surrogate-Key': " ".join(keys)}, timeout=timeout)
+        if response.status_code >= 400:
+            raise ValueError(f"Purge endpoint returned HTTP {response.status_code}")
+    return purge
+
+if PURGE_URL:
+    purge_hooks.append(http_purge_hook(PURGE_URL))
+
+def purge_surrogate_keys(keys):
+    for hook in purge_hooks:
+        try:
+            hook(keys)
+            inc_metric('pms_purges_sent')
+        except Exception as exc:
+            inc_metric('pms_purge_failures')
+            logger.error("Purge hook failed for %s: %s", ", ".join(keys), exc)
+
+
+class PurgeQueue:
+    """Runs purge_surrogate_keys() on a background thread, so a slow CDN never delays the request that refreshed."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._thread = None
+
+    def submit(self, keys):
+        with self._lock:
+            self._pending += 1
+            # Started on first use so each gunicorn worker gets its own thread after forking.
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="purges", daemon=True)
+                self._thread.start()
+        self._queue.put(keys)
+
+    def wait_idle(self, timeout=None):
+        """Block until every submitted purge has been sent (or failed); False on timeout."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def _run(self):
+        while True:
+            keys = self._queue.get()
+            try:
+                purge_surrogate_keys(keys)
+            finally:
+                with self._idle:
+                    self._pending -= 1
+                    self._idle.notify_all()
+
+
+purges = PurgeQueue()
+
+
+_subscriptions_lock = threading.Lock()
+
+def load_subscriptions():
+    if not os.path.exists(WEBHOOK_SUBSCRIPTIONS_FILE):
+        return []
+    with open(WEBHOOK_SUBSCRIPTIONS_FILE, "r") as f:
+        return json.load(f)
+
+def save_subscriptions(subscriptions):
+    write_file_atomic(WEBHOOK_SUBSCRIPTIONS_FILE, json.dumps(subscriptions, indent=2).encode("utf-8"))
+
+
+class WebhookDispatcher:
+    """Sends webhook deliveries from a bounded in-memory queue on a single background thread.
+
+    Failed deliveries are rescheduled with exponential backoff instead of being retried in
+    place, so one slow or failing receiver delays only its own deliveries, never a refresh.
+    """
+
+    def __init__(self, max_pending=WEBHOOK_QUEUE_MAX):
+        self.max_pending = max_pending
+        self._queue = queue.Queue()
+        self._retries = []  # (due, seq, delivery) heap, only touched by the worker thread
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._thread = None
+
+    def submit(self, url, payload):
+        """Queue a delivery; returns False (and drops it) when the queue is full."""
+        delivery = {
+            'id': uuid.uuid4().hex,
+            'url': url,
+            'body': json.dumps(payload).encode("utf-8"),
+            'attempts': 0,
+        }
+        with self._lock:
+            if self._pending >= self.max_pending:
+                inc_metric('pms_webhooks_dropped')
+                logger.warning("Webhook queue is full; dropping delivery to %s", url)
+                return False
+            self._pending += 1
+            set_metric('pms_webhooks_pending', self._pending)
+            # Started on first use so each gunicorn worker gets its own thread after forking.
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="webhooks", daemon=True)
+                self._thread.start()
+        self._queue.put(delivery)
+        return True
+
+    def wait_idle(self, timeout=None):
+        """Block until every queued delivery has succeeded or given up; False on timeout."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def _run(self):
+        while True:
+            timeout = max(self._retries[0][0] - monotonic(), 0) if self._retries else None
+            try:
+                self._attempt(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                pass
+            while self._retries and self._retries[0][0] <= monotonic():
+                self._attempt(heapq.heappop(self._retries)[2])
+
+    def _attempt(self, delivery):
+        delivery['attempts'] += 1
+        try:
+            post_webhook(delivery)
+        except Exception as exc:
+            if delivery['attempts'] < WEBHOOK_MAX_ATTEMPTS:
+                delay = WEBHOOK_RETRY_BASE_SECONDS * 2 ** (delivery['attempts'] - 1)
+                inc_metric('pms_webhook_retries')
+                logger.warning("Webhook to %s failed (attempt %d), retrying in %ss: %s",
+                               delivery['url'], delivery['attempts'], delay, exc)
+                heapq.heappush(self._retries, (monotonic() + delay, next(self._seq), delivery))
+                return
+            inc_metric('pms_webhook_failures')
+            logger.error("Giving up on webhook to %s after %d attempts: %s", delivery['url'], delivery['attempts'], exc)
+        else:
+            inc_metric('pms_webhooks_delivered')
+        with self._idle:
+            self._pending -= 1
+            set_metric('pms_webhooks_pending', self._pending)
+            self._idle.notify_all()
+
+
+def post_webhook(delivery):
+    headers = {
+        'Content-Type': 'application/json',
+        'X-Webhook-Delivery': delivery['id'],
+        'X-Webhook-Attempt': str(delivery['attempts']),
+    }
+    if WEBHOOK_SECRET:
+        digest = hmac.new(WEBHOOK_SECRET.encode(), delivery['body'], hashlib.sha256).hexdigest()
+        headers['X-Webhook-Signature'] = f"sha256={digest}"
+    response = requests.post(delivery['url'], data=delivery['body'], headers=headers, timeout=WEBHOOK_TIMEOUT_SECONDS)
+    if response.status_code >= 300:
+        raise ValueError(f"Receiver returned HTTP {response.status_code}")
+
+
+webhooks = WebhookDispatcher()
+
+def claim_unit_change(key, digest):
+    """Claim delivery of one unit's change; False when another worker already claimed it.
+
+    The claim is an O_EXCL marker named after the unit and its new digest. Claiming
+    clears the unit's older markers, so a later change back to an earlier feed is
+    delivered again.
+    """
+    directory = os.path.join(os.path.dirname(os.path.abspath(WEBHOOK_SUBSCRIPTIONS_FILE)), WEBHOOK_CLAIMS_DIR)
+    os.makedirs(directory, exist_ok=True)
+    prefix = slugify(key) + "."
+    name = prefix + (digest or "removed")
+    try:
+        os.close(os.open(os.path.join(directory, name), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+    except FileExistsError:
+        return False
+    for other in os.listdir(directory):
+        if other.startswith(prefix) and other != name:
+            try:
+                os.remove(os.path.join(directory, other))
+            except FileNotFoundError:
+                pass
+    return True
+
+def notify_subscribers(snapshot):
+    """Queue one delivery per callback URL, listing every changed unit that URL subscribed to.
+
+    Every gunicorn worker sees the same changes, so each unit's change is claimed
+    first and only the worker that claims it sends it.
+    """
+    try:
+        subscriptions = load_subscriptions()
+    except (OSError, ValueError) as exc:
+        logger.error("Could not read webhook subscriptions: %s", exc)
+        return
+    subscribed = {subscription['unit'] for subscription in subscriptions}
+    changed = set()
+    for key in snapshot.changed_units:
+        if key not in subscribed:
+            continue
+        try:
+            if not claim_unit_change(key, snapshot.unit_digests.get(key)):
+                continue
+        except OSError as exc:
+            # Sending a change twice is better than not sending it at all.
+            logger.warning("Could not claim the webhook delivery for %s; sending it anyway: %s", key, exc)
+        changed.add(key)
+    batches = defaultdict(list)
+    for subscription in subscriptions:
+        if subscription['unit'] in changed and subscription['unit'] not in batches[subscription['url']]:
+            batches[subscription['url']].append(subscription['unit'])
+    for url, units in batches.items():
+        webhooks.submit(url, {
+            'event': 'calendars.changed',
+            'built_at': snapshot.built_at.isoformat(),
+            'units': [
+                {
+                    'unit': key,
+                    'calendar': f"/calendar/{slugify(key)}.ics",
+                    'etag': snapshot.unit_digests.get(key),
+                    'removed': key not in snapshot.properties,
+                }
+                for key in units
+            ],
+        })
+
+
+def apply_cache_headers(response, snapshot, key=None, vary='Accept-Encoding'):
+    """Let shared caches hold a response until the snapshot behind it is due for refresh."""
+    max_age = max(int(SNAPSHOT_TTL_SECONDS - snapshot.age_seconds()), 0)
+    response.headers['Cache-Control'] = f"public, max-age={max_age}, stale-while-revalidate={PUBLISHED_TTL_SECONDS}"
+    response.vary.add(vary)
+    if key is not None:
+        response.headers['Surrogate-Key'] = surrogate_key(key)
+        if response.last_modified is None and key in snapshot.unit_last_modified:
+            response.last_modified = snapshot.unit_last_modified[key]
+    return response
+
+
+def parse_window_bound(value, tz=None):
+    """Parse a ?from=/?to= value (ISO date or datetime) into an aware datetime local to tz (default TIMEZONE)."""
+    tz = tz or pytz.timezone(TIMEZONE)
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid date: {value!r}; expected YYYY-MM-DD") from None
+    if parsed.tzinfo is None:
+        return tz.localize(parsed)
+    return parsed.astimezone(tz)
+
+
+def requested_window(args, now=None, tz=None):
+    """Work out the [start, end) window for a feed request in tz (default TIMEZONE); either side may be None."""
+    tz = tz or pytz.timezone(TIMEZONE)
+    window_start = parse_window_bound(args['from'], tz) if args.get('from') else None
+    window_end = parse_window_bound(args['to'], tz) if args.get('to') else None
+    if window_end is None and DEFAULT_HORIZON_DAYS is not None:
+        base = window_start or local_day_start(now or datetime.now(tz), tz)
+        window_end = base + timedelta(days=DEFAULT_HORIZON_DAYS)
+    if window_start and window_end and window_end <= window_start:
+        raise ValueError("'to' must be after 'from'")
+    return window_start, window_end
+
+
+def collapsed_stacks(stats):
+    """Fold cProfile data into "caller;callee <microseconds>" lines for flamegraph tools.
+
+    cProfile only records caller->callee edges, not whole stacks, so a function's
+    own time is split across the paths reaching it in proportion to the cumulative
+    time each caller accounts for.
+    """
+    entries = stats.stats
+    callees = defaultdict(list)
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees[caller].append((func, edge[3]))
+
+    def label(func):
+        filename, line, name = func
+        return f"{name} ({os.path.basename(filename)}:{line})" if line else name
+
+    folded = Counter()
+
+    def walk(func, path, on_path, share):
+        own_time = entries[func][2] * share
+        if own_time > 0:
+            folded[path] += own_time
+        for callee, edge_time in callees.get(func, ()):
+            callee_time = entries[callee][3]
+            child_share = share * edge_time / callee_time if callee_time else 0
+            if callee in on_path or child_share * callee_time < 1e-6:
+                continue
+            walk(callee, f"{path};{label(callee)}", on_path | {callee}, child_share)
+
+    for func, (_, _, _, _, callers) in entries.items():
+        if not callers:
+            walk(func, label(func), {func}, 1.0)
+    return "".join(f"{path} {round(seconds * 1e6)}\n" for path, seconds in sorted(folded.items()) if seconds >= 5e-7)
+
+
+def profiled(view):
+    """Run the view under cProfile when an authorized request asks for it with X-Profile.
+
+    ``X-Profile: stats`` or ``collapsed`` returns the profile instead of the page;
+    any other value writes <name>.pstats and <name>.collapsed to PROFILE_DIR and
+    names them in an X-Profile-Files header. Untriggered requests only pay for a
+    header lookup.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        mode = request.headers.get('X-Profile')
+        if not mode or not debug_authorized():
+            return view(*args, **kwargs)
+
+        def run():
+            response = app.make_response(view(*args, **kwargs))
+            if response.is_streamed:
+                # Render streamed bodies now so their cost lands in the profile.
+                response.make_sequence()
+            return response
+
+        profiler = cProfile.Profile()
+        response = profiler.runcall(run)
+        stats = pstats.Stats(profiler)
+
+        if mode == 'stats':
+            report = io.StringIO()
+            stats.stream = report
+            stats.sort_stats('cumulative').print_stats(60)
+            return Response(report.getvalue(), mimetype='text/plain')
+        if mode == 'collapsed':
+            return Response(collapsed_stacks(stats), mimetype='text/plain')
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, f"{datetime.now(pytz.utc).strftime('%Y%m%dT%H%M%S%fZ')}-{view.__name__}")
+        stats.dump_stats(base + ".pstats")
+        with open(base + ".collapsed", "w") as f:
+            f.write(collapsed_stacks(stats))
+        logger.info("Wrote request profile to %s.pstats", base)
+        response.headers['X-Profile-Files'] = f"{base}.pstats, {base}.collapsed"
+        return response
+    return wrapper
+
+
 @app.route("/calendar/<property_name>.ics")
+@profiled
 def export_property_calendar(property_name):
-    props = parse_and_group_events()
+    snapshot = get_snapshot()
+    props = snapshot.properties
 
-    # Resolve slug to the original property key (support legacy hyphen-only links too)
-    slug_map = {slugify(k): k for k in props.keys()}
-    key = slug_map.get(property_name.lower())
-    if not key:
-        normalized_property_name = property_name.replace("-", " ")
-        if normalized_property_name in props:
-            key = normalized_property_name
+    key = snapshot.resolve_key(property_name)
     if not key:
         return Response(f"No calendar found for {property_name}", status=404)
 
+    try:
+        window_start, window_end = requested_window(request.args, tz=unit_timezone(key))
+    except ValueError as exc:
+        return Response(str(exc), status=400)
+    if window_start is None and window_end is None:
+        if PUBLISH_DIR:
+            response = published_feed_response(key)
+            if response is not None:
+                return apply_cache_headers(response, snapshot, key)
+        events = props[key]
+    else:
+        events = snapshot.unit_index(key).window(window_start, window_end)
+
+    blocks = snapshot.blocks.get(key, ())
+    if STREAM_MIN_EVENTS is not None and len(events) >= STREAM_MIN_EVENTS:
+        # No Content-Length, so the body goes out with chunked transfer as it is rendered.
+        response = Response(iter_property_calendar(key, events, blocks, window_start, window_end), mimetype='text/calendar')
+        # Keep make_conditional() from buffering the generator to compute a Content-Length.
+        response.implicit_sequence_conversion = False
+    else:
+        response = Response(render_property_calendar(key, events, blocks, window_start, window_end), mimetype='text/calendar')
+    if events is props[key] and key in snapshot.unit_digests:
+        response.set_etag(snapshot.unit_digests[key])
+    apply_cache_headers(response, snapshot, key)
+    return response.make_conditional(request)
+
+
+def unit_code_for(key):
+    """Short code used in exported UIDs: the MAO in "Apartment MAO - Five Bedroom", else the slug."""
+    unit_code_match = re.match(r'^(Apartment|Room)\s+([A-Z]{2,5})\b', key)
+    return unit_code_match.group(2) if unit_code_match else slugify(key)
+
+
+def render_property_calendar(key, events, blocks=(), window_start=None, window_end=None):
+    """Render one unit's events (and blocks) as an iCal document (bytes)."""
+    return b"".join(iter_property_calendar(key, events, blocks, window_start, window_end))
+
+
+def iter_property_calendar(key, events, blocks=(), window_start=None, window_end=None):
+    """Yield one unit's iCal document piece by piece: header, each VEVENT, VTIMEZONE, footer.
+
+    Each VEVENT comes from vevent_cache when its fields are unchanged, so only new
+    or modified reservations are serialized again. Blocks overlapping the window
+    follow the reservations, recurring ones expanded by iter_block_occurrences().
+    """
     # Build VCALENDAR matching Hospitable-style headers
     cal_out = ICal()
     cal_out.add('prodid', 'https://pms-calendar.fly.dev/')
     cal_out.add('version', '2.0')
     cal_out.add('calscale', 'GREGORIAN')
-    cal_out.add('x-published-ttl', 'PT30M')
+    cal_out.add('x-published-ttl', f'PT{PUBLISHED_TTL_SECONDS // 60}M')
     relcalid = f"{slugify(key)}-property@pms-calendar.fly.dev"
     cal_out.add('x-wr-relcalid', relcalid)
     cal_out.add('x-wr-caldesc', f'Reservation feed for {key} (provided by https://pms-calendar.fly.dev/)')
     cal_out.add('x-wr-calname', key)
 
+    # Build a UID that is unique per PMS by combining the source UID with the unit code (e.g., MAO, AYA).
+    unit_code = unit_code_for(key)
+
+    unit_tz = unit_timezone(key)
+    calendar_end = b"END:VCALENDAR\r\n"
+    yield cal_out.to_ical()[:-len(calendar_end)]
+
     # Add events
-    for ev in props[key]:
-        e = IEvent()
+    first_year = last_year = None
+    for ev in events:
+        if first_year is None or ev['start'].year < first_year:
+            first_year = ev['start'].year
+        if last_year is None or ev['end'].year > last_year:
+            last_year = ev['end'].year
+        fingerprint = (
+            ev.get('uid'), unit_code, unit_tz.zone, ev.get('booking_code'), ev.get('original_booking_code'),
+            ev['start'], ev['end'], ev.get('dtstamp'), ev.get('version', 1),
+            ev['summary'], ev['description'], ev.get('location'),
+            tuple(ev['geo']) if isinstance(ev.get('geo'), (list, tuple)) else ev.get('geo'),
+        )
+        fragment = vevent_cache.get(fingerprint)
+        if fragment is None:
+            fragment = render_event(ev, unit_code, unit_tz).to_ical()
+            vevent_cache.put(fingerprint, fragment)
+        yield fragment
+
+    if blocks:
+        lower = window_start or datetime.now(unit_tz).replace(hour=0, minute=0, second=0, microsecond=0)
+        upper = window_end or lower + timedelta(days=BLOCK_HORIZON_DAYS)
+        for block in blocks:
+            for start, end in iter_block_occurrences(block, lower, upper, unit_tz):
+                if first_year is None or start.year < first_year:
+                    first_year = start.year
+                if last_year is None or end.year > last_year:
+                    last_year = end.year
+                fingerprint = (
+                    'block', block['uid'], unit_code, unit_tz.zone, start, end,
+                    block['all_day'], block['summary'], block.get('dtstamp'), bool(block.get('rrule')),
+                )
+                fragment = vevent_cache.get(fingerprint)
+                if fragment is None:
+                    fragment = render_block(block, start, end, unit_code, unit_tz).to_ical()
+                    vevent_cache.put(fingerprint, fragment)
+                yield fragment
+
+    if first_year is None:
+        first_year = last_year = datetime.now(unit_tz).year
+    yield vtimezone_fragment(unit_tz.zone, first_year, last_year)
+    yield calendar_end
+
+
+def render_event(ev, unit_code, unit_tz=None):
+    e = IEvent()
+
+    src_uid = ev.get('uid') or f"{int(ev['start'].timestamp())}@staypr"
+    src_uid_left = src_uid.split('@', 1)[0] if '@' in src_uid else src_uid
+    combined_uid = f"{src_uid_left}+{unit_code}@staypr"
+    e.add('uid', combined_uid)
+    # Expose original identifiers for debugging/traceability
+    e.add('X-ORIGINAL-UID', src_uid)
+    e.add('X-UNIT-CODE', unit_code)
+    if ev.get('booking_code'):
+        e.add('X-RESERVATION-CODE', ev.get('booking_code'))
+    if ev.get('original_booking_code'):
+        e.add('X-ORIGINAL-RESERVATION-CODE', ev.get('original_booking_code'))
+
+    ev_dtstamp = None
+    try:
+        ev_dtstamp = datetime.fromisoformat(ev.get('dtstamp')).astimezone(pytz.utc) if ev.get('dtstamp') else None
+    except Exception:
+        pass
+
+    event_dtstamp = ev_dtstamp if ev_dtstamp else datetime.now(pytz.utc)
+    e.add('dtstamp', event_dtstamp)
+    e.add('last-modified', event_dtstamp)
+    e.add('status', 'CONFIRMED')
+    e.add('transp', 'OPAQUE')
+    try:
+        sequence = int(ev.get('version', 1))
+    except (TypeError, ValueError):
+        sequence = 1
+    e.add('sequence', max(sequence, 0))
+    e.add('summary', ev['summary'])
+    e.add('description', ev['description'])
+
+    # DTSTART/DTEND as local times with TZID set to the unit's zone
+    unit_tz = unit_tz or pytz.timezone(TIMEZONE)
+    e.add('dtstart', ev['start'].astimezone(unit_tz))
+    e['DTSTART'].params['TZID'] = unit_tz.zone
+    e.add('dtend', ev['end'].astimezone(unit_tz))
+    e['DTEND'].params['TZID'] = unit_tz.zone
+
+    if ev.get('location'):
+        e.add('location', ev['location'])
+    if ev.get('geo') and isinstance(ev['geo'], (list, tuple)) and len(ev['geo']) == 2:
+        e.add('geo', ev['geo'])
+    return e
+
+
+def iter_block_occurrences(block, window_start, window_end, unit_tz):
+    """Yield (start, end) for each occurrence of a block that overlaps [window_start, window_end).
+
+    Recurring blocks are expanded one occurrence at a time in the unit's local time and
+    stop at window_end, so a rule with no end never materializes more than the window.
+    """
+    if not block.get('rrule'):
+        if block['start'] < window_end and block['end'] > window_start:
+            yield block['start'], block['end']
+        return
+    first = block['start'].astimezone(unit_tz).replace(tzinfo=None)
+    duration = block['end'].astimezone(unit_tz).replace(tzinfo=None) - first
+    excluded = set(block.get('exdates') or ())
+    # Occurrences starting up to one duration before the window still overlap it.
+    lower = (window_start.astimezone(unit_tz).replace(tzinfo=None) - duration)
+    upper = window_end.astimezone(unit_tz).replace(tzinfo=None)
+    rule = rrulestr(block['rrule'], dtstart=first, ignoretz=True)
+    for occurrence in rule.xafter(lower):
+        if occurrence >= upper:
+            break
+        if occurrence.isoformat() in excluded:
+            continue
+        yield unit_tz.localize(occurrence), unit_tz.localize(occurrence + duration)
 
-        # Build a UID that is unique per PMS by combining the source UID with the unit code (e.g., MAO, AYA).
-        unit_code_match = re.match(r'^(Apartment|Room)\s+([A-Z]{2,5})\b', key)
-        unit_code = unit_code_match.group(2) if unit_code_match else slugify(key)
 
-        src_uid = ev.get('uid') or f"{int(ev['start'].timestamp())}@staypr"
-        src_uid_left = src_uid.split('@', 1)[0] if '@' in src_uid else src_uid
-        combined_uid = f"{src_uid_left}+{unit_code}@staypr"
-        e.add('uid', combined_uid)
-        # Expose original identifiers for debugging/traceability
-        e.add('X-ORIGINAL-UID', src_uid)
-        e.add('X-UNIT-CODE', unit_code)
-        if ev.get('booking_code'):
-            e.add('X-RESERVATION-CODE', ev.get('booking_code'))
-        if ev.get('original_booking_code'):
-            e.add('X-ORIGINAL-RESERVATION-CODE', ev.get('original_booking_code'))
+def render_block(block, start, end, unit_code, unit_tz):
+    """One occurrence of a close-out or owner block as a VEVENT marked X-EVENT-TYPE:BLOCK."""
+    e = IEvent()
 
-        ev_dtstamp = None
-        try:
-            ev_dtstamp = datetime.fromisoformat(ev.get('dtstamp')).astimezone(pytz.utc) if ev.get('dtstamp') else None
-        except Exception:
-            pass
+    src_uid = block['uid'] or f"{int(block['start'].timestamp())}@staypr"
+    src_uid_left = src_uid.split('@', 1)[0] if '@' in src_uid else src_uid
+    if block.get('rrule'):
+        # Each expanded occurrence needs its own UID.
+        src_uid_left = f"{src_uid_left}-{start.strftime('%Y%m%dT%H%M')}"
+    e.add('uid', f"{src_uid_left}+{unit_code}@staypr")
+    e.add('X-ORIGINAL-UID', src_uid)
+    e.add('X-UNIT-CODE', unit_code)
+    e.add('X-EVENT-TYPE', 'BLOCK')
+
+    block_dtstamp = None
+    try:
+        block_dtstamp = datetime.fromisoformat(block['dtstamp']).astimezone(pytz.utc) if block.get('dtstamp') else None
+    except Exception:
+        pass
+    e.add('dtstamp', block_dtstamp or datetime.now(pytz.utc))
+    e.add('status', 'CONFIRMED')
+    e.add('transp', 'OPAQUE')
+    e.add('categories', ['BLOCK'])
+    e.add('summary', 'Blocked')
+    e.add('description', block['summary'])
+
+    if block['all_day']:
+        e.add('dtstart', start.date())
+        e.add('dtend', end.date())
+    else:
+        e.add('dtstart', start)
+        e['DTSTART'].params['TZID'] = unit_tz.zone
+        e.add('dtend', end)
+        e['DTEND'].params['TZID'] = unit_tz.zone
+    return e
 
-        event_dtstamp = ev_dtstamp if ev_dtstamp else datetime.now(pytz.utc)
-        e.add('dtstamp', event_dtstamp)
-        e.add('last-modified', event_dtstamp)
-        e.add('status', 'CONFIRMED')
-        e.add('transp', 'OPAQUE')
-        try:
-            sequence = int(ev.get('version', 1))
-        except (TypeError, ValueError):
-            sequence = 1
-        e.add('sequence', max(sequence, 0))
-        e.add('summary', ev['summary'])
-        e.add('description', ev['description'])
-
-        # DTSTART/DTEND with TZID=America/Puerto_Rico
-        e.add('dtstart', ev['start'])
-        e['DTSTART'].params['TZID'] = 'America/Puerto_Rico'
-        e.add('dtend', ev['end'])
-        e['DTEND'].params['TZID'] = 'America/Puerto_Rico'
-
-        if ev.get('location'):
-            e.add('location', ev['location'])
-        if ev.get('geo') and isinstance(ev['geo'], (list, tuple)) and len(ev['geo']) == 2:
-            e.add('geo', ev['geo'])
 
+def render_turnover_calendar(turnovers, dtstamp):
+    """One cleaning VEVENT per check-out, across all units, as an iCal document (bytes).
+
+    Each event runs from check-out until the next arrival on a same-day turnover,
+    otherwise until the unit's usual check-in time that day.
+    """
+    cal_out = ICal()
+    cal_out.add('prodid', 'https://pms-calendar.fly.dev/')
+    cal_out.add('version', '2.0')
+    cal_out.add('calscale', 'GREGORIAN')
+    cal_out.add('x-published-ttl', f'PT{PUBLISHED_TTL_SECONDS // 60}M')
+    cal_out.add('x-wr-relcalid', 'turnovers@pms-calendar.fly.dev')
+    cal_out.add('x-wr-caldesc', 'Check-out turnovers for every unit (provided by https://pms-calendar.fly.dev/)')
+    cal_out.add('x-wr-calname', 'Turnovers')
+
+    years_by_zone = {}
+    for turnover in turnovers:
+        unit = turnover['unit']
+        unit_tz = unit_timezone(unit)
+        unit_code = unit_code_for(unit)
+        start = datetime.fromisoformat(turnover['check_out']).astimezone(unit_tz)
+        if turnover['same_day']:
+            end = datetime.fromisoformat(turnover['next_arrival']).astimezone(unit_tz)
+        else:
+            end = unit_tz.localize(datetime.combine(start.date(), unit_stay_times(unit)[0]))
+        end = max(end, start)
+        years = years_by_zone.setdefault(unit_tz.zone, [start.year, start.year])
+        years[0], years[1] = min(years[0], start.year), max(years[1], end.year)
+
+        departing = turnover['departing']
+        src_uid = departing['uid'] or f"{int(start.timestamp())}@staypr"
+        src_uid_left = src_uid.split('@', 1)[0] if '@' in src_uid else src_uid
+        e = IEvent()
+        e.add('uid', f"{src_uid_left}+{unit_code}-turnover@staypr")
+        e.add('X-UNIT-CODE', unit_code)
+        e.add('X-EVENT-TYPE', 'TURNOVER')
+        e.add('dtstamp', dtstamp)
+        e.add('transp', 'TRANSPARENT')
+        label = "Same-day turnover" if turnover['same_day'] else "Turnover"
+        e.add('summary', f"{label}: {unit}")
+        lines = [f"Departing: {departing['booking_code'] or src_uid}"]
+        if turnover['arriving']:
+            lines.append(f"Next arrival: {turnover['next_arrival']} ({turnover['arriving']['booking_code']})")
+            lines.append(f"Gap: {turnover['gap_hours']} hours, {turnover['gap_nights']} nights")
+        else:
+            lines.append("Next arrival: none booked")
+        e.add('description', "\n".join(lines))
+        e.add('dtstart', start)
+        e['DTSTART'].params['TZID'] = unit_tz.zone
+        e.add('dtend', end)
+        e['DTEND'].params['TZID'] = unit_tz.zone
         cal_out.add_component(e)
 
-    # Append a minimal VTIMEZONE block
-    tz_comp = ITimezone()
-    tz_comp.add('tzid', 'America/Puerto_Rico')
-    std = ITimezoneStandard()
-    std.add('dtstart', datetime(2025, 9, 7, 16, 0, 0))
-    std.add('tzname', 'AST')
-    std.add('tzoffsetto', timedelta(hours=-4))
-    std.add('tzoffsetfrom', timedelta(hours=-4))
-    tz_comp.add_component(std)
-    cal_out.add_component(tz_comp)
+    calendar_end = b"END:VCALENDAR\r\n"
+    body = cal_out.to_ical()[:-len(calendar_end)]
+    zones = b"".join(vtimezone_fragment(zone, first, last) for zone, (first, last) in sorted(years_by_zone.items()))
+    return body + zones + calendar_end
+
+
+def vtimezone_fragment(zone, first_year, last_year):
+    """A VTIMEZONE block covering every tz database transition of zone from first_year through last_year.
+
+    Generating one walks the zone's transitions, so each (zone, year range) is serialized
+    once and reused by every feed and request that needs it.
+    """
+    cache_key = (zone, first_year, last_year)
+    fragment = vtimezone_cache.get(cache_key)
+    if fragment is None:
+        fragment = build_vtimezone(zone, first_year, last_year).to_ical()
+        vtimezone_cache.put(cache_key, fragment)
+    return fragment
+
+
+def build_vtimezone(zone, first_year, last_year):
+    """VTIMEZONE with the offset in force on 1 January of first_year, then one
+    STANDARD or DAYLIGHT sub-component per transition up to the end of last_year."""
+    tz = pytz.timezone(zone)
+    range_start = datetime(first_year, 1, 1)
+    range_end = datetime(last_year + 1, 1, 1)
+
+    component = ITimezone()
+    component.add('tzid', zone)
+
+    def add_observance(local_start, offset_from, offset_to, is_dst, name):
+        observance = ITimezoneDaylight() if is_dst else ITimezoneStandard()
+        observance.add('dtstart', local_start)
+        observance.add('tzoffsetfrom', offset_from)
+        observance.add('tzoffsetto', offset_to)
+        observance.add('tzname', name)
+        component.add_component(observance)
+
+    at_start = tz.localize(range_start)
+    add_observance(range_start, at_start.utcoffset(), at_start.utcoffset(), bool(at_start.dst()), at_start.tzname())
+
+    # pytz's transition table: naive UTC instants and the (offset, dst, name) in force from each one.
+    # Fixed-offset zones have no table and need nothing past the first observance.
+    offset_before = at_start.utcoffset()
+    transitions = zip(getattr(tz, '_utc_transition_times', []), getattr(tz, '_transition_info', []))
+    for utc_time, (offset, dst, name) in transitions:
+        local_time = utc_time + offset_before if utc_time.year > 1 else utc_time
+        if range_start < local_time < range_end:
+            add_observance(local_time, offset_before, offset, bool(dst), name)
+        if local_time >= range_end:
+            break
+        if local_time > range_start:
+            offset_before = offset
+    return component
+
+@app.route("/availability.json")
+def availability():
+    """Which units are free, and how full each one is, for the nights in [from, to)."""
+    if not request.args.get('from') or not request.args.get('to'):
+        return Response("Both 'from' and 'to' dates are required", status=400)
+    try:
+        window_start, window_end = requested_window(request.args)
+    except ValueError as exc:
+        return Response(str(exc), status=400)
+    start_date, end_date = window_start.date(), window_end.date()
+    nights = (end_date - start_date).days
+    if nights <= 0:
+        return Response("'to' must be at least one night after 'from'", status=400)
+
+    occupancy = get_snapshot().occupancy()
+    booked = occupancy.booked_nights(start_date, end_date)
+    total_booked = sum(booked.values())
+    return jsonify({
+        'from': start_date.isoformat(),
+        'to': end_date.isoformat(),
+        'nights': nights,
+        'available': occupancy.available_units(start_date, end_date),
+        'occupancy_rate': round(total_booked / (nights * len(booked)), 4) if booked else 0.0,
+        'units': {
+            unit: {
+                'slug': slugify(unit),
+                'booked_nights': count,
+                'occupancy_rate': round(count / nights, 4),
+            }
+            for unit, count in booked.items()
+        },
+    })
+
+
+@app.route("/lookup.json")
+def lookup_reservation():
+    """Find which unit(s) a booking code (original or suffixed) or source UID ended up in.
+
+    Answers from the snapshot already in memory and never fetches the source feed.
+    """
+    query = (request.args.get('q') or "").strip()
+    if not query:
+        return Response("A reservation code or UID is required as ?q=", status=400)
+    hits = current_snapshot().reservation_index().get(query.upper(), [])
+    return jsonify({
+        'query': query,
+        'count': len(hits),
+        'matches': [
+            {
+                'matched_on': field,
+                'unit': unit,
+                'calendar': f"/calendar/{slugify(unit)}.ics",
+                'uid': ev.get('uid'),
+                'booking_code': ev.get('booking_code'),
+                'original_booking_code': ev.get('original_booking_code'),
+                'summary': ev.get('summary'),
+                'start': ev['start'].isoformat(),
+                'end': ev['end'].isoformat(),
+                'version': ev.get('version', 1),
+            }
+            for field, unit, ev in hits
+        ],
+    })
+
+
+@app.route("/turnovers.json")
+def turnover_report():
+    """Check-outs with each unit's next arrival and the gap (?unit=, ?from=, ?to= on the check-out time)."""
+    snapshot = get_snapshot()
+    key = None
+    if request.args.get('unit'):
+        key = snapshot.resolve_key(request.args['unit'])
+        if not key:
+            return Response(f"Unknown unit: {request.args['unit']!r}", status=404)
+    tz = unit_timezone(key) if key else None
+    try:
+        start = parse_window_bound(request.args['from'], tz) if request.args.get('from') else None
+        end = parse_window_bound(request.args['to'], tz) if request.args.get('to') else None
+    except ValueError as exc:
+        return Response(str(exc), status=400)
+    records = [
+        t for t in snapshot.turnovers()
+        if (key is None or t['unit'] == key)
+        and (start is None or datetime.fromisoformat(t['check_out']) >= start)
+        and (end is None or datetime.fromisoformat(t['check_out']) < end)
+    ]
+    response = jsonify({
+        'built_at': snapshot.built_at.isoformat(),
+        'count': len(records),
+        'same_day': sum(1 for t in records if t['same_day']),
+        'turnovers': records,
+    })
+    return apply_cache_headers(response, snapshot)
+
+
+@app.route("/turnovers.ics")
+def turnover_calendar():
+    """Every unit's check-out turnovers as one calendar for housekeeping."""
+    snapshot = get_snapshot()
+    body, etag = snapshot.turnover_feed()
+    response = Response(body, mimetype='text/calendar')
+    response.set_etag(etag)
+    apply_cache_headers(response, snapshot)
+    return response.make_conditional(request)
+
+
+@app.route("/conflicts.json")
+def double_bookings():
+    """Overlapping reservations found in the current snapshot."""
+    conflicts = get_snapshot().conflicts
+    return jsonify({'count': len(conflicts), 'conflicts': conflicts})
+
+
+@app.route("/metrics")
+def metrics():
+    with _metrics_lock:
+        lines = [f"{name} {value}" for name, value in sorted(_metrics.items())]
+    for name, cache in sorted(_caches.items()):
+        lookups = cache.hits + cache.misses
+        lines.append(f'pms_cache_hits{{cache="{name}"}} {cache.hits}')
+        lines.append(f'pms_cache_misses{{cache="{name}"}} {cache.misses}')
+        lines.append(f'pms_cache_hit_ratio{{cache="{name}"}} {round(cache.hits / lookups, 4) if lookups else 0}')
+        lines.append(f'pms_cache_entries{{cache="{name}"}} {len(cache)}')
+        lines.append(f'pms_cache_evictions{{cache="{name}"}} {cache.evictions}')
+        lines.append(f'pms_cache_approx_bytes{{cache="{name}"}} {cache.approximate_bytes()}')
+    classification = summary_classifier.stats()
+    for rule, hits in classification['hits'].items():
+        lines.append(f'pms_classification_hits{{format="{classification["format"]}",rule="{rule}"}} {hits}')
+    lines.append(f'pms_classification_unclassified{{format="{classification["format"]}"}} {classification["unclassified"]}')
+    return Response("\n".join(lines) + "\n", mimetype='text/plain')
+
+
+def token_authorized(expected, header):
+    """True when the expected token is configured and the request presents it (header or ?token=)."""
+    if not expected:
+        return False
+    supplied = request.headers.get(header) or request.args.get('token') or ""
+    return hmac.compare_digest(supplied.encode(), expected.encode())
+
+
+def debug_authorized():
+    return token_authorized(DEBUG_TOKEN, 'X-Debug-Token')
+
+
+@app.route("/debug/memory")
+def debug_memory():
+    """Cache sizes plus tracemalloc's top allocators (?start=1 begins tracing, ?stop=1 ends it)."""
+    if not debug_authorized():
+        return Response("Not found", status=404)
+    if request.args.get('start') and not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return Response("'limit' must be an integer", status=400)
+
+    report = {'caches': {name: cache.stats() for name, cache in sorted(_caches.items())}}
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics('lineno')[:limit]
+        report['tracemalloc'] = {
+            'tracing': True,
+            'current_bytes': current,
+            'peak_bytes': peak,
+            'top': [
+                {'location': str(stat.traceback[0]), 'size_bytes': stat.size, 'count': stat.count}
+                for stat in top
+            ],
+        }
+    else:
+        report['tracemalloc'] = {'tracing': False}
+    if request.args.get('stop') and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return jsonify(report)
+
+
+@app.route("/history.json")
+def reservation_history():
+    """Every version of past and current reservations from the history log (?unit=, ?from=, ?to=)."""
+    if not HISTORY_DIR:
+        return Response("Reservation history is not enabled.", status=404)
+    key = None
+    if request.args.get('unit'):
+        key = current_snapshot().resolve_key(request.args['unit'])
+        if not key:
+            return Response(f"Unknown unit: {request.args['unit']!r}", status=404)
+    tz = unit_timezone(key) if key else None
+    try:
+        start = parse_window_bound(request.args['from'], tz) if request.args.get('from') else None
+        end = parse_window_bound(request.args['to'], tz) if request.args.get('to') else None
+    except ValueError as exc:
+        return Response(str(exc), status=400)
+    records = ReservationHistory(HISTORY_DIR).query(key, start, end)
+    return jsonify({'unit': key, 'count': len(records), 'records': records})
+
+
+@app.route("/peer/snapshot")
+def peer_snapshot():
+    """The leader's current reservations for followers, signed with PEER_SECRET."""
+    if PEER_LEADER_URL or not token_authorized(PEER_SECRET, 'X-Peer-Token'):
+        return Response("Not found", status=404)
+    signed = peer_snapshot_response(get_snapshot())
+    if signed is None:
+        return Response("No successful source fetch yet; no lease to offer.", status=503)
+    body, signature = signed
+    response = Response(body, mimetype='application/json')
+    response.headers['X-Peer-Signature'] = signature
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@app.route("/subscriptions", methods=["GET", "POST"])
+def webhook_subscriptions():
+    """List subscriptions, or register a callback URL for one unit with {"unit": ..., "url": ...}."""
+    if not token_authorized(SUBSCRIPTION_TOKEN, 'X-Subscription-Token'):
+        return Response("Not found", status=404)
+    if request.method == "GET":
+        return jsonify({'subscriptions': load_subscriptions()})
+
+    data = request.get_json(silent=True) or {}
+    url = (data.get('url') or "").strip()
+    if urlparse(url).scheme not in ('http', 'https') or not urlparse(url).netloc:
+        return Response("'url' must be an absolute http(s) URL", status=400)
+    key = current_snapshot().resolve_key(data.get('unit') or "")
+    if not key:
+        return Response(f"Unknown unit: {data.get('unit')!r}", status=404)
+
+    with _subscriptions_lock:
+        subscriptions = load_subscriptions()
+        for subscription in subscriptions:
+            if subscription['unit'] == key and subscription['url'] == url:
+                return jsonify(subscription)
+        subscription = {
+            'id': uuid.uuid4().hex,
+            'unit': key,
+            'url': url,
+            'created': datetime.now(pytz.utc).isoformat(),
+        }
+        subscriptions.append(subscription)
+        save_subscriptions(subscriptions)
+    response = jsonify(subscription)
+    response.status_code = 201
+    response.headers['Location'] = f"/subscriptions/{subscription['id']}"
+    return response
+
+
+@app.route("/subscriptions/<subscription_id>", methods=["DELETE"])
+def delete_webhook_subscription(subscription_id):
+    if not token_authorized(SUBSCRIPTION_TOKEN, 'X-Subscription-Token'):
+        return Response("Not found", status=404)
+    with _subscriptions_lock:
+        subscriptions = load_subscriptions()
+        remaining = [s for s in subscriptions if s['id'] != subscription_id]
+        if len(remaining) == len(subscriptions):
+            return Response("No such subscription", status=404)
+        save_subscriptions(remaining)
+    return Response(status=204)
 
-    ical_bytes = cal_out.to_ical()
-    return Response(ical_bytes, mimetype='text/calendar')
 
 @app.route("/")
+@profiled
 def list_properties():
     logger.info("Root URL accessed; listing all properties")
     base_url = request.url_root.rstrip("/")
-    props = parse_and_group_events()
+    snapshot = get_snapshot()
+    props = snapshot.properties
     html = f"""
 <!DOCTYPE html>
 <html>
@@ -673,7 +2930,10 @@ def list_properties():
 </body>
 </html>
 """
-    return Response(html, mimetype='text/html')
+    response = Response(html, mimetype='text/html')
+    response.headers['Surrogate-Key'] = INDEX_SURROGATE_KEY
+    # The page embeds absolute feed URLs built from the requested host.
+    return apply_cache_headers(response, snapshot, vary='Host')
 
 
 @app.route("/favicon.svg")
@@ -682,13 +2942,48 @@ def favicon():
     return Response(FAVICON_SVG, mimetype="image/svg+xml")
 
 
-# --- Manual cache clear route ---
-@app.route("/refresh")
+# --- Manual refresh routes ---
+@app.route("/refresh", methods=["GET", "POST"])
+@profiled
 def refresh_cache():
-    """Force clear the cached reservation data."""
+    """Rebuild the snapshot now; the cache and current feeds are only replaced on success.
+
+    ?background=1 runs the refresh on a worker thread and points to /refresh/status.
+    """
+    if request.args.get('background') in ('1', 'true', 'yes'):
+        job = start_background_refresh()
+        response = jsonify(dict(job, status_url='/refresh/status'))
+        response.status_code = 202
+        response.headers['Location'] = '/refresh/status'
+        return response
+
+    try:
+        snapshot = refresh_snapshot()
+    except ValueError as exc:
+        logger.error("Manual refresh failed; keeping the current snapshot: %s", exc)
+        response = jsonify({'status': 'failed', 'error': str(exc)})
+        response.status_code = 502
+        return response
+    logger.info("Snapshot rebuilt manually via /refresh route.")
+    return jsonify(refresh_report(snapshot))
+
+
+@app.route("/refresh/status")
+def refresh_status():
+    job = load_refresh_job()
+    if job is None:
+        return Response("No background refresh has been started.", status=404)
+    return jsonify(job)
+
+
+@app.route("/refresh/hard-reset", methods=["POST"])
+def hard_reset_cache():
+    """Delete the cached reservation data, dropping started-reservation fallbacks."""
+    invalidate_snapshot()
+    mark_snapshot_replaced()
     if os.path.exists(CACHE_FILE):
         os.remove(CACHE_FILE)
-        logger.info("Cache file deleted manually via /refresh route.")
+        logger.info("Cache file deleted manually via /refresh/hard-reset route.")
         return Response("Cache cleared. It will rebuild automatically on next load.", status=200)
     else:
         logger.info("Cache file not found; nothing to delete.")
@@ -0,0 +1,312 @@
+"""Reproduce calendar polling load locally against a stand-in Freetobook server.
+
+Usage:
+    python load-test.py [--events 500] [--latency 0.2] [--error-rate 0.05] [--not-modified]
+                        [--workers 2] [--followers 0] [--pollers 20] [--duration 30] [--json]
+
+Starts a fake upstream feed server, runs the real wsgi:app under gunicorn with
+SOURCE_ICAL_URL pointed at it (in a scratch directory, so the reservation cache
+starts empty), then has --pollers threads fetch /calendar/<slug>.ics for every
+unit slug in turn for --duration seconds. Reports request latency percentiles,
+throughput, how many upstream requests the app made and how many times it
+rewrote its cache file.
+
+With --followers N, N more instances run in peer mode against the first one
+(each in its own scratch directory) and the pollers are spread across all of
+them, so the upstream request count shows whether only the leader fetches.
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import pathlib
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+ROOT = pathlib.Path(__file__).resolve().parent
+_MODULE_PATH = ROOT / "format-calendars.py"
+_spec = importlib.util.spec_from_file_location("format_calendars", _MODULE_PATH)
+if _spec is None or _spec.loader is None:
+    raise ImportError(f"Unable to load module from {_MODULE_PATH}")
+calendars = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(calendars)
+
+CACHE_WRITE_LOG_LINE = "Wrote reservation cache to"
+PEER_SECRET = "load-test-peer-secret"
+
+
+def synthetic_feed(event_count, start=None):
+    """A Freetobook-style feed with event_count back-to-back stays spread over the known units."""
+    start = start or date.today()
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "CALSCALE:GREGORIAN",
+        "PRODID:-//freetobook//EN",
+        "BEGIN:VEVENT",
+        f"UID:{stamp}-53930@freetobook.com",
+        f"DTSTAMP:{stamp}",
+        f"SUMMARY:Last update {stamp}",
+        f"DTSTART:{start.strftime('%Y%m%d')}T000000",
+        f"DTEND:{start.strftime('%Y%m%d')}T000000",
+        "END:VEVENT",
+    ]
+    units = calendars.KNOWN_PROPERTIES
+    next_free = {unit: start for unit in units}
+    for i in range(event_count):
+        unit = units[i % len(units)]
+        check_in = next_free[unit]
+        check_out = check_in + timedelta(days=2 + i % 4)
+        next_free[unit] = check_out + timedelta(days=1)
+        lines.extend([
+            "BEGIN:VEVENT",
+            f"UID:{80000000 + i}@freetobook.com",
+            f"DTSTAMP:{stamp}",
+            f"SUMMARY:{unit}:CTB{i:07X}",
+            f"DTSTART;VALUE=DATE:{check_in.strftime('%Y%m%d')}",
+            f"DTEND;VALUE=DATE:{check_out.strftime('%Y%m%d')}",
+            "END:VEVENT",
+        ])
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(lines) + "\r\n"
+
+
+class FakeFeedServer:
+    """Serves one feed over HTTP with configurable latency, error rate and 304 support."""
+
+    def __init__(self, feed_text, latency=0.0, error_rate=0.0, not_modified=False, seed=None):
+        self.body = feed_text.encode("utf-8")
+        self.etag = '"%s"' % hashlib.sha1(self.body).hexdigest()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.not_modified = not_modified
+        self.counts = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/ical/property-feed/load-test.ics"
+
+    def start(self):
+        feed = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with feed._lock:
+                    feed.counts["requests"] += 1
+                    failed = feed._random.random() < feed.error_rate
+                if feed.latency:
+                    time.sleep(feed.latency)
+                if failed:
+                    feed._count("errors")
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                if feed.not_modified and self.headers.get("If-None-Match") == feed.etag:
+                    feed._count("not_modified")
+                    self.send_response(304)
+                    self.send_header("ETag", feed.etag)
+                    self.end_headers()
+                    return
+                feed._count("ok")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/calendar")
+                self.send_header("Content-Length", str(len(feed.body)))
+                self.send_header("ETag", feed.etag)
+                self.end_headers()
+                self.wfile.write(feed.body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_app(workdir, source_url, workers, port, leader_url=None):
+    env = dict(os.environ, SOURCE_ICAL_URL=source_url, PEER_SECRET=PEER_SECRET)
+    if leader_url:
+        env["PEER_LEADER_URL"] = leader_url
+    log = open(pathlib.Path(workdir) / "gunicorn.log", "w")
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn",
+            "--bind", f"127.0.0.1:{port}",
+            "--workers", str(workers),
+            "--timeout", "60",
+            "--pythonpath", str(ROOT),
+            "wsgi:app",
+        ],
+        cwd=workdir,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited early; see {log.name}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/favicon.svg", timeout=1)
+            return process, log
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("gunicorn did not start within 20 seconds")
+
+
+def poll(base_urls, slugs, offset, deadline):
+    session = requests.Session()
+    latencies = []
+    statuses = Counter()
+    i = offset
+    base_url = base_urls[offset % len(base_urls)]
+    while time.monotonic() < deadline:
+        url = f"{base_url}/calendar/{slugs[i % len(slugs)]}.ics"
+        i += 1
+        started = time.perf_counter()
+        try:
+            response = session.get(url, timeout=60)
+            statuses[response.status_code] += 1
+        except requests.RequestException:
+            statuses["error"] += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+    return latencies, statuses
+
+
+def percentile_ms(latencies, pct):
+    if not latencies:
+        return None
+    if len(latencies) == 1:
+        return round(latencies[0] * 1000, 2)
+    return round(statistics.quantiles(latencies, n=100, method="inclusive")[pct - 1] * 1000, 2)
+
+
+def run(events=500, latency=0.0, error_rate=0.0, not_modified=False, workers=2, pollers=10, duration=10.0, seed=None,
+        followers=0):
+    feed = FakeFeedServer(synthetic_feed(events), latency, error_rate, not_modified, seed).start()
+    slugs = [calendars.slugify(name) for name in calendars.KNOWN_PROPERTIES]
+    instances = []
+    try:
+        with tempfile.TemporaryDirectory() as scratch:
+            try:
+                base_urls = []
+                for n in range(1 + followers):
+                    workdir = pathlib.Path(scratch) / f"instance{n}"
+                    workdir.mkdir()
+                    port = free_port()
+                    leader_url = base_urls[0] if base_urls else None
+                    process, log = start_app(workdir, feed.url, workers, port, leader_url)
+                    instances.append((workdir, process, log))
+                    base_urls.append(f"http://127.0.0.1:{port}")
+                started = time.monotonic()
+                deadline = started + duration
+                with ThreadPoolExecutor(max_workers=pollers) as pool:
+                    results = list(pool.map(
+                        lambda offset: poll(base_urls, slugs, offset, deadline),
+                        range(pollers),
+                    ))
+                elapsed = time.monotonic() - started
+            finally:
+                for _, process, log in instances:
+                    process.terminate()
+                    process.wait(timeout=30)
+                    log.close()
+            cache_writes = sum(
+                (workdir / "gunicorn.log").read_text().count(CACHE_WRITE_LOG_LINE) for workdir, _, _ in instances
+            )
+    finally:
+        feed.stop()
+
+    latencies = [value for result in results for value in result[0]]
+    statuses = Counter()
+    for _, result_statuses in results:
+        statuses.update(result_statuses)
+    return {
+        "events": events,
+        "workers": workers,
+        "followers": followers,
+        "pollers": pollers,
+        "duration_s": round(elapsed, 2),
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": percentile_ms(latencies, 50),
+        "p95_ms": percentile_ms(latencies, 95),
+        "p99_ms": percentile_ms(latencies, 99),
+        "statuses": {str(k): v for k, v in sorted(statuses.items(), key=str)},
+        "upstream_requests": feed.counts["requests"],
+        "upstream_errors": feed.counts["errors"],
+        "upstream_not_modified": feed.counts["not_modified"],
+        "cache_file_writes": cache_writes,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the calendar app against a fake upstream feed.")
+    parser.add_argument("--events", type=int, default=500, help="reservations in the fake feed")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the fake upstream waits before answering")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream requests answered with 503")
+    parser.add_argument("--not-modified", action="store_true", help="answer matching If-None-Match with 304")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--followers", type=int, default=0, help="extra instances pulling the first one's snapshot")
+    parser.add_argument("--pollers", type=int, default=10, help="concurrent simulated calendar pollers")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to poll for")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the upstream error injection")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = run(
+        events=args.events,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        not_modified=args.not_modified,
+        workers=args.workers,
+        pollers=args.pollers,
+        duration=args.duration,
+        seed=args.seed,
+        followers=args.followers,
+    )
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key:>22}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
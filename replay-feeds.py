@@ -0,0 +1,220 @@
+"""Replay a recorded series of source feeds through the cache merge, step by step.
+
+Usage:
+    python replay-feeds.py SOURCE [--cache CACHE_FILE] [--module PATH] [--out REPORT.json]
+                           [--compare BASELINE.json] [--json]
+
+SOURCE is either a directory of feeds named by the time they were recorded
+(20260417T120000.ics, 2026-04-17T12.ics, ...) or a manifest with one
+"<timestamp> <feed path>" line per step (paths relative to the manifest).
+Timestamps without an offset are in TIMEZONE.
+
+Each feed is run through parse_and_group_events() in timestamp order with
+now_override set to its timestamp and a temporary cache file carried from one
+step to the next, so version bumps, started bookings kept after the feed drops
+them and cancellations play out as they did in production. HISTORY_DIR is
+switched off for the replay, so the reservation history is never written.
+Feeds are read into memory up front, so only the merge itself is timed.
+
+After every step the resulting per-unit state (uid, code, start, end, version)
+and the step's timing are recorded. --out writes the full report; --compare
+checks the states against a report from another run (e.g. of another version
+loaded with --module) and exits 1 if any step differs.
+"""
+import argparse
+import importlib.util
+import inspect
+import json
+import logging
+import pathlib
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+_MODULE_PATH = pathlib.Path(__file__).resolve().parent / "format-calendars.py"
+
+
+def load_calendars(path=_MODULE_PATH):
+    spec = importlib.util.spec_from_file_location("format_calendars", path)
+    if spec is None or spec.loader is None:
+        raise ImportError(f"Unable to load module from {path}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+calendars = load_calendars()
+
+
+def parse_timestamp(value, module=calendars):
+    at = datetime.fromisoformat(value)
+    if at.tzinfo is None:
+        at = module.pytz.timezone(module.TIMEZONE).localize(at)
+    return at
+
+
+def load_steps(source, module=calendars):
+    """[(timestamp, feed name, feed text)] in timestamp order, from a feed directory or a manifest."""
+    source = pathlib.Path(source)
+    entries = []
+    if source.is_dir():
+        for path in source.glob("*.ics"):
+            try:
+                entries.append((parse_timestamp(path.stem, module), path))
+            except ValueError:
+                raise ValueError(f"{path.name}: file name is not a timestamp; use a manifest instead") from None
+    else:
+        for number, line in enumerate(source.read_text(encoding="utf-8").splitlines(), 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                stamp, feed = line.split(None, 1)
+                entries.append((parse_timestamp(stamp, module), source.parent / feed.strip()))
+            except ValueError:
+                raise ValueError(f"{source}:{number}: expected '<timestamp> <feed path>'") from None
+    entries.sort(key=lambda entry: entry[0])
+    return [(at, path.name, path.read_text(encoding="utf-8")) for at, path in entries]
+
+
+def unit_state(properties):
+    """Per-unit reservations in a comparable, JSON-ready form."""
+    return {
+        unit: [
+            [ev.get('uid'), ev.get('booking_code'), ev['start'].isoformat(), ev['end'].isoformat(), ev.get('version', 1)]
+            for ev in events
+        ]
+        for unit, events in sorted(properties.items())
+        if events
+    }
+
+
+def replay(steps, cache_file=None, module=calendars):
+    """Run each (timestamp, name, text) step through parse_and_group_events(); returns one result per step."""
+    results = []
+    # Replays must not append to the production reservation history.
+    history_dir = getattr(module, 'HISTORY_DIR', None)
+    module.HISTORY_DIR = None
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            working_cache = pathlib.Path(tmp) / "cache.json"
+            if cache_file:
+                shutil.copyfile(cache_file, working_cache)
+            # Versions from before source_text was added only take an already-parsed calendar.
+            takes_text = 'source_text' in inspect.signature(module.parse_and_group_events).parameters
+            for number, (at, name, text) in enumerate(steps):
+                started = time.perf_counter()
+                if takes_text:
+                    source = {'source_text': text}
+                else:
+                    source = {'source_calendar': module.ICal.from_ical(text)}
+                props = module.parse_and_group_events(now_override=at, cache_file=str(working_cache), **source)
+                elapsed = time.perf_counter() - started
+                stats = getattr(module, 'last_parse_stats', {})
+                results.append({
+                    'step': number,
+                    'at': at.isoformat(),
+                    'feed': name,
+                    'seconds': round(elapsed, 6),
+                    'source_ok': bool(stats.get('source_ok')),
+                    'error': stats.get('error'),
+                    'reservations': sum(len(events) for events in props.values()),
+                    'units': unit_state(props),
+                })
+    finally:
+        module.HISTORY_DIR = history_dir
+    return results
+
+
+def summarize(results):
+    timings = [result['seconds'] for result in results]
+    total = sum(timings)
+    summary = {
+        'steps': len(results),
+        'failed_steps': sum(1 for result in results if not result['source_ok']),
+        'total_seconds': round(total, 4),
+        'steps_per_second': round(len(results) / total, 1) if total else None,
+        'p50_ms': None,
+        'p95_ms': None,
+        'max_ms': round(max(timings) * 1000, 3) if timings else None,
+    }
+    if len(timings) > 1:
+        cuts = statistics.quantiles(timings, n=100, method="inclusive")
+        summary.update(p50_ms=round(cuts[49] * 1000, 3), p95_ms=round(cuts[94] * 1000, 3))
+    elif timings:
+        summary.update(p50_ms=round(timings[0] * 1000, 3), p95_ms=round(timings[0] * 1000, 3))
+    return summary
+
+
+def compare(results, baseline):
+    """Steps whose per-unit state differs from a baseline report's, and the relative speed."""
+    mismatches = []
+    for result, expected in zip(results, baseline['results']):
+        units = sorted(
+            unit for unit in set(result['units']) | set(expected['units'])
+            if result['units'].get(unit) != expected['units'].get(unit)
+        )
+        if units or (result['at'], result['feed']) != (expected['at'], expected['feed']):
+            mismatches.append({'step': result['step'], 'at': result['at'], 'feed': result['feed'], 'units': units})
+    if len(results) != len(baseline['results']):
+        mismatches.append({'step': min(len(results), len(baseline['results'])), 'units': [], 'error': (
+            f"{len(results)} steps replayed, baseline has {len(baseline['results'])}"
+        )})
+    baseline_seconds = baseline['summary']['total_seconds']
+    current_seconds = sum(result['seconds'] for result in results)
+    return {
+        'mismatched_steps': len(mismatches),
+        'mismatches': mismatches,
+        'speedup': round(baseline_seconds / current_seconds, 3) if current_seconds else None,
+    }
+
+
+def run(source, cache_file=None, module_path=None, baseline=None):
+    module = load_calendars(module_path) if module_path else calendars
+    steps = load_steps(source, module)
+    results = replay(steps, cache_file, module)
+    report = {'module': str(module_path or _MODULE_PATH), 'summary': summarize(results), 'results': results}
+    if baseline is not None:
+        report['comparison'] = compare(results, baseline)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded source feeds through the cache merge.")
+    parser.add_argument("source", help="directory of timestamp-named *.ics feeds, or a manifest file")
+    parser.add_argument("--cache", help="reservation cache JSON to start from (read-only)")
+    parser.add_argument("--module", help="format-calendars.py to replay against (default: this checkout's)")
+    parser.add_argument("--out", help="write the full report, with every step's state, to this JSON file")
+    parser.add_argument("--compare", help="report from an earlier run to check states and speed against")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    # Per-step cache-write logging would swamp the output and the timings.
+    logging.getLogger(calendars.__name__).setLevel(logging.WARNING)
+    baseline = json.loads(pathlib.Path(args.compare).read_text()) if args.compare else None
+    try:
+        report = run(args.source, args.cache, args.module, baseline)
+    except (OSError, ValueError) as exc:
+        parser.error(str(exc))
+    if args.out:
+        pathlib.Path(args.out).write_text(json.dumps(report, indent=2))
+
+    summary = dict(report['summary'])
+    if 'comparison' in report:
+        summary['mismatched_steps'] = report['comparison']['mismatched_steps']
+        summary['speedup'] = report['comparison']['speedup']
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        for key, value in summary.items():
+            print(f"{key:>18}: {value}")
+        for mismatch in report.get('comparison', {}).get('mismatches', [])[:20]:
+            print(f"step {mismatch['step']} ({mismatch.get('feed')}): {mismatch.get('error') or ', '.join(mismatch['units'])}")
+    return 1 if report.get('comparison', {}).get('mismatched_steps') else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
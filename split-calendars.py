@@ -0,0 +1,112 @@
+"""Split saved source feeds into per-unit .ics files without running the web server.
+
+Usage:
+    python split-calendars.py FEED_OR_DIR [--cache CACHE_FILE] [--out OUT_DIR] [--jobs N] [--now ISO_DATETIME]
+
+A single feed file is written to OUT_DIR/<unit-slug>.ics. A directory of feeds
+(*.ics) is processed across a process pool, one feed per task, and each feed
+gets its own OUT_DIR/<feed-name>/ subdirectory.
+
+The optional cache file is used as the merge baseline for every feed but is
+never modified; each feed merges against its own temporary copy.
+"""
+import argparse
+import importlib.util
+import pathlib
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+_MODULE_PATH = pathlib.Path(__file__).resolve().parent / "format-calendars.py"
+_spec = importlib.util.spec_from_file_location("format_calendars", _MODULE_PATH)
+if _spec is None or _spec.loader is None:
+    raise ImportError(f"Unable to load module from {_MODULE_PATH}")
+calendars = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(calendars)
+
+
+def split_feed(feed_path, out_dir, cache_file=None, now_iso=None):
+    """Write one .ics per unit for a saved feed; returns (feed_path, units, events)."""
+    feed_text = pathlib.Path(feed_path).read_text(encoding="utf-8")
+    if "BEGIN:VCALENDAR" not in feed_text:
+        raise ValueError(f"{feed_path} does not look like iCal data")
+    source_calendar = calendars.ICal.from_ical(feed_text)
+    now = datetime.fromisoformat(now_iso) if now_iso else None
+    if now is not None and now.tzinfo is None:
+        now = calendars.pytz.timezone(calendars.TIMEZONE).localize(now)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        working_cache = pathlib.Path(tmp) / "cache.json"
+        if cache_file:
+            shutil.copyfile(cache_file, working_cache)
+        props = calendars.parse_and_group_events(
+            now_override=now,
+            cache_file=str(working_cache),
+            source_calendar=source_calendar,
+        )
+    # parse_and_group_events() falls back to the cache on a bad feed; here that must count as a failure.
+    stats = calendars.last_parse_stats
+    if not stats.get('source_ok'):
+        raise ValueError(f"could not be parsed: {stats.get('error', 'unknown error')}")
+
+    out = pathlib.Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    blocks = calendars.last_source_blocks or {}
+    for key, events in props.items():
+        ical_bytes = calendars.render_property_calendar(key, events, blocks.get(key, ()))
+        (out / f"{calendars.slugify(key)}.ics").write_bytes(ical_bytes)
+    return str(feed_path), len(props), sum(len(v) for v in props.values())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split saved source iCal feeds into per-unit .ics files.")
+    parser.add_argument("source", help="feed file, or a directory of *.ics feed files")
+    parser.add_argument("--cache", help="reservation cache JSON to merge against (read-only)")
+    parser.add_argument("--out", default="out", help="output directory (default: out)")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--now", help="treat this ISO datetime as 'now' when dropping ended reservations")
+    args = parser.parse_args(argv)
+
+    source = pathlib.Path(args.source)
+    out = pathlib.Path(args.out)
+    if source.is_dir():
+        tasks = [(path, out / path.stem) for path in sorted(source.glob("*.ics"))]
+    elif source.is_file():
+        tasks = [(source, out)]
+    else:
+        parser.error(f"{source} does not exist")
+    if not tasks:
+        parser.error(f"no .ics files found in {source}")
+
+    failures = 0
+    if len(tasks) == 1 or args.jobs == 1:
+        results = []
+        for feed_path, feed_out in tasks:
+            try:
+                results.append(split_feed(feed_path, feed_out, args.cache, args.now))
+            except Exception as exc:
+                failures += 1
+                print(f"{feed_path}: failed: {exc}", file=sys.stderr)
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            futures = [
+                (feed_path, pool.submit(split_feed, feed_path, feed_out, args.cache, args.now))
+                for feed_path, feed_out in tasks
+            ]
+            results = []
+            for feed_path, future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as exc:
+                    failures += 1
+                    print(f"{feed_path}: failed: {exc}", file=sys.stderr)
+
+    for feed_path, units, events in results:
+        print(f"{feed_path}: {events} reservation events across {units} units")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,34 @@
 import importlib.util
+import gzip
+import hashlib
+import hmac
 import json
+import os
+import sys
+import threading
+import time
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
 from icalendar import Calendar as ICal
+import pytest
 import pytz
+import requests
+from werkzeug.serving import make_server
 
 
 MODULE_PATH = Path(__file__).resolve().parent.parent / "format-calendars.py"
+SPLIT_CLI_PATH = Path(__file__).resolve().parent.parent / "split-calendars.py"
+LOAD_TEST_PATH = Path(__file__).resolve().parent.parent / "load-test.py"
+BENCH_CLASSIFICATION_PATH = Path(__file__).resolve().parent.parent / "bench-classification.py"
+REPLAY_FEEDS_PATH = Path(__file__).resolve().parent.parent / "replay-feeds.py"
 
 
-def load_module():
-    spec = importlib.util.spec_from_file_location("format_calendars", MODULE_PATH)
+def load_module(path=MODULE_PATH, name="format_calendars"):
+    spec = importlib.util.spec_from_file_location(name, path)
     if spec is None or spec.loader is None:
-        raise ImportError(f"Unable to load module from {MODULE_PATH}")
+        raise ImportError(f"Unable to load module from {path}")
     module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(module)
     return module
@@ -23,6 +38,15 @@ class DummyResponse:
     def __init__(self, text: str, status_code: int = 200):
         self.text = text
         self.status_code = status_code
+        self.closed = False
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        body = self.text.encode("utf-8")
+        for offset in range(0, len(body), chunk_size):
+            yield body[offset:offset + chunk_size]
+
+    def close(self):
+        self.closed = True
 
 
 ICS_SAMPLE = """BEGIN:VCALENDAR
@@ -265,6 +289,38 @@ END:VCALENDAR
 """
 
 
+class RecordingServer:
+    """Local stand-in for an outside HTTP service; records every request it receives."""
+
+    def __init__(self, status_code=200, statuses=()):
+        self.status_code = status_code
+        self.statuses = list(statuses)  # answered first, one per request, before falling back to status_code
+        self.requests = []
+        recorder = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _record(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                recorder.requests.append((self.command, self.path, dict(self.headers), body))
+                self.send_response(recorder.statuses.pop(0) if recorder.statuses else recorder.status_code)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            do_GET = do_POST = do_PURGE = _record
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d" % self._httpd.server_address[1]
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
 def ical_events_from_response(response):
     cal = ICal.from_ical(response.data)
     return [component for component in cal.walk() if component.name == "VEVENT"]
@@ -510,3 +566,1265 @@ def test_fetch_failure_uses_cache_without_overwriting_it(monkeypatch, tmp_path):
     assert future_uid in uids
     assert ended_uid not in uids
     assert cache_file.read_text() == original_cache_text
+
+
+def booking_feed(*events):
+    """A minimal source feed from (uid, dtstamp, summary, start, end) tuples."""
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//freetobook//EN"]
+    for uid, dtstamp, summary, start, end in events:
+        lines += [
+            "BEGIN:VEVENT", f"UID:{uid}", f"DTSTAMP:{dtstamp}", f"SUMMARY:{summary}",
+            f"DTSTART;VALUE=DATE:{start}", f"DTEND;VALUE=DATE:{end}", "END:VEVENT",
+        ]
+    return "\n".join(lines + ["END:VCALENDAR"])
+
+
+def test_calendar_route_filters_by_date_window(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    now = tz.localize(datetime(2025, 12, 3, 12, 0, 0))
+
+    cache_file = tmp_path / "cache.json"
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(ICS_SAMPLE))
+    props = module.parse_and_group_events(now_override=now, cache_file=str(cache_file))
+    monkeypatch.setattr(module, "parse_and_group_events", lambda: props)
+
+    with module.app.test_client() as client:
+        response = client.get("/calendar/apartment-ryo.ics?from=2025-12-10&to=2026-01-01")
+        assert response.status_code == 200
+        uids = [str(event.get("X-ORIGINAL-UID")) for event in ical_events_from_response(response)]
+        assert uids == ["72730530@freetobook.com"]
+
+        # Stays overlapping either edge of the window are included.
+        response = client.get("/calendar/apartment-ryo.ics?from=2025-12-05&to=2026-01-06")
+        uids = [str(event.get("X-ORIGINAL-UID")) for event in ical_events_from_response(response)]
+        assert uids == ["73244251@freetobook.com", "72730530@freetobook.com", "73302947@freetobook.com"]
+
+        assert len(ical_events_from_response(client.get("/calendar/apartment-ryo.ics"))) == 5
+        assert client.get("/calendar/apartment-ryo.ics?from=not-a-date").status_code == 400
+
+        monkeypatch.setattr(module, "DEFAULT_HORIZON_DAYS", 10)
+        response = client.get("/calendar/apartment-ryo.ics?from=2025-12-10")
+        uids = [str(event.get("X-ORIGINAL-UID")) for event in ical_events_from_response(response)]
+        assert uids == ["72730530@freetobook.com"]
+
+
+def test_availability_reports_free_units_and_occupancy(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    now = tz.localize(datetime(2025, 12, 3, 12, 0, 0))
+
+    cache_file = tmp_path / "cache.json"
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(ICS_SAMPLE))
+    props = module.parse_and_group_events(now_override=now, cache_file=str(cache_file))
+    monkeypatch.setattr(module, "parse_and_group_events", lambda: props)
+
+    with module.app.test_client() as client:
+        response = client.get("/availability.json?from=2025-12-07&to=2025-12-11")
+        assert response.status_code == 200
+        payload = response.get_json()
+
+        assert payload["nights"] == 4
+        # Room TWO checks out on the 8th; everything else listed is empty for these nights.
+        assert "Room TWO" not in payload["available"]
+        assert "Apartment RYO" in payload["available"]
+        assert "Room FOUR" in payload["available"]
+        assert payload["units"]["Room TWO"]["booked_nights"] == 1
+        assert payload["units"]["Room TWO"]["occupancy_rate"] == 0.25
+        assert payload["units"]["Apartment AYA"]["booked_nights"] == 1
+
+        response = client.get("/availability.json?from=2025-12-14&to=2025-12-20")
+        payload = response.get_json()
+        assert payload["units"]["Apartment RYO"]["booked_nights"] == 6
+        assert "Apartment RYO" not in payload["available"]
+
+        assert client.get("/availability.json?from=2025-12-07").status_code == 400
+
+
+def test_double_bookings_are_reported_by_endpoint_and_metric(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    now = tz.localize(datetime(2025, 12, 3, 12, 0, 0))
+
+    overlapping_feed = ICS_SAMPLE.replace(
+        "END:VCALENDAR",
+        "BEGIN:VEVENT\nUID:99999999@freetobook.com\nDTSTAMP:20251203T101743Z\n"
+        "SUMMARY:Apartment RYO:CTBOVERLAP\nDTSTART;VALUE=DATE:20251216\nDTEND;VALUE=DATE:20251218\n"
+        "END:VEVENT\nEND:VCALENDAR",
+    )
+    cache_file = tmp_path / "cache.json"
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(overlapping_feed))
+    props = module.parse_and_group_events(now_override=now, cache_file=str(cache_file))
+    monkeypatch.setattr(module, "parse_and_group_events", lambda: props)
+
+    with module.app.test_client() as client:
+        payload = client.get("/conflicts.json").get_json()
+        assert payload["count"] == 1
+        conflict = payload["conflicts"][0]
+        assert conflict["unit"] == "Apartment RYO"
+        assert [r["uid"] for r in conflict["reservations"]] == ["72730530@freetobook.com", "99999999@freetobook.com"]
+        assert [r["booking_code"] for r in conflict["reservations"]] == ["CTB18FBBD7", "CTBOVERLAP"]
+
+        assert "pms_double_bookings 1" in client.get("/metrics").get_data(as_text=True)
+
+
+def test_back_to_back_stays_are_not_double_bookings():
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    first = {"uid": "a", "start": tz.localize(datetime(2026, 1, 1, 16)), "end": tz.localize(datetime(2026, 1, 3, 11))}
+    second = {"uid": "b", "start": tz.localize(datetime(2026, 1, 3, 16)), "end": tz.localize(datetime(2026, 1, 5, 11))}
+
+    assert module.detect_double_bookings({"Room ONE": [second, first]}) == []
+
+
+def test_turnovers_pair_each_check_out_with_the_next_arrival(monkeypatch):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+
+    def stay(uid, start, end):
+        return {
+            "uid": uid, "booking_code": uid.upper(), "summary": uid, "description": "",
+            "start": tz.localize(start), "end": tz.localize(end),
+        }
+
+    props = {
+        "Apartment RYO": [
+            stay("r3", datetime(2026, 1, 10, 16), datetime(2026, 1, 12, 11)),
+            stay("r1", datetime(2026, 1, 1, 16), datetime(2026, 1, 3, 11)),
+            stay("r2", datetime(2026, 1, 3, 16), datetime(2026, 1, 6, 11)),
+            stay("rx", datetime(2026, 1, 4, 16), datetime(2026, 1, 5, 11)),
+        ],
+        "Room ONE": [stay("o1", datetime(2026, 1, 2, 16), datetime(2026, 1, 4, 11))],
+    }
+    monkeypatch.setattr(module, "parse_and_group_events", lambda: props)
+
+    snapshot = module.get_snapshot()
+    turnovers = snapshot.turnovers()
+    assert snapshot.turnovers() is turnovers, "Computed once per snapshot"
+    assert [(t["unit"], t["departing"]["uid"], (t["arriving"] or {}).get("uid")) for t in turnovers] == [
+        ("Apartment RYO", "r1", "r2"),
+        ("Room ONE", "o1", None),
+        ("Apartment RYO", "rx", "r3"),
+        ("Apartment RYO", "r2", "r3"),
+        ("Apartment RYO", "r3", None),
+    ], "A double-booked stay inside another is not the next arrival"
+    first = turnovers[0]
+    assert first["same_day"] and first["gap_hours"] == 5.0 and first["gap_nights"] == 0
+    assert (turnovers[3]["gap_nights"], turnovers[3]["gap_hours"]) == (4, 101.0)
+
+    with module.app.test_client() as client:
+        payload = client.get("/turnovers.json?unit=apartment-ryo&from=2026-01-04&to=2026-01-12").get_json()
+        assert [t["departing"]["uid"] for t in payload["turnovers"]] == ["rx", "r2"]
+        assert payload["same_day"] == 0
+        assert client.get("/turnovers.json?unit=nowhere").status_code == 404
+
+        response = client.get("/turnovers.ics")
+        body = response.get_data(as_text=True)
+        assert body.count("X-EVENT-TYPE:TURNOVER") == 5
+        assert "SUMMARY:Same-day turnover: Apartment RYO" in body
+        assert "DTSTART;TZID=America/Puerto_Rico:20260103T110000" in body
+        assert "DTEND;TZID=America/Puerto_Rico:20260103T160000" in body
+        assert "BEGIN:VTIMEZONE" in body
+        assert client.get("/turnovers.ics", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+def test_split_cli_writes_unit_feeds_for_each_source_file(monkeypatch, tmp_path):
+    cli = load_module(SPLIT_CLI_PATH, "split_calendars")
+    # Worker tasks are pickled by module name, as they are when the script runs as __main__.
+    monkeypatch.setitem(sys.modules, "split_calendars", cli)
+    feeds = tmp_path / "feeds"
+    feeds.mkdir()
+    (feeds / "december.ics").write_text(ICS_SAMPLE)
+    (feeds / "april.ics").write_text(MULTI_UNIT_BOOKING_SAMPLE)
+    out = tmp_path / "out"
+
+    exit_code = cli.main([str(feeds), "--out", str(out), "--jobs", "2", "--now", "2025-12-03T12:00:00"])
+
+    assert exit_code == 0
+    ryo = ICal.from_ical((out / "december" / "apartment-ryo.ics").read_bytes())
+    assert len([c for c in ryo.walk() if c.name == "VEVENT"]) == 5
+    aya = ICal.from_ical((out / "april" / "apartment-aya.ics").read_bytes())
+    codes = [str(c.get("X-RESERVATION-CODE")) for c in aya.walk() if c.name == "VEVENT"]
+    assert codes == ["WTB19BCD37-2"]
+    assert (out / "april" / "room-four.ics").exists(), "Known units always get a feed"
+
+
+def test_split_cli_counts_unparseable_feeds_as_failures(tmp_path, capsys):
+    cli = load_module(SPLIT_CLI_PATH, "split_calendars")
+    feeds = tmp_path / "feeds"
+    feeds.mkdir()
+    (feeds / "a.ics").write_text(MULTI_UNIT_BOOKING_SAMPLE)
+    (feeds / "b.ics").write_text(MULTI_UNIT_BOOKING_SAMPLE.replace("DTSTART;VALUE=DATE:2026", "DTSTART;VALUE=DATE:x2026"))
+    out = tmp_path / "out"
+
+    assert cli.main([str(feeds), "--out", str(out), "--jobs", "1", "--now", "2026-04-17T12:00:00"]) == 1
+    assert "b.ics: failed: could not be parsed" in capsys.readouterr().err
+    assert (out / "a").exists() and not (out / "b").exists()
+
+
+def test_replay_tool_records_merge_state_after_each_feed(monkeypatch, tmp_path, capsys):
+    replay = load_module(REPLAY_FEEDS_PATH, "replay_feeds")
+    stay = ("74699664@freetobook.com", "20250101T000000Z", "Apartment RYO:WTB19BCD37", "20250115", "20250118")
+    rebooked = stay[:1] + ("20250111T000000Z",) + stay[2:]
+    later = ("74699663@freetobook.com", "20250111T000000Z", "Apartment AYA:WTB2", "20250301", "20250303")
+    feeds = tmp_path / "feeds"
+    feeds.mkdir()
+    (feeds / "20250116T120000.ics").write_text(booking_feed())
+    (feeds / "20250110T120000.ics").write_text(booking_feed(stay, later))
+    (feeds / "20250112T120000.ics").write_text(booking_feed(rebooked, later))
+
+    history_dir = tmp_path / "history"
+    monkeypatch.setattr(replay.calendars, "HISTORY_DIR", str(history_dir))
+    report = replay.run(str(feeds))
+    assert not history_dir.exists(), "Replays never append to the reservation history"
+    assert replay.calendars.HISTORY_DIR == str(history_dir)
+    results = report["results"]
+    assert [r["feed"] for r in results] == ["20250110T120000.ics", "20250112T120000.ics", "20250116T120000.ics"]
+    assert [r["units"]["Apartment RYO"][0][4] for r in results] == [1, 2, 2], "Newer DTSTAMP bumps the version"
+    assert "Apartment AYA" in results[1]["units"]
+    assert "Apartment AYA" not in results[2]["units"], "Vanished future booking is cancelled"
+    assert results[2]["units"]["Apartment RYO"][0][:2] == ["74699664@freetobook.com", "WTB19BCD37"], (
+        "Started booking is kept after the feed drops it"
+    )
+    assert report["summary"]["steps"] == 3 and report["summary"]["failed_steps"] == 0
+
+    baseline_path = tmp_path / "baseline.json"
+    assert replay.main([str(feeds), "--out", str(baseline_path)]) == 0
+    assert replay.main([str(feeds), "--compare", str(baseline_path), "--json"]) == 0
+    capsys.readouterr()
+
+    baseline = json.loads(baseline_path.read_text())
+    baseline["results"][1]["units"]["Apartment RYO"][0][4] = 1
+    baseline_path.write_text(json.dumps(baseline))
+    manifest = tmp_path / "steps.txt"
+    manifest.write_text("# when fetched, feed\n" + "".join(
+        f"{name[:15]} feeds/{name}\n" for name in ["20250110T120000.ics", "20250112T120000.ics", "20250116T120000.ics"]
+    ))
+    assert replay.main([str(manifest), "--compare", str(baseline_path)]) == 1
+    assert "step 1 (20250112T120000.ics): Apartment RYO" in capsys.readouterr().out
+
+
+def test_published_feeds_are_served_from_disk(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    now = tz.localize(datetime(2026, 4, 17, 12, 0, 0))
+
+    cache_file = tmp_path / "cache.json"
+    publish_dir = tmp_path / "published"
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(MULTI_UNIT_BOOKING_SAMPLE))
+    props = module.parse_and_group_events(now_override=now, cache_file=str(cache_file))
+    monkeypatch.setattr(module, "parse_and_group_events", lambda: props)
+    monkeypatch.setattr(module, "PUBLISH_DIR", str(publish_dir))
+
+    with module.app.test_client() as client:
+        response = client.get("/calendar/apartment-aya.ics")
+        assert response.status_code == 200
+        assert response.data == (publish_dir / "apartment-aya.ics").read_bytes()
+        assert response.headers["ETag"]
+        assert response.headers["Last-Modified"]
+        assert (publish_dir / "apartment-aya.ics.gz").exists()
+
+        not_modified = client.get("/calendar/apartment-aya.ics", headers={"If-None-Match": response.headers["ETag"]})
+        assert not_modified.status_code == 304
+
+        compressed = client.get("/calendar/apartment-aya.ics", headers={"Accept-Encoding": "gzip"})
+        assert compressed.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(compressed.data) == response.data
+
+        # Re-publishing an unchanged snapshot leaves the files alone.
+        assert module.publish_snapshot(module.get_snapshot(), str(publish_dir)) == []
+
+        monkeypatch.setattr(module, "X_ACCEL_REDIRECT_PREFIX", "/published/")
+        redirected = client.get("/calendar/apartment-aya.ics")
+        assert redirected.headers["X-Accel-Redirect"] == "/published/apartment-aya.ics"
+        assert redirected.data == b""
+
+
+def test_streamed_feed_is_parsed_across_chunk_boundaries(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    now = tz.localize(datetime(2026, 4, 17, 12, 0, 0))
+
+    cache_file = tmp_path / "cache.json"
+    response = DummyResponse(MULTI_UNIT_BOOKING_SAMPLE.replace("\n", "\r\n"))
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: response)
+    monkeypatch.setattr(module, "FETCH_CHUNK_BYTES", 7)
+
+    props = module.parse_and_group_events(now_override=now, cache_file=str(cache_file))
+
+    assert [e["booking_code"] for e in props["Apartment UMI"]] == ["WTB19BCD37-4"]
+    assert response.closed
+
+
+def test_oversized_or_truncated_feed_falls_back_to_cache(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    now = tz.localize(datetime(2026, 4, 17, 12, 0, 0))
+
+    cache_file = tmp_path / "cache.json"
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(MULTI_UNIT_BOOKING_SAMPLE))
+    module.parse_and_group_events(now_override=now, cache_file=str(cache_file))
+    original_cache_text = cache_file.read_text()
+
+    # Cut off mid-feed: the missing bookings must not be treated as cancelled.
+    truncated = MULTI_UNIT_BOOKING_SAMPLE.split("BEGIN:VEVENT\nUID:74699664")[0]
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(truncated))
+    props = module.parse_and_group_events(now_override=now, cache_file=str(cache_file))
+    assert len(props["Apartment RYO"]) == 1
+    assert cache_file.read_text() == original_cache_text
+
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(MULTI_UNIT_BOOKING_SAMPLE))
+    monkeypatch.setattr(module, "FETCH_MAX_BYTES", 100)
+    with pytest.raises(ValueError, match="larger than 100 bytes"):
+        list(module.fetch_source_events())
+
+
+def test_unchanged_reservations_reuse_cached_vevent_fragments(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    now = tz.localize(datetime(2025, 12, 3, 12, 0, 0))
+
+    cache_file = tmp_path / "cache.json"
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(ICS_SAMPLE))
+    props = module.parse_and_group_events(now_override=now, cache_file=str(cache_file))
+    events = props["Apartment RYO"]
+
+    first = module.render_property_calendar("Apartment RYO", events)
+    assert (module.vevent_cache.hits, module.vevent_cache.misses) == (0, 5)
+
+    assert module.render_property_calendar("Apartment RYO", events) == first
+    assert (module.vevent_cache.hits, module.vevent_cache.misses) == (5, 5)
+
+    changed = dict(events[0], version=2)
+    rendered = module.render_property_calendar("Apartment RYO", [changed] + events[1:])
+    assert (module.vevent_cache.hits, module.vevent_cache.misses) == (9, 6)
+    assert b"SEQUENCE:2" in rendered
+
+    with module.app.test_client() as client:
+        metrics = client.get("/metrics").get_data(as_text=True)
+    assert 'pms_cache_hit_ratio{cache="vevent"} 0.6' in metrics
+
+
+def test_load_test_feed_server_is_a_usable_upstream(monkeypatch, tmp_path):
+    harness = load_module(LOAD_TEST_PATH, "load_test")
+    module = load_module()
+    feed = harness.FakeFeedServer(harness.synthetic_feed(45), not_modified=True).start()
+    try:
+        monkeypatch.setattr(module, "SOURCE_ICAL_URL", feed.url)
+        props = module.parse_and_group_events(cache_file=str(tmp_path / "cache.json"))
+        assert sum(len(events) for events in props.values()) == 45
+        assert all(len(props[unit]) == 5 for unit in module.KNOWN_PROPERTIES)
+
+        unchanged = module.parse_and_group_events(cache_file=str(tmp_path / "cache.json"))
+        assert module.last_parse_stats["source_ok"], "A 304 is an unchanged feed, not a failed fetch"
+        assert module.last_parse_stats["events_parsed"] == 0
+        assert {k: [e["uid"] for e in v] for k, v in unchanged.items()} == {k: [e["uid"] for e in v] for k, v in props.items()}
+
+        module.source_event_cache.clear()
+        module.parse_and_group_events(cache_file=str(tmp_path / "cache.json"))
+        assert not module.last_parse_stats["source_ok"], "A 304 whose events were evicted cannot be replayed"
+        refetched = module.parse_and_group_events(cache_file=str(tmp_path / "cache.json"))
+        assert module.last_parse_stats["source_ok"] and module.last_parse_stats["events_parsed"] == 46
+        assert sum(len(events) for events in refetched.values()) == 45
+        assert module.requests.get(feed.url, headers={"If-None-Match": feed.etag}).status_code == 304
+        feed.error_rate = 1.0
+        assert module.requests.get(feed.url).status_code == 503
+        assert feed.counts == {"requests": 6, "ok": 2, "not_modified": 3, "errors": 1}
+    finally:
+        feed.stop()
+
+
+def peer_instance(monkeypatch, tmp_path, name, feed_url, **settings):
+    """A separately loaded copy of the app with its own cache file, as if it ran on another machine."""
+    module = load_module(name=name)
+    cache_file = str(tmp_path / f"{name}.json")
+    monkeypatch.setattr(module, "SOURCE_ICAL_URL", feed_url)
+    monkeypatch.setattr(module, "CACHE_FILE", cache_file)
+    real_parse = module.parse_and_group_events
+    monkeypatch.setattr(module, "parse_and_group_events", lambda: real_parse(cache_file=cache_file))
+    for setting, value in settings.items():
+        monkeypatch.setattr(module, setting, value)
+    return module
+
+
+def test_peer_followers_use_the_leaders_snapshot(monkeypatch, tmp_path):
+    harness = load_module(LOAD_TEST_PATH, "load_test")
+    feed = harness.FakeFeedServer(harness.synthetic_feed(30)).start()
+    leader = peer_instance(monkeypatch, tmp_path, "leader", feed.url, PEER_SECRET="peer-secret")
+    server = make_server("127.0.0.1", 0, leader.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    leader_url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        followers = [
+            peer_instance(monkeypatch, tmp_path, f"follower{i}", feed.url, PEER_LEADER_URL=leader_url, PEER_SECRET="peer-secret")
+            for i in range(2)
+        ]
+        snapshots = [follower.get_snapshot() for follower in followers]
+        assert feed.counts["requests"] == 1, "Only the leader should hit the source feed"
+        leader_uids = {k: [e["uid"] for e in v] for k, v in leader.current_snapshot().properties.items()}
+        for follower, snapshot in zip(followers, snapshots):
+            assert {k: [e["uid"] for e in v] for k, v in snapshot.properties.items()} == leader_uids
+            assert snapshot.stats["peer_version"] == snapshots[0].stats["peer_version"]
+            cached = json.loads(Path(follower.CACHE_FILE).read_text())
+            assert sum(len(v) for v in cached.values()) == 30
+        with followers[0].app.test_client() as client:
+            assert client.get("/peer/snapshot", headers={"X-Peer-Token": "peer-secret"}).status_code == 404
+
+        response = requests.get(leader_url + "/peer/snapshot", headers={"X-Peer-Token": "peer-secret"})
+        signature = response.headers["X-Peer-Signature"]
+        with pytest.raises(ValueError, match="signature"):
+            followers[0].verify_peer_snapshot(response.content.replace(b"Apartment", b"Apartmnet"), signature)
+        newer = followers[0].Snapshot({})
+        newer.stats = {"peer_built_at": "2999-01-01T00:00:00+00:00"}
+        with pytest.raises(ValueError, match="older"):
+            followers[0].verify_peer_snapshot(response.content, signature, newer)
+
+        intruder = peer_instance(monkeypatch, tmp_path, "intruder", feed.url, PEER_LEADER_URL=leader_url, PEER_SECRET="guess")
+        assert "peer_version" not in intruder.get_snapshot().stats
+        assert feed.counts["requests"] == 2, "A follower the leader refuses fetches for itself"
+
+        monkeypatch.setattr(leader, "PEER_LEASE_SECONDS", 0)
+        leader.invalidate_snapshot()
+        followers[0].invalidate_snapshot()
+        assert "peer_version" not in followers[0].get_snapshot().stats, "An expired lease must not be trusted"
+        assert feed.counts["requests"] == 4
+
+        server.shutdown()
+        followers[1].invalidate_snapshot()
+        snapshot = followers[1].get_snapshot()
+        assert snapshot.stats["source_ok"] and "peer_version" not in snapshot.stats
+        assert {k: [e["uid"] for e in v] for k, v in snapshot.properties.items()} == leader_uids
+        assert feed.counts["requests"] == 5
+    finally:
+        server.shutdown()
+        feed.stop()
+
+
+def test_large_unit_feeds_are_streamed(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    now = tz.localize(datetime(2025, 12, 3, 12, 0, 0))
+
+    cache_file = tmp_path / "cache.json"
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(ICS_SAMPLE))
+    props = module.parse_and_group_events(now_override=now, cache_file=str(cache_file))
+    monkeypatch.setattr(module, "parse_and_group_events", lambda: props)
+    expected = module.render_property_calendar("Apartment RYO", props["Apartment RYO"])
+
+    with module.app.test_client() as client:
+        buffered = client.get("/calendar/apartment-ryo.ics")
+        assert buffered.headers["Content-Length"] == str(len(expected))
+
+        monkeypatch.setattr(module, "STREAM_MIN_EVENTS", 5)
+        streamed = client.get("/calendar/apartment-ryo.ics")
+        assert "Content-Length" not in streamed.headers
+        assert streamed.data == expected
+
+    chunks = list(module.iter_property_calendar("Apartment RYO", props["Apartment RYO"]))
+    assert len(chunks) == 5 + 3, "header, one chunk per event, VTIMEZONE and footer"
+
+
+def test_responses_carry_shared_cache_headers(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    now = tz.localize(datetime(2026, 4, 17, 12, 0, 0))
+
+    cache_file = tmp_path / "cache.json"
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(MULTI_UNIT_BOOKING_SAMPLE))
+    props = module.parse_and_group_events(now_override=now, cache_file=str(cache_file))
+    monkeypatch.setattr(module, "parse_and_group_events", lambda: props)
+
+    with module.app.test_client() as client:
+        response = client.get("/calendar/apartment-aya.ics")
+        cache_control = response.headers["Cache-Control"]
+        assert cache_control.startswith("public, max-age=")
+        assert 0 < int(cache_control.split("max-age=")[1].split(",")[0]) <= module.SNAPSHOT_TTL_SECONDS
+        assert "stale-while-revalidate=1800" in cache_control
+        assert response.headers["Surrogate-Key"] == "unit-apartment-aya"
+        assert response.headers["Vary"] == "Accept-Encoding"
+        assert response.headers["Last-Modified"]
+
+        assert client.get("/calendar/apartment-aya.ics", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+        index = client.get("/")
+        assert index.headers["Cache-Control"].startswith("public, max-age=")
+        assert index.headers["Surrogate-Key"] == "index"
+        assert index.headers["Vary"] == "Host"
+
+
+def test_refresh_purges_only_changed_units(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    now = tz.localize(datetime(2026, 4, 17, 12, 0, 0))
+
+    cache_file = tmp_path / "cache.json"
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(MULTI_UNIT_BOOKING_SAMPLE))
+    props = module.parse_and_group_events(now_override=now, cache_file=str(cache_file))
+    changed_props = dict(props)
+    changed_props["Apartment RYO"] = [dict(props["Apartment RYO"][0], version=2)]
+    snapshots = iter([props, changed_props, changed_props])
+    monkeypatch.setattr(module, "parse_and_group_events", lambda: next(snapshots))
+
+    receiver = RecordingServer()
+    try:
+        monkeypatch.setattr(module, "purge_hooks", [module.http_purge_hook(receiver.url + "/purge")])
+        module.get_snapshot()
+        assert receiver.requests == [], "The first snapshot has nothing to compare against"
+
+        module.invalidate_snapshot()
+        snapshot = module.get_snapshot()
+        assert snapshot.changed_units == ["Apartment RYO"]
+        assert module.purges.wait_idle(timeout=5)
+        assert [(method, path, headers["Surrogate-Key"]) for method, path, headers, _ in receiver.requests] == [
+            ("PURGE", "/purge", "unit-apartment-ryo index"),
+        ]
+        assert snapshot.unit_last_modified["Apartment AYA"] < snapshot.unit_last_modified["Apartment RYO"]
+
+        module.invalidate_snapshot()
+        assert module.get_snapshot().changed_units == []
+        assert module.purges.wait_idle(timeout=5)
+        assert len(receiver.requests) == 1
+
+        # A CDN that hangs on PURGE never holds up the request that triggered the refresh.
+        release = threading.Event()
+        monkeypatch.setattr(module, "purge_hooks", [lambda keys: release.wait(5)])
+        snapshots = iter([props])
+        module.invalidate_snapshot()
+        started = time.monotonic()
+        assert module.get_snapshot().changed_units == ["Apartment RYO"]
+        assert time.monotonic() - started < 1
+        assert not module.purges.wait_idle(timeout=0.05)
+        release.set()
+        assert module.purges.wait_idle(timeout=5)
+    finally:
+        receiver.stop()
+
+
+def test_webhooks_push_changed_units_to_subscribers(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    now = tz.localize(datetime(2026, 4, 17, 12, 0, 0))
+    monkeypatch.setattr(module, "WEBHOOK_SUBSCRIPTIONS_FILE", str(tmp_path / "subscriptions.json"))
+    monkeypatch.setattr(module, "SUBSCRIPTION_TOKEN", "sub-token")
+    monkeypatch.setattr(module, "WEBHOOK_SECRET", "hook-secret")
+    monkeypatch.setattr(module, "WEBHOOK_RETRY_BASE_SECONDS", 0.05)
+
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(MULTI_UNIT_BOOKING_SAMPLE))
+    props = module.parse_and_group_events(now_override=now, cache_file=str(tmp_path / "cache.json"))
+    changed_props = dict(props)
+    changed_props["Apartment RYO"] = [dict(props["Apartment RYO"][0], version=2)]
+    snapshots = iter([props, changed_props])
+    monkeypatch.setattr(module, "parse_and_group_events", lambda: next(snapshots))
+    module.get_snapshot()
+
+    receiver = RecordingServer(statuses=[503])
+    try:
+        token = {"X-Subscription-Token": "sub-token"}
+        with module.app.test_client() as client:
+            assert client.post("/subscriptions", json={"unit": "apartment-ryo", "url": receiver.url}).status_code == 404
+            assert client.post("/subscriptions", json={"unit": "apartment-ryo", "url": "ftp://x"}, headers=token).status_code == 400
+            assert client.post("/subscriptions", json={"unit": "nowhere", "url": receiver.url}, headers=token).status_code == 404
+            for unit in ("apartment-ryo", "apartment-aya", "apartment-ryo"):
+                client.post("/subscriptions", json={"unit": unit, "url": receiver.url + "/hook"}, headers=token)
+            subscriptions = client.get("/subscriptions", headers=token).get_json()["subscriptions"]
+            assert sorted(s["unit"] for s in subscriptions) == ["Apartment AYA", "Apartment RYO"]
+
+            module.invalidate_snapshot()
+            assert module.get_snapshot().changed_units == ["Apartment RYO"]
+            assert module.webhooks.wait_idle(timeout=5)
+
+            assert [(method, path) for method, path, _, _ in receiver.requests] == [("POST", "/hook"), ("POST", "/hook")]
+            first, second = (headers for _, _, headers, _ in receiver.requests)
+            assert first["X-Webhook-Delivery"] == second["X-Webhook-Delivery"], "A retry resends the same delivery"
+            assert (first["X-Webhook-Attempt"], second["X-Webhook-Attempt"]) == ("1", "2")
+            body = receiver.requests[-1][3]
+            expected = hmac.new(b"hook-secret", body, hashlib.sha256).hexdigest()
+            assert second["X-Webhook-Signature"] == f"sha256={expected}"
+            payload = json.loads(body)
+            assert [u["unit"] for u in payload["units"]] == ["Apartment RYO"], "Only changed units are pushed"
+            assert payload["units"][0]["calendar"] == "/calendar/apartment-ryo.ics"
+
+            metrics = client.get("/metrics").get_data(as_text=True)
+            assert "pms_webhook_retries 1" in metrics
+            assert "pms_webhooks_delivered 1" in metrics
+
+            ryo = next(s for s in subscriptions if s["unit"] == "Apartment RYO")
+            assert client.delete(f"/subscriptions/{ryo['id']}", headers=token).status_code == 204
+            assert client.delete(f"/subscriptions/{ryo['id']}", headers=token).status_code == 404
+            assert len(client.get("/subscriptions", headers=token).get_json()["subscriptions"]) == 1
+    finally:
+        receiver.stop()
+
+
+def test_each_change_is_pushed_by_one_worker_only(monkeypatch, tmp_path):
+    subscriptions = tmp_path / "subscriptions.json"
+    subscriptions.write_text(json.dumps([{"id": "s1", "unit": "Apartment RYO", "url": "http://receiver/hook"}]))
+    sent = []
+    workers = [load_module(name=f"format_calendars_worker_{n}") for n in range(2)]
+    for worker in workers:
+        monkeypatch.setattr(worker, "WEBHOOK_SUBSCRIPTIONS_FILE", str(subscriptions))
+        monkeypatch.setattr(worker.webhooks, "submit", lambda url, payload: sent.append(payload) or True)
+
+    def change(worker, digest):
+        snapshot = worker.Snapshot({"Apartment RYO": [], "Apartment AYA": []})
+        snapshot.unit_digests = {"Apartment RYO": digest, "Apartment AYA": digest}
+        snapshot.changed_units = ["Apartment RYO", "Apartment AYA"]
+        worker.notify_subscribers(snapshot)
+        return [unit["etag"] for payload in sent for unit in payload["units"]]
+
+    for worker in workers:
+        assert change(worker, "aaa") == ["aaa"], "Only the first worker to claim a change sends it"
+    for worker in workers:
+        assert change(worker, "bbb") == ["aaa", "bbb"]
+    for worker in workers:
+        assert change(worker, "aaa") == ["aaa", "bbb", "aaa"], "Changing back to an earlier feed is sent again"
+    assert sorted(path.name for path in (tmp_path / "webhook_claims").iterdir()) == ["apartment-ryo.aaa"]
+
+
+def test_webhook_queue_is_bounded_and_never_blocks(monkeypatch):
+    module = load_module()
+    release = threading.Event()
+    monkeypatch.setattr(module, "post_webhook", lambda delivery: release.wait(5))
+    dispatcher = module.WebhookDispatcher(max_pending=2)
+
+    started = time.perf_counter()
+    accepted = [dispatcher.submit("http://127.0.0.1:9/hook", {"n": n}) for n in range(4)]
+    assert time.perf_counter() - started < 1, "Submitting must not wait for a slow receiver"
+    assert accepted == [True, True, False, False]
+    assert module._metrics["pms_webhooks_dropped"] == 2
+
+    release.set()
+    assert dispatcher.wait_idle(timeout=5)
+    assert module._metrics["pms_webhooks_delivered"] == 2
+
+
+def test_refresh_rebuilds_in_place_and_reports_stages(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    now = tz.localize(datetime(2026, 4, 17, 12, 0, 0))
+
+    cache_file = tmp_path / "cache.json"
+    cache_file.write_text(json.dumps({
+        "Room ONE": [{
+            "uid": "started-uid",
+            "summary": "Room ONE (STARTED)",
+            "start": tz.localize(datetime(2026, 4, 15, 16, 0, 0)).isoformat(),
+            "end": tz.localize(datetime(2026, 4, 20, 11, 0, 0)).isoformat(),
+            "description": "Started booking",
+            "dtstamp": datetime(2026, 4, 1, 0, 0, 0, tzinfo=pytz.utc).isoformat(),
+            "version": 1,
+        }]
+    }))
+    real_parse = module.parse_and_group_events
+    monkeypatch.setattr(module, "parse_and_group_events", lambda: real_parse(now_override=now, cache_file=str(cache_file)))
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(MULTI_UNIT_BOOKING_SAMPLE))
+    monkeypatch.setattr(module, "CACHE_FILE", str(cache_file))
+
+    with module.app.test_client() as client:
+        response = client.post("/refresh")
+        assert response.status_code == 200
+        report = response.get_json()
+        assert set(report["timings"]) >= {"fetch_parse", "merge", "save", "render", "checks", "total"}
+        assert report["changes"]["source_reservations"] == 4
+        assert report["changes"]["restored_started"] == 1
+        assert "started-uid" in cache_file.read_text(), "A refresh must keep started bookings the feed dropped"
+
+        snapshot = module.get_snapshot()
+        monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse("unavailable", status_code=503))
+        cached_text = cache_file.read_text()
+        failed = client.get("/refresh")
+        assert failed.status_code == 502
+        assert failed.get_json()["status"] == "failed"
+        assert module.get_snapshot() is snapshot
+        assert cache_file.read_text() == cached_text
+
+
+def test_background_refresh_and_hard_reset(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    now = tz.localize(datetime(2026, 4, 17, 12, 0, 0))
+
+    cache_file = tmp_path / "cache.json"
+    real_parse = module.parse_and_group_events
+    monkeypatch.setattr(module, "parse_and_group_events", lambda: real_parse(now_override=now, cache_file=str(cache_file)))
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(MULTI_UNIT_BOOKING_SAMPLE))
+    monkeypatch.setattr(module, "CACHE_FILE", str(cache_file))
+
+    with module.app.test_client() as client:
+        assert client.get("/refresh/status").status_code == 404
+
+        started = client.post("/refresh?background=1")
+        assert started.status_code == 202
+        assert started.headers["Location"].endswith("/refresh/status")
+
+        deadline = time.monotonic() + 10
+        status = started.get_json()
+        while status["state"] == "running" and time.monotonic() < deadline:
+            time.sleep(0.01)
+            status = client.get("/refresh/status").get_json()
+        assert status["state"] == "succeeded"
+        assert status["result"]["changes"]["reservations"] == 4
+        assert cache_file.exists()
+
+        assert client.get("/refresh/hard-reset").status_code == 405
+        assert client.post("/refresh/hard-reset").status_code == 200
+        assert not cache_file.exists()
+
+
+def test_refresh_status_and_snapshot_swaps_are_shared_between_workers(monkeypatch, tmp_path):
+    cache_file = tmp_path / "cache.json"
+    monkeypatch.setattr(requests, "get", lambda url, **kwargs: DummyResponse(MULTI_UNIT_BOOKING_SAMPLE))
+    builds = {"first": 0, "second": 0}
+    workers = {}
+    for name in builds:
+        worker = workers[name] = load_module(name=f"format_calendars_{name}")
+        worker.CACHE_FILE = str(cache_file)
+        real_parse = worker.parse_and_group_events
+        worker.parse_and_group_events = (
+            lambda name=name, parse=real_parse: builds.__setitem__(name, builds[name] + 1) or parse(cache_file=str(cache_file))
+        )
+    first, second = workers["first"], workers["second"]
+
+    second.get_snapshot()
+    second.get_snapshot()
+    assert builds["second"] == 1
+
+    client_first, client_second = first.app.test_client(), second.app.test_client()
+    started = client_first.post("/refresh?background=1").get_json()
+    deadline = time.monotonic() + 10
+    status = client_second.get("/refresh/status").get_json()
+    assert status["id"] == started["id"], "Any worker can report the job"
+    while status["state"] == "running" and time.monotonic() < deadline:
+        time.sleep(0.01)
+        status = client_second.get("/refresh/status").get_json()
+    assert status["state"] == "succeeded"
+
+    first.get_snapshot()
+    assert builds["first"] == 1, "The worker that refreshed keeps its new snapshot"
+    second.get_snapshot()
+    second.get_snapshot()
+    assert builds["second"] == 2, "Other workers rebuild once after a refresh elsewhere"
+
+    assert client_first.post("/refresh").status_code == 200
+    second.get_snapshot()
+    assert builds["second"] == 3
+
+
+def test_slug_cache_is_bounded_and_reported(monkeypatch):
+    module = load_module()
+    monkeypatch.setattr(module.slugify_cache, "max_entries", 10)
+
+    for i in range(100):
+        assert module.slugify(f"Room Flood {i}") == f"room-flood-{i}"
+    assert module.slugify("Room Flood 99") == "room-flood-99"
+
+    stats = module.slugify_cache.stats()
+    assert stats["entries"] == 10
+    assert stats["evictions"] == 90
+    assert stats["hits"] == 1
+    assert stats["approx_bytes"] > 0
+
+
+def test_debug_memory_requires_token(monkeypatch):
+    module = load_module()
+
+    with module.app.test_client() as client:
+        assert client.get("/debug/memory").status_code == 404
+
+        monkeypatch.setattr(module, "DEBUG_TOKEN", "secret")
+        assert client.get("/debug/memory", headers={"X-Debug-Token": "wrong"}).status_code == 404
+
+        report = client.get("/debug/memory?start=1&stop=1&limit=5", headers={"X-Debug-Token": "secret"}).get_json()
+    assert set(report["caches"]) == {"slug", "source_event", "vevent", "vtimezone"}
+    assert report["tracemalloc"]["tracing"] is True
+    assert len(report["tracemalloc"]["top"]) <= 5
+    assert not module.tracemalloc.is_tracing()
+
+
+def test_profile_header_captures_single_request(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    now = tz.localize(datetime(2025, 12, 3, 12, 0, 0))
+
+    cache_file = tmp_path / "cache.json"
+    real_parse = module.parse_and_group_events
+    monkeypatch.setattr(module, "parse_and_group_events", lambda: real_parse(now_override=now, cache_file=str(cache_file)))
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(ICS_SAMPLE))
+    monkeypatch.setattr(module, "PROFILE_DIR", str(tmp_path / "profiles"))
+
+    with module.app.test_client() as client:
+        ignored = client.get("/calendar/apartment-ryo.ics", headers={"X-Profile": "save"})
+        assert "X-Profile-Files" not in ignored.headers, "Profiling needs DEBUG_TOKEN"
+
+        monkeypatch.setattr(module, "DEBUG_TOKEN", "secret")
+        headers = {"X-Debug-Token": "secret"}
+        module.invalidate_snapshot()
+        saved = client.get("/calendar/apartment-ryo.ics", headers=dict(headers, **{"X-Profile": "save"}))
+        assert len(ical_events_from_response(saved)) == 5
+        pstats_path, collapsed_path = saved.headers["X-Profile-Files"].split(", ")
+        assert module.pstats.Stats(pstats_path).total_calls > 0
+        collapsed = Path(collapsed_path).read_text()
+        assert "export_property_calendar" in collapsed
+        assert "parse_and_group_events" in collapsed, "A request that rebuilt the snapshot profiles the parse too"
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in collapsed.splitlines())
+
+        report = client.get("/", headers=dict(headers, **{"X-Profile": "stats"}))
+        assert report.mimetype == "text/plain"
+        assert "function calls" in report.get_data(as_text=True)
+
+
+def test_lookup_finds_suffixed_codes_without_fetching(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    now = tz.localize(datetime(2026, 4, 17, 12, 0, 0))
+
+    cache_file = tmp_path / "cache.json"
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(MULTI_UNIT_BOOKING_SAMPLE))
+    props = module.parse_and_group_events(now_override=now, cache_file=str(cache_file))
+    monkeypatch.setattr(module, "parse_and_group_events", lambda: props)
+
+    with module.app.test_client() as client:
+        module.get_snapshot()
+
+        def fail(url, **kwargs):
+            raise AssertionError("lookups must not fetch the source feed")
+        monkeypatch.setattr(module.requests, "get", fail)
+        monkeypatch.setattr(module, "SNAPSHOT_TTL_SECONDS", 0)
+
+        original = client.get("/lookup.json?q=WTB19BCD37").get_json()
+        assert original["count"] == 4
+        assert {m["unit"]: m["booking_code"] for m in original["matches"]} == {
+            "Apartment MAO - Five Bedroom": "WTB19BCD37-1",
+            "Apartment AYA": "WTB19BCD37-2",
+            "Apartment RYO": "WTB19BCD37-3",
+            "Apartment UMI": "WTB19BCD37-4",
+        }
+        assert {m["matched_on"] for m in original["matches"]} == {"original_booking_code"}
+
+        suffixed = client.get("/lookup.json?q=wtb19bcd37-3").get_json()
+        assert [(m["unit"], m["matched_on"], m["calendar"]) for m in suffixed["matches"]] == [
+            ("Apartment RYO", "booking_code", "/calendar/apartment-ryo.ics"),
+        ]
+
+        by_uid = client.get("/lookup.json?q=74699663@freetobook.com").get_json()
+        assert [m["unit"] for m in by_uid["matches"]] == ["Apartment AYA"]
+
+        assert client.get("/lookup.json?q=NOPE").get_json()["count"] == 0
+        assert client.get("/lookup.json").status_code == 400
+
+
+def test_lookups_before_the_first_refresh_reuse_the_cached_snapshot(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    cache_file = tmp_path / "cache.json"
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(MULTI_UNIT_BOOKING_SAMPLE))
+    module.parse_and_group_events(now_override=tz.localize(datetime(2026, 4, 17, 12, 0, 0)), cache_file=str(cache_file))
+    monkeypatch.setattr(module, "CACHE_FILE", str(cache_file))
+
+    loads = []
+    load = module.load_cached_reservations
+    monkeypatch.setattr(module, "load_cached_reservations", lambda path: loads.append(path) or load(path))
+
+    with module.app.test_client() as client:
+        first = client.get("/lookup.json?q=WTB19BCD37").get_json()
+        assert client.get("/lookup.json?q=WTB19BCD37").get_json() == first
+        assert len(loads) == 1, "The fallback snapshot is built once per cache file version"
+
+        cached = json.loads(cache_file.read_text())
+        cached = {key: value for key, value in cached.items() if "RYO" not in key}
+        cache_file.write_text(json.dumps(cached))
+        stat = cache_file.stat()
+        os.utime(cache_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        changed = client.get("/lookup.json?q=WTB19BCD37").get_json()
+        assert len(loads) == 2
+        assert "Apartment RYO" not in {m["unit"] for m in changed["matches"]}
+
+
+def test_summary_rules_dispatch_in_one_pass_and_count_hits(monkeypatch, tmp_path):
+    module = load_module()
+    classifier = module.summary_classifier
+    assert classifier.classify("Apartment RYO:WTB19BCD37", "1@freetobook.com") == (
+        "Apartment RYO", "WTB19BCD37", "reservation",
+    )
+    assert classifier.classify("Apartment MAO - Five Bedroom", "x:CTB42") == (
+        "Apartment MAO - Five Bedroom", "CTB42", "reservation",
+    )
+    assert classifier.classify("Apartment RYO", "2@freetobook.com") == (
+        "Apartment RYO", "2@freetobook.com", "block",
+    ), "Code-less summaries without a CTB UID are close-outs"
+    assert classifier.classify("Closed", "3@freetobook.com") is None
+    assert classifier.stats() == {
+        "format": "freetobook",
+        "hits": {"unit-and-code": 1, "unit-with-ctb-uid": 1, "unit-close-out": 1},
+        "unclassified": 1,
+    }
+
+    generic = module.SummaryClassifier("generic", module.CLASSIFICATION_RULES["generic"])
+    assert generic.classify("Reservation HM123 - Casa Luna", "a@example.com") == ("Casa Luna", "HM123", "reservation")
+    assert generic.classify("Casa Luna: HM456", "b@example.com") == ("Casa Luna", "HM456", "reservation")
+    assert generic.classify("Owner stay: Casa Luna", "c@example.com")[::2] == ("Casa Luna", "block")
+
+    guarded = module.SummaryClassifier("test", [
+        {"name": "vip", "summary": r"Room (?P<unit>\w+)", "uid_contains": "VIP"},
+        {"name": "any-room", "summary": r"(?P<unit>Room \w+)"},
+    ])
+    assert guarded.classify("Room ONE", "VIP-7") == ("ONE", "VIP-7", "reservation")
+    assert guarded.classify("Room ONE", "plain-8") == ("Room ONE", "plain-8", "reservation"), (
+        "A failed UID check falls through"
+    )
+    assert guarded.stats()["hits"] == {"vip": 1, "any-room": 1}
+
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(MULTI_UNIT_BOOKING_SAMPLE))
+    module.parse_and_group_events(cache_file=str(tmp_path / "cache.json"))
+    with module.app.test_client() as client:
+        metrics = client.get("/metrics").get_data(as_text=True)
+    assert 'pms_classification_hits{format="freetobook",rule="unit-and-code"} 5' in metrics
+    assert 'pms_classification_unclassified{format="freetobook"} 1' in metrics
+
+    bench = load_module(BENCH_CLASSIFICATION_PATH, "bench_classification")
+    report = bench.run(events=500, repeat=1)
+    assert sum(report["hits"].values()) + report["unclassified"] == 500
+    assert all(report["hits"][rule] > 0 for rule in ("unit-and-code", "unit-with-ctb-uid", "unit-close-out"))
+    assert bench.run(events=50, source_format="generic", repeat=1)["hits"]["block"] > 0
+    assert report["compiled_ns_per_event"] > 0 and report["baseline_ns_per_event"] > 0
+
+
+def test_units_use_their_own_timezone_and_stay_times(monkeypatch, tmp_path):
+    module = load_module()
+    monkeypatch.setattr(module, "UNIT_SETTINGS", {
+        "Apartment AYA": {"timezone": "America/New_York", "check_in": "15:00", "check_out": "10:00"},
+    })
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(MULTI_UNIT_BOOKING_SAMPLE))
+    cache_file = tmp_path / "cache.json"
+    now = pytz.utc.localize(datetime(2026, 4, 17, 12, 0, 0))
+    props = module.parse_and_group_events(now_override=now, cache_file=str(cache_file))
+
+    new_york = pytz.timezone("America/New_York")
+    aya = props["Apartment AYA"][0]
+    assert aya["start"] == new_york.localize(datetime(2026, 5, 7, 15, 0))
+    assert aya["end"] == new_york.localize(datetime(2026, 5, 11, 10, 0))
+    ryo = props["Apartment RYO"][0]
+    assert ryo["start"] == pytz.timezone(module.TIMEZONE).localize(datetime(2026, 5, 7, 16, 0))
+
+    restored = module.properties_from_cache(json.loads(cache_file.read_text()), now)
+    assert restored["Apartment AYA"][0]["start"].tzinfo.zone == "America/New_York"
+
+    body = module.render_property_calendar("Apartment AYA", props["Apartment AYA"]).decode()
+    assert "DTSTART;TZID=America/New_York:20260507T150000" in body
+    assert "DTEND;TZID=America/New_York:20260511T100000" in body
+    cal = ICal.from_ical(body)
+    [vtimezone] = [c for c in cal.walk() if c.name == "VTIMEZONE"]
+    assert str(vtimezone["TZID"]) == "America/New_York"
+    transitions = [(c.name, c["DTSTART"].dt) for c in vtimezone.subcomponents]
+    assert transitions == [
+        ("STANDARD", datetime(2026, 1, 1, 0, 0)),
+        ("DAYLIGHT", datetime(2026, 3, 8, 2, 0)),
+        ("STANDARD", datetime(2026, 11, 1, 2, 0)),
+    ]
+    assert "TZID=America/Puerto_Rico" in module.render_property_calendar("Apartment RYO", props["Apartment RYO"]).decode()
+
+    module.render_property_calendar("Apartment AYA", props["Apartment AYA"])
+    assert module.vtimezone_cache.stats()["entries"] == 2, "One block per (zone, year range)"
+    assert module.vtimezone_cache.hits >= 1
+
+
+def test_close_outs_are_exported_and_recurring_blocks_expand_within_the_horizon(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    feed = booking_feed(
+        ("74699664@freetobook.com", "20260401T000000Z", "Apartment RYO:WTB19BCD37", "20260505", "20260508"),
+        ("90000001@freetobook.com", "20260401T000000Z", "Apartment RYO", "20260510", "20260512"),
+        ("90000002@freetobook.com", "20260401T000000Z", "Apartment AYA", "20260301", "20260302"),
+    ).replace("END:VCALENDAR", "\n".join([
+        "BEGIN:VEVENT", "UID:90000003@freetobook.com", "DTSTAMP:20260401T000000Z", "SUMMARY:Closed - Apartment AYA",
+        "DTSTART:20200106T090000", "DTEND:20200106T120000", "RRULE:FREQ=WEEKLY;BYDAY=MO",
+        "EXDATE:20260511T090000", "END:VEVENT", "END:VCALENDAR",
+    ]))
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(feed))
+    now = tz.localize(datetime(2026, 5, 1, 12, 0))
+    props = module.parse_and_group_events(now_override=now, cache_file=str(tmp_path / "cache.json"))
+
+    assert [ev["uid"] for ev in props["Apartment RYO"]] == ["74699664@freetobook.com"]
+    blocks = module.last_source_blocks
+    assert [b["uid"] for b in blocks["Apartment RYO"]] == ["90000001@freetobook.com"]
+    assert [b["uid"] for b in blocks["Apartment AYA"]] == ["90000003@freetobook.com"], "Ended one-off blocks are dropped"
+    assert module.last_parse_stats["source_blocks"] == 2
+
+    body = module.render_property_calendar(
+        "Apartment RYO", props["Apartment RYO"], blocks["Apartment RYO"], window_start=now,
+    ).decode()
+    cal = ICal.from_ical(body)
+    [block] = [c for c in cal.walk("VEVENT") if c.get("X-EVENT-TYPE") == "BLOCK"]
+    assert block["DTSTART"].dt == datetime(2026, 5, 10).date()
+    assert "CTB" not in str(block["UID"]) and str(block["DESCRIPTION"]) == "Apartment RYO"
+
+    # Six years of Mondays, but only the occurrences inside the requested window are generated.
+    window_start = tz.localize(datetime(2026, 5, 1))
+    window_end = tz.localize(datetime(2026, 6, 1))
+    occurrences = module.iter_block_occurrences(blocks["Apartment AYA"][0], window_start, window_end, tz)
+    assert [start.day for start, _ in occurrences] == [4, 18, 25], "EXDATE skips 11 May"
+    body = module.render_property_calendar(
+        "Apartment AYA", props["Apartment AYA"], blocks["Apartment AYA"], window_start, window_end,
+    ).decode()
+    assert body.count("X-EVENT-TYPE:BLOCK") == 3
+    assert "DTSTART;TZID=America/Puerto_Rico:20260504T090000" in body
+    uids = [str(c["UID"]) for c in ICal.from_ical(body).walk("VEVENT")]
+    assert len(set(uids)) == 3
+
+    default_body = module.render_property_calendar("Apartment AYA", [], blocks["Apartment AYA"]).decode()
+    assert 50 <= default_body.count("X-EVENT-TYPE:BLOCK") <= 53, "Open-ended rules stop at BLOCK_HORIZON_DAYS"
+
+    parse = module.parse_and_group_events
+    monkeypatch.setattr(module, "parse_and_group_events", lambda: props)
+    with module.app.test_client() as client:
+        served = client.get("/calendar/apartment-aya.ics?from=2026-05-01&to=2026-06-01").get_data(as_text=True)
+    assert served.count("X-EVENT-TYPE:BLOCK") == 3
+
+    broken = feed.replace("DTSTART;VALUE=DATE:20260505", "DTSTART;VALUE=DATE:2026-05-05")
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(broken))
+    parse(now_override=now, cache_file=str(tmp_path / "other-cache.json"))
+    assert not module.last_parse_stats["source_ok"]
+    assert module.last_source_blocks == {}, "A failed parse must not leave the previous feed's blocks behind"
+
+    # After a restart, a failed fetch still exports the close-outs saved with the cache.
+    restarted = load_module()
+    monkeypatch.setattr(restarted.requests, "get", lambda url, **kwargs: DummyResponse(broken))
+    monkeypatch.setattr(restarted, "CACHE_FILE", str(tmp_path / "cache.json"))
+    assert [c["uid"] for c in restarted.current_snapshot().blocks["Apartment AYA"]] == ["90000003@freetobook.com"]
+    restarted_parse = restarted.parse_and_group_events
+    monkeypatch.setattr(
+        restarted, "parse_and_group_events",
+        lambda: restarted_parse(now_override=now, cache_file=str(tmp_path / "cache.json")),
+    )
+    snapshot = restarted.build_snapshot()
+    assert not snapshot.stats["source_ok"]
+    assert sorted(snapshot.blocks) == ["Apartment AYA", "Apartment RYO"]
+    served = restarted.render_property_calendar(
+        "Apartment AYA", snapshot.properties["Apartment AYA"], snapshot.blocks["Apartment AYA"], window_start, window_end,
+    ).decode()
+    assert served.count("X-EVENT-TYPE:BLOCK") == 3
+
+
+def test_a_broken_block_never_takes_down_the_snapshot(monkeypatch, tmp_path, caplog):
+    module = load_module()
+    monkeypatch.chdir(tmp_path)
+    feed = booking_feed(
+        ("74699664@freetobook.com", "20260401T000000Z", "Apartment RYO:WTB19BCD37", "20990505", "20990508"),
+        ("90000001@freetobook.com", "20260401T000000Z", "Apartment RYO", "20990510", "20990512"),
+    ).replace("END:VCALENDAR", "\n".join([
+        "BEGIN:VEVENT", "UID:90000003@freetobook.com", "DTSTAMP:20260401T000000Z", "SUMMARY:Apartment AYA",
+        "DTSTART:20260106T090000", "DTEND:20260106T120000", "RRULE:FREQ=SOMETIMES", "END:VEVENT", "END:VCALENDAR",
+    ]))
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(feed))
+    snapshot = module.get_snapshot()
+    assert snapshot.stats["source_ok"] and "Apartment AYA" not in snapshot.blocks
+    assert [b["uid"] for b in snapshot.blocks["Apartment RYO"]] == ["90000001@freetobook.com"]
+    assert "Dropping block 90000003@freetobook.com" in caplog.text
+
+    def broken(*args, **kwargs):
+        raise ValueError("cannot expand")
+        yield
+
+    monkeypatch.setattr(module, "iter_block_occurrences", broken)
+    module.invalidate_snapshot()
+    snapshot = module.get_snapshot()
+    assert "Apartment RYO" not in snapshot.blocks, "The unit's blocks are dropped, its reservations still export"
+    assert set(snapshot.unit_digests) == set(snapshot.properties)
+    with module.app.test_client() as client:
+        assert client.get("/calendar/apartment-ryo.ics").status_code == 200
+        assert client.get("/").status_code == 200
+
+
+def test_unchanged_source_events_are_not_reparsed(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    now = tz.localize(datetime(2025, 12, 3, 12, 0, 0))
+    cache_file = tmp_path / "cache.json"
+
+    parsed_uids = []
+    real_parse_source_reservation = module.parse_source_reservation
+
+    def counting_parse(component, outcome=None):
+        parsed_uids.append(str(component.get("UID")))
+        return real_parse_source_reservation(component, outcome)
+
+    monkeypatch.setattr(module, "parse_source_reservation", counting_parse)
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(ICS_SAMPLE))
+    first = module.parse_and_group_events(now_override=now, cache_file=str(cache_file))
+    assert len(parsed_uids) == 28
+
+    first_counts = module.summary_classifier.stats()
+    parsed_uids.clear()
+    second = module.parse_and_group_events(now_override=now, cache_file=str(cache_file))
+    assert parsed_uids == []
+    assert module.last_parse_stats["events_reused"] == 28
+    second_counts = module.summary_classifier.stats()
+    assert second_counts["hits"] == {rule: 2 * hits for rule, hits in first_counts["hits"].items()}, (
+        "Reused events are still counted by their classifying rule"
+    )
+    assert second_counts["unclassified"] == 2 * first_counts["unclassified"]
+    assert module.source_event_cache.stats()["entries"] == 28
+    assert {k: [(e["uid"], e["description"]) for e in v] for k, v in first.items()} == \
+        {k: [(e["uid"], e["description"]) for e in v] for k, v in second.items()}
+
+    modified = ICS_SAMPLE.replace(
+        "SUMMARY:Apartment RYO:CTB18FBBD7\nDTSTART;VALUE=DATE:20251214",
+        "SUMMARY:Apartment RYO:CTB18FBBD7\nDTSTART;VALUE=DATE:20251215",
+    )
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(modified))
+    third = module.parse_and_group_events(now_override=now, cache_file=str(cache_file))
+    assert parsed_uids == ["72730530@freetobook.com"]
+    assert module.last_parse_stats["events_parsed"] == 1
+    moved = next(e for e in third["Apartment RYO"] if e["uid"] == "72730530@freetobook.com")
+    assert moved["start"].date().isoformat() == "2025-12-15"
+    assert "Nights: 5" in moved["description"]
+
+
+def test_availability_counts_close_outs_as_unavailable(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    feed = booking_feed(
+        ("74699664@freetobook.com", "20270401T000000Z", "Apartment UMI:WTB19BCD37", "20270501", "20270504"),
+        ("90000001@freetobook.com", "20270401T000000Z", "Closed - Apartment RYO", "20270509", "20270512"),
+    ).replace("END:VCALENDAR", "\n".join([
+        "BEGIN:VEVENT", "UID:90000002@freetobook.com", "DTSTAMP:20270401T000000Z", "SUMMARY:Apartment AYA",
+        "DTSTART;VALUE=DATE:20270503", "DTEND;VALUE=DATE:20270504", "RRULE:FREQ=WEEKLY;BYDAY=MO",
+        "END:VEVENT", "END:VCALENDAR",
+    ]))
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(feed))
+    props = module.parse_and_group_events(
+        now_override=tz.localize(datetime(2027, 5, 1, 12, 0)), cache_file=str(tmp_path / "cache.json"),
+    )
+    monkeypatch.setattr(module, "parse_and_group_events", lambda: props)
+
+    with module.app.test_client() as client:
+        payload = client.get("/availability.json?from=2027-05-10&to=2027-05-14").get_json()
+    assert "Apartment RYO" not in payload["available"], "A close-out overlapping the window makes the unit unavailable"
+    assert payload["units"]["Apartment RYO"]["booked_nights"] == 2
+    assert "Apartment AYA" not in payload["available"]
+    assert payload["units"]["Apartment AYA"]["booked_nights"] == 1, "Only the Monday inside the window is closed"
+    assert "Apartment UMI" in payload["available"]
+
+
+def test_recurring_blocks_end_at_a_utc_until_in_the_units_timezone(monkeypatch, tmp_path):
+    module = load_module()
+    monkeypatch.setattr(module, "UNIT_SETTINGS", {"Apartment AYA": {"timezone": "Europe/Berlin"}})
+    berlin = pytz.timezone("Europe/Berlin")
+    # Mondays 09:00-12:00 Berlin time; the last one starts exactly at UNTIL (07:00Z = 09:00 CEST).
+    feed = booking_feed().replace("END:VCALENDAR", "\n".join([
+        "BEGIN:VEVENT", "UID:90000003@freetobook.com", "DTSTAMP:20270401T000000Z", "SUMMARY:Closed - Apartment AYA",
+        "DTSTART:20270503T070000Z", "DTEND:20270503T100000Z", "RRULE:FREQ=WEEKLY;UNTIL=20270524T070000Z",
+        "END:VEVENT", "END:VCALENDAR",
+    ]))
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(feed))
+    module.parse_and_group_events(
+        now_override=pytz.utc.localize(datetime(2027, 5, 1, 12, 0)), cache_file=str(tmp_path / "cache.json"),
+    )
+    [block] = module.last_source_blocks["Apartment AYA"]
+    occurrences = list(module.iter_block_occurrences(
+        block, berlin.localize(datetime(2027, 5, 1)), berlin.localize(datetime(2027, 7, 1)), berlin,
+    ))
+    assert [(start.day, start.hour, end.hour) for start, end in occurrences] == [
+        (3, 9, 12), (10, 9, 12), (17, 9, 12), (24, 9, 12),
+    ]
+
+
+def test_day_cutoffs_and_windows_follow_each_units_timezone(monkeypatch, tmp_path):
+    module = load_module()
+    monkeypatch.setattr(module, "UNIT_SETTINGS", {"Apartment AYA": {"timezone": "Asia/Tokyo", "check_out": "23:00"}})
+    feed = booking_feed(
+        # Left at 23:00 on 1 May in Tokyo: already yesterday there, though still 1 May in Puerto Rico.
+        ("74699661@freetobook.com", "20270401T000000Z", "Apartment AYA:WTB1", "20270428", "20270501"),
+        ("74699662@freetobook.com", "20270401T000000Z", "Apartment AYA:WTB2", "20270505", "20270509"),
+        ("74699663@freetobook.com", "20270401T000000Z", "Apartment RYO:WTB3", "20270505", "20270509"),
+    )
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(feed))
+    # 2 May 01:00 in Tokyo, 1 May 12:00 in Puerto Rico.
+    props = module.parse_and_group_events(
+        now_override=pytz.utc.localize(datetime(2027, 5, 1, 16, 0)), cache_file=str(tmp_path / "cache.json"),
+    )
+    assert [ev["uid"] for ev in props["Apartment AYA"]] == ["74699662@freetobook.com"]
+
+    window_start, window_end = module.requested_window(
+        {"from": "2027-05-09", "to": "2027-05-10"}, tz=module.unit_timezone("Apartment AYA"),
+    )
+    assert window_start == pytz.timezone("Asia/Tokyo").localize(datetime(2027, 5, 9))
+    assert [ev["uid"] for ev in module.Snapshot(props).unit_index("Apartment AYA").window(window_start, window_end)] == [
+        "74699662@freetobook.com",
+    ]
+
+    # Tokyo's 23:00 check-out on 9 May comes before Puerto Rico's 11:00 one, though its ISO string sorts after.
+    turnovers = module.compute_turnovers(props)
+    assert [t["unit"] for t in turnovers] == ["Apartment AYA", "Apartment RYO"]
+    assert turnovers[0]["check_out"] > turnovers[1]["check_out"]
+
+
+def test_publishing_removes_feeds_of_gone_and_unrenderable_units(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    monkeypatch.setattr(module.requests, "get", lambda url, **kwargs: DummyResponse(MULTI_UNIT_BOOKING_SAMPLE))
+    props = module.parse_and_group_events(
+        now_override=tz.localize(datetime(2026, 4, 17, 12, 0, 0)), cache_file=str(tmp_path / "cache.json"),
+    )
+    publish_dir = tmp_path / "published"
+    publish_dir.mkdir()
+    for name in ("old-unit.ics", "old-unit.ics.gz", "notes.txt"):
+        (publish_dir / name).write_bytes(b"stale")
+
+    snapshot = module.Snapshot(props)
+    module.publish_snapshot(snapshot, str(publish_dir))
+    assert not (publish_dir / "old-unit.ics").exists() and not (publish_dir / "old-unit.ics.gz").exists()
+    assert (publish_dir / "notes.txt").exists(), "Only feed files are cleaned up"
+    assert (publish_dir / "apartment-ryo.ics").exists()
+
+    render = module.render_property_calendar
+
+    def failing_render(key, *args, **kwargs):
+        if key == "Apartment RYO":
+            raise ValueError("broken")
+        return render(key, *args, **kwargs)
+
+    monkeypatch.setattr(module, "render_property_calendar", failing_render)
+    module.publish_snapshot(snapshot, str(publish_dir))
+    assert not (publish_dir / "apartment-ryo.ics").exists(), "A unit that cannot be rendered is not served stale"
+    assert not (publish_dir / "apartment-ryo.ics.gz").exists()
+    assert (publish_dir / "apartment-aya.ics").exists()
+
+
+def test_history_keeps_every_version_and_departed_stays(monkeypatch, tmp_path):
+    module = load_module()
+    tz = pytz.timezone(module.TIMEZONE)
+    history_dir = tmp_path / "history"
+    cache_file = tmp_path / "cache.json"
+    monkeypatch.setattr(module, "HISTORY_DIR", str(history_dir))
+
+    stay = ("74699664@freetobook.com", "20250101T000000Z", "Apartment RYO:WTB19BCD37", "20250115", "20250118")
+    rebooked = stay[:1] + ("20250111T000000Z",) + stay[2:]
+    later = ("74699663@freetobook.com", "20250111T000000Z", "Apartment AYA:WTB2", "20250301", "20250303")
+    steps = [
+        (datetime(2025, 1, 10, 12), booking_feed(stay)),
+        (datetime(2025, 1, 12, 12), booking_feed(rebooked, later)),
+        (datetime(2025, 2, 20, 12), booking_feed()),
+    ]
+    for now, feed in steps:
+        monkeypatch.setattr(module.requests, "get", lambda url, feed=feed, **kwargs: DummyResponse(feed))
+        module.parse_and_group_events(now_override=tz.localize(now), cache_file=str(cache_file))
+
+    assert json.loads(cache_file.read_text()) == {unit: [] for unit in module.KNOWN_PROPERTIES}
+    assert sorted(p.name for p in history_dir.iterdir()) == ["2025-01.jsonl.gz", "2025-02.jsonl", "index.json"]
+    index = json.loads((history_dir / "index.json").read_text())
+    assert index["2025-01"]["records"] == 3
+    assert set(index["2025-01"]["units"]) == {"Apartment RYO", "Apartment AYA"}
+
+    history = module.ReservationHistory(str(history_dir))
+    ryo = history.query("Apartment RYO")
+    assert [(r["state"], r["version"]) for r in ryo] == [("booked", 1), ("booked", 2), ("ended", 2)]
+    aya = history.query("Apartment AYA", start=tz.localize(datetime(2025, 2, 1)))
+    assert [r["state"] for r in aya] == ["booked", "cancelled"]
+    assert history.query(start=tz.localize(datetime(2025, 4, 1))) == []
+
+    with module.app.test_client() as client:
+        response = client.get("/history.json?unit=apartment-ryo&from=2025-01-01&to=2025-02-01")
+        assert response.status_code == 200
+        assert response.get_json()["count"] == 3
+        assert client.get("/history.json?from=soon").status_code == 400